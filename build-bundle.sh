@@ -21,6 +21,7 @@ mv chrome-linux rechnungs-assistent-bundle/chromium
 # Copy relevant files to zip
 cp -r src/build/linux/x64/release/bundle/* rechnungs-assistent-bundle
 cp src/generator-html.py rechnungs-assistent-bundle
+cp -r src/generator rechnungs-assistent-bundle
 cp -r src/html rechnungs-assistent-bundle
 cp deb/usr/bin/rechnungs-assistent rechnungs-assistent-bundle/rechnungs-assistent.sh
 cp rechnungs-assistent.png rechnungs-assistent-bundle/
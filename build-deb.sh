@@ -11,6 +11,7 @@ cp version src/build/linux/x64/release/bundle/
 mkdir -p deb/usr/lib/rechnungs-assistent/
 cp -r src/build/linux/x64/release/bundle/* deb/usr/lib/rechnungs-assistent/
 cp src/generator-html.py deb/usr/lib/rechnungs-assistent/
+cp -r src/generator deb/usr/lib/rechnungs-assistent/
 cp -r src/html deb/usr/lib/rechnungs-assistent/
 
 # mkdir -p deb/usr/share/icons/hicolor/scalable/apps/
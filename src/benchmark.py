@@ -0,0 +1,348 @@
+# Benchmark of the generator: generates synthetic invoices with html/invoice.html and
+# html/template.csv.example in a temporary home and measures every stage (see generator.metrics).
+# The results are appended as json lines with the commit they were measured on, so two commits
+# can be compared: python3 benchmark.py --compare <commit> [<commit>]
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from generator.batch import generate_batch_sequential
+from generator.generate import generate_invoice
+from generator.metrics import StageStatistics
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+repository_dir = os.path.dirname(current_dir)
+entry_path = f"{current_dir}/generator-html.py"
+
+
+# name, line items per invoice, invoices
+scenarios = [
+    ("lines-1", 1, 1),
+    ("lines-100", 100, 1),
+    ("lines-10000", 10000, 1),
+    ("batch-1", 3, 1),
+    ("batch-1000", 3, 1000),
+    ("batch-10000", 3, 10000),
+]
+# Left out by --quick
+slow_scenarios = ("lines-10000", "batch-10000")
+# A chromium printing 10000 pdfs takes too long for a benchmark
+chromium_skipped_scenarios = ("batch-10000",)
+
+renderer_names = ("stub", "none", "native", "chromium", "pool")
+
+
+# Prints the pdf without a browser: the html is copied as it is. Measures everything around
+# chromium, so the benchmark runs offline and the numbers don't depend on the chromium version.
+class StubRenderer:
+    def print_pdf(self, html_path, pdf_path):
+        shutil.copyfile(html_path, pdf_path)
+
+    def close(self):
+        pass
+
+
+def is_chromium_available():
+    from generator.chromium import get_chromium_exec
+    chromium_exec = get_chromium_exec(current_dir)
+    return os.path.exists(chromium_exec) or shutil.which(chromium_exec) != None
+
+
+def get_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repository_dir, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository_dir, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, changes.strip() != ""
+
+
+# The same invoices on every run: the line items only depend on their position
+def create_articles(count):
+    articles = []
+    for i in range(1, count + 1):
+        articles.append(f"Artikel {i};{i % 97 + 0.5:.2f};{i % 5 + 1};Leistung Nummer {i} laut Vereinbarung")
+    return articles
+
+
+def create_customer(i):
+    return {
+        "customerCompany": f"Firma {i} GmbH",
+        "customerName": f"Erika Musterfrau {i}",
+        "customerStreet": f"Hauptstr. {i % 200 + 1}",
+        "customerZIP": f"{10000 + i % 89999}",
+        "customerCity": "Musterstadt",
+    }
+
+
+# A home with the example template in the config dir, like after the first start
+def create_home(home):
+    directories = {
+        "home": home,
+        "cache_dir": f"{home}/.cache/rechnungs-assistent/",
+        "config_dir": f"{home}/.config/rechnungs-assistent/",
+        "current_dir": current_dir,
+    }
+    os.makedirs(directories["cache_dir"])
+    os.makedirs(directories["config_dir"])
+    shutil.copyfile(f"{current_dir}/html/template.csv.example", f'{directories["config_dir"]}/template.csv')
+    shutil.copyfile(f"{current_dir}/html/logo.png", f'{directories["config_dir"]}/logo.png')
+    return directories
+
+
+def create_args(directories, renderer, arguments=()):
+    parser = runpy.run_path(entry_path)["create_parser"](directories)
+    output = "xml" if renderer == "none" else "pdf,xml"
+    # The stub takes the place of chromium. Every invoice is printed, the render cache would only hide it.
+    args = parser.parse_args([
+        "--renderer", "chromium" if renderer == "stub" else renderer,
+        "--output", output,
+        "--renderCacheSize", "0",
+        "--invoiceDir", f'{directories["home"]}/Dokumente/Rechnungen/',
+        "--serviceDate", "01.01.2024",
+    ] + list(arguments))
+    return args
+
+
+def create_resources(renderer):
+    if renderer == "stub":
+        return {"renderer": StubRenderer()}
+    return {}
+
+
+# Generates the invoice of the scenario again and again until min_seconds are over
+def run_lines_scenario(directories, renderer, line_count, min_seconds, max_runs):
+    args = create_args(directories, renderer)
+    params = vars(args)
+    params.update(create_customer(1))
+    params["article"] = create_articles(line_count)
+    resources = create_resources(renderer)
+    statistics = StageStatistics()
+    count = 0
+    start_time = time.perf_counter()
+    try:
+        while count < max_runs and (count < 3 or time.perf_counter() - start_time < min_seconds):
+            result = generate_invoice(dict(params), resources, directories)
+            statistics.add(result["timings"])
+            count += 1
+    finally:
+        if resources.get("renderer") != None:
+            resources["renderer"].close()
+    return count, 0, time.perf_counter() - start_time, statistics
+
+
+def run_batch_scenario(directories, renderer, line_count, invoice_count):
+    manifest_path = f'{directories["home"]}/batch.jsonl'
+    with open(manifest_path, "w") as f:
+        for i in range(1, invoice_count + 1):
+            row = create_customer(i)
+            row["article"] = create_articles(line_count)
+            f.write(json.dumps(row) + "\n")
+    args = create_args(directories, renderer, ["--batch", manifest_path])
+    resources = create_resources(renderer)
+    statistics = StageStatistics()
+    count = 0
+    failed = 0
+    start_time = time.perf_counter()
+    try:
+        for row_number, result, error in generate_batch_sequential(args, resources, directories):
+            count += 1
+            if error != None:
+                failed += 1
+                print(f"Error in row {row_number}: {error}", file=sys.stderr)
+            else:
+                statistics.add(result["timings"])
+    finally:
+        if resources.get("renderer") != None:
+            resources["renderer"].close()
+    return count, failed, time.perf_counter() - start_time, statistics
+
+
+# Seconds from starting python until the generator exits: --help and an xml-only dry run
+def run_startup_scenario(home, runs):
+    env = dict(os.environ, HOME=home)
+    statistics = StageStatistics()
+    for name, arguments in (("help", ["--help"]), ("dryRun", ["--dryRun", "--renderer", "none", "--output", "xml"])):
+        for i in range(runs):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable, entry_path] + arguments, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            statistics.add({name: round(time.perf_counter() - start_time, 6)})
+    return statistics
+
+
+def get_runs(args, renderers):
+    selected = [name.strip() for name in args.scenario.split(",")] if args.scenario != "" else None
+    runs = []
+    if selected == None or "startup" in selected:
+        runs.append(("startup", "none", 0, 0))
+    for name, line_count, invoice_count in scenarios:
+        if selected != None and name not in selected:
+            continue
+        if selected == None and args.quick and name in slow_scenarios:
+            continue
+        for renderer in renderers:
+            if selected == None and renderer in ("chromium", "pool") and name in chromium_skipped_scenarios:
+                continue
+            runs.append((name, renderer, line_count, invoice_count))
+    return runs
+
+
+def run_scenario(args, directories, name, renderer, line_count, invoice_count):
+    if name == "startup":
+        start_time = time.perf_counter()
+        statistics = run_startup_scenario(directories["home"], 3 if args.quick else 10)
+        return 0, 0, time.perf_counter() - start_time, statistics.get_summary(("help", "dryRun"))
+    # The generator prints every step, only the table is of interest
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if name.startswith("lines-"):
+            count, failed, seconds, statistics = run_lines_scenario(directories, renderer, line_count, float(args.seconds), int(args.maxRuns))
+        else:
+            count, failed, seconds, statistics = run_batch_scenario(directories, renderer, line_count, invoice_count)
+    return count, failed, seconds, statistics.get_summary()
+
+
+def run_benchmark(args):
+    renderers = [name.strip() for name in args.renderer.split(",") if name.strip() != ""]
+    for renderer in renderers:
+        if renderer not in renderer_names:
+            print(f'Error: Unknown renderer: "{renderer}". Use: {", ".join(renderer_names)}')
+            sys.exit(1)
+    commit, dirty = get_commit()
+    record_base = {
+        "type": "benchmark",
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+
+    print(f'Benchmark of {commit}{" with uncommitted changes" if dirty else ""}')
+    print_header()
+    records = []
+    for name, renderer, line_count, invoice_count in get_runs(args, renderers):
+        home = tempfile.mkdtemp(prefix="rechnungs-assistent-benchmark-")
+        try:
+            directories = create_home(home)
+            count, failed, seconds, stages = run_scenario(args, directories, name, renderer, line_count, invoice_count)
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+        record = dict(record_base, scenario=name, renderer=renderer, lines=line_count, invoices=count, failed=failed)
+        record["seconds"] = round(seconds, 6)
+        record["invoicesPerSecond"] = round(count / seconds if seconds > 0 else 0, 2)
+        record["stages"] = stages
+        records.append(record)
+        print_record(record)
+
+    if args.results != "":
+        with open(args.results, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print(f"Results appended to {args.results}")
+
+
+def print_header():
+    print(f'{"scenario":<14}{"renderer":<10}{"invoices":>9}{"seconds":>9}{"inv/s":>9}{"p50 ms":>10}{"p99 ms":>10}  slowest stage')
+
+
+def print_record(record):
+    stages = record["stages"]
+    if record["scenario"] == "startup":
+        # Every start is one python process, there are no stages
+        for name, summary in stages.items():
+            print(f'{"startup-" + name:<14}{"":<10}{summary["count"]:>9}{summary["sum"]:>9.2f}{"":>9}{summary["p50"] * 1000:>10.1f}{summary["p99"] * 1000:>10.1f}')
+        return
+    total = stages.get("total", {"sum": 0, "p50": 0, "p99": 0})
+    slowest = ""
+    stage_sums = [(summary["sum"], stage) for stage, summary in stages.items() if stage != "total"]
+    if len(stage_sums) > 0 and total["sum"] > 0:
+        seconds, stage = max(stage_sums)
+        slowest = f'{stage} ({seconds / total["sum"] * 100:.0f} %)'
+    if record["failed"] > 0:
+        slowest += f', {record["failed"]} failed'
+    print(f'{record["scenario"]:<14}{record["renderer"]:<10}{record["invoices"]:>9}{record["seconds"]:>9.2f}{record["invoicesPerSecond"]:>9.1f}{total["p50"] * 1000:>10.2f}{total["p99"] * 1000:>10.2f}  {slowest}')
+
+
+def read_results(results_path):
+    records = []
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() != "":
+                records.append(json.loads(line))
+    return records
+
+
+# The p50 of every stage of two commits side by side. The last run of a commit counts.
+# Without a second commit the last one measured is compared to the first.
+def compare_results(args):
+    if not os.path.exists(args.results):
+        print(f'Error: No results in "{args.results}", run the benchmark first')
+        sys.exit(1)
+    records = [record for record in read_results(args.results) if record.get("type") == "benchmark"]
+    commits = args.compare
+    if len(commits) == 1:
+        if len(records) == 0:
+            print(f'Error: No results in "{args.results}", run the benchmark first')
+            sys.exit(1)
+        commits = [commits[0], records[-1]["commit"]]
+    runs = []
+    for commit in commits:
+        latest = {}
+        for record in records:
+            if record["commit"].startswith(commit) or commit.startswith(record["commit"]):
+                latest[(record["scenario"], record["renderer"])] = record
+        if len(latest) == 0:
+            print(f'Error: No results of commit "{commit}" in "{args.results}"')
+            sys.exit(1)
+        runs.append(latest)
+
+    old_runs, new_runs = runs
+    print(f'{"scenario":<14}{"renderer":<10}{"stage":<10}{commits[0][:10]:>12}{commits[1][:10]:>12}{"change":>9}')
+    for key, new_record in new_runs.items():
+        if key not in old_runs:
+            continue
+        old_stages = old_runs[key]["stages"]
+        for stage, summary in new_record["stages"].items():
+            if stage not in old_stages:
+                continue
+            old_seconds = old_stages[stage]["p50"]
+            new_seconds = summary["p50"]
+            change = f"{(new_seconds - old_seconds) / old_seconds * 100:+.0f} %" if old_seconds > 0 else ""
+            print(f"{key[0]:<14}{key[1]:<10}{stage:<10}{old_seconds * 1000:>10.2f}ms{new_seconds * 1000:>10.2f}ms{change:>9}")
+
+
+def main():
+    default_renderers = "stub,none,native"
+    if is_chromium_available():
+        default_renderers += ",pool"
+
+    parser = argparse.ArgumentParser(description="Benchmark of the invoice generator with synthetic invoices. Prints a table and appends the results as json lines to --results.")
+    parser.add_argument("--scenario", help=f'Comma separated scenarios: startup, {", ".join(name for name, lines, invoices in scenarios)}. lines-<n> is one invoice with n line items, batch-<n> is a --batch of n invoices. Default: all', default="")
+    parser.add_argument("--renderer", help=f'Comma separated renderers: stub (copies the html instead of printing it), none (xml only), native, chromium, pool. Default: {default_renderers}', default=default_renderers)
+    parser.add_argument("--quick", help=f'Leave out {" and ".join(slow_scenarios)}', action="store_true")
+    parser.add_argument("--seconds", help="Seconds a lines-<n> scenario generates its invoice again and again. Default: 2", default="2")
+    parser.add_argument("--maxRuns", help="Most invoices of a lines-<n> scenario. Default: 500", default="500")
+    parser.add_argument("--results", help='The json lines file the results are appended to, "" to keep them. Default: benchmark-results.jsonl next to src', default=f"{repository_dir}/benchmark-results.jsonl")
+    parser.add_argument("--compare", nargs="+", help="Compare the results of two commits instead of running the benchmark. With one commit it is compared to the last one measured.")
+    args = parser.parse_args()
+
+    if args.compare != None:
+        if len(args.compare) > 2:
+            print("Error: --compare takes one or two commits")
+            sys.exit(1)
+        compare_results(args)
+        return
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
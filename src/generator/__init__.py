@@ -0,0 +1,2 @@
+# The invoice generator behind generator-html.py. The modules import only what they need
+# themselves, so importing one of them never loads the others without a reason.
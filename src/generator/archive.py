@@ -0,0 +1,349 @@
+# INVOICE ARCHIVE
+# Every saved invoice is added to data/archive.sqlite of the invoice dir when it is committed:
+# number, date, customer, totals and the VAT per rate. Looking up an invoice and the revenue per
+# month, customer or VAT rate use the indexed tables, the xml files are not read again.
+# --reindexArchive adds the Rechnung-*.xml files that were saved before (or by other tools).
+import os
+import contextlib
+import decimal
+import re
+import sqlite3
+import time
+
+from .invoice import round_money
+
+
+# Stored in the database once its tables exist
+archive_version = 1
+
+# Columns of an invoice, in the order --findInvoice prints them
+archive_columns = ("number", "date", "customer", "netto", "vat", "brutto", "currency", "pdfPath", "xmlPath")
+
+# The namespaces of the ZUGFeRD xml, see zugferd.write_invoice_xml()
+xml_namespaces = {
+    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
+    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
+    "udt": "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100",
+}
+
+
+# Amounts are stored in cents, so the sums are exact
+def to_cents(value):
+    return int(round_money(value) * 100)
+
+
+def format_cents(cents):
+    return str(decimal.Decimal(cents).scaleb(-2))
+
+
+# mtime and size of the xml, --reindexArchive only reads the files whose stamp changed
+def get_file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+# The paths are stored normalized, so --reindexArchive finds them whatever way the
+# invoice dir was written (the default ends with a /)
+def normalize_path(path):
+    return os.path.normpath(path) if path != "" else ""
+
+
+# The entry of a committed invoice, taken from the Invoice instead of its xml.
+# result is the result of generate_invoice_files() with the paths of the saved documents.
+def get_archive_entry(invoice, result):
+    return {
+        "number": invoice.number,
+        "date": invoice.date.strftime("%Y-%m-%d"),
+        # The buyer name of the xml
+        "customer": (invoice.customer["customerCompany"] + " " + invoice.customer["customerName"]).strip(),
+        "netto": to_cents(invoice.sum_netto),
+        "vat": to_cents(invoice.vat_sum),
+        "brutto": to_cents(invoice.sum_brutto),
+        "currency": invoice.currency_code,
+        "pdfPath": normalize_path(result["invoicePath"]),
+        "xmlPath": normalize_path(result["xmlPath"]),
+        "stamp": get_file_stamp(result["xmlPath"]) if result["xmlPath"] != "" else "",
+        "vatGroups": [(str(round_money(group.vat)), to_cents(group.basis), to_cents(group.tax)) for group in invoice.vat_groups],
+    }
+
+
+# The entry of a saved xml, for invoices that were not added when they were committed
+def read_archive_entry(xml_path):
+    # Imported here, only --reindexArchive parses xml
+    import xml.etree.ElementTree as ElementTree
+    stamp = get_file_stamp(xml_path)
+    root = ElementTree.parse(xml_path).getroot()
+
+    def get_text(element, path):
+        found = element.find(path, xml_namespaces)
+        if found == None or found.text == None:
+            return ""
+        return found.text.strip()
+
+    settlement = root.find("rsm:SupplyChainTradeTransaction/ram:ApplicableHeaderTradeSettlement", xml_namespaces)
+    if settlement == None:
+        raise ValueError("not an invoice xml")
+    summation = settlement.find("ram:SpecifiedTradeSettlementHeaderMonetarySummation", xml_namespaces)
+    date = get_text(root, "rsm:ExchangedDocument/ram:IssueDateTime/udt:DateTimeString")
+    if not re.match(r"^\d{8}$", date):
+        raise ValueError(f'invalid date "{date}"')
+    pdf_path = xml_path[:-len(".xml")] + ".pdf"
+    return {
+        "number": get_text(root, "rsm:ExchangedDocument/ram:ID"),
+        "date": f"{date[0:4]}-{date[4:6]}-{date[6:8]}",
+        "customer": get_text(root, "rsm:SupplyChainTradeTransaction/ram:ApplicableHeaderTradeAgreement/ram:BuyerTradeParty/ram:Name"),
+        "netto": to_cents(get_text(summation, "ram:TaxBasisTotalAmount")),
+        "vat": to_cents(get_text(summation, "ram:TaxTotalAmount")),
+        "brutto": to_cents(get_text(summation, "ram:GrandTotalAmount")),
+        "currency": get_text(settlement, "ram:InvoiceCurrencyCode"),
+        "pdfPath": pdf_path if os.path.exists(pdf_path) else "",
+        "xmlPath": xml_path,
+        "stamp": stamp,
+        "vatGroups": [
+            (str(round_money(get_text(tax, "ram:RateApplicablePercent"))), to_cents(get_text(tax, "ram:BasisAmount")), to_cents(get_text(tax, "ram:CalculatedAmount")))
+            for tax in settlement.findall("ram:ApplicableTradeTax", xml_namespaces)
+        ],
+    }
+
+
+# The sums of the invoices, kept up to date with every invoice that is added or replaced, so
+# the revenue queries read a few rows per month instead of all the invoices.
+# table -> (key columns, sum columns). count is the number of invoices in the row.
+revenue_tables = {
+    "revenue_month": (("month", "currency"), ("count", "netto", "vat", "brutto")),
+    "revenue_customer": (("customer", "currency"), ("count", "netto", "vat", "brutto")),
+    "revenue_year_customer": (("year", "customer", "currency"), ("count", "netto", "vat", "brutto")),
+    "revenue_month_customer": (("month", "customer", "currency"), ("count", "netto", "vat", "brutto")),
+    "revenue_vat": (("month", "rate", "currency"), ("count", "basis", "tax")),
+}
+
+
+class InvoiceArchive:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        # Transactions are started explicitly, see transaction()
+        self.connection = sqlite3.connect(f"{data_dir}/archive.sqlite", timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Adding an invoice doesn't wait for the disk. A power loss can only cost the last
+        # invoices, which --reindexArchive adds again.
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # The tables are only created once, every generated invoice opens the archive
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != archive_version:
+            self.create_tables()
+
+    def create_tables(self):
+        with self.transaction():
+            # NOCASE lets LIKE 'abc%' use the indexes
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS invoices (number TEXT PRIMARY KEY COLLATE NOCASE, date TEXT NOT NULL,"
+                " month TEXT NOT NULL, customer TEXT NOT NULL COLLATE NOCASE, netto INTEGER NOT NULL,"
+                " vat INTEGER NOT NULL, brutto INTEGER NOT NULL, currency TEXT NOT NULL,"
+                " pdfPath TEXT NOT NULL, xmlPath TEXT NOT NULL, stamp TEXT NOT NULL)")
+            # The indexes hold the columns search() sorts by, so it doesn't read the rows
+            self.connection.execute("CREATE INDEX IF NOT EXISTS invoices_number ON invoices (number, date)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS invoices_customer ON invoices (customer, date, number)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date, number, customer)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS invoice_vat (number TEXT NOT NULL COLLATE NOCASE, rate TEXT NOT NULL,"
+                " basis INTEGER NOT NULL, tax INTEGER NOT NULL, PRIMARY KEY (number, rate))")
+            for table, (key_columns, sum_columns) in revenue_tables.items():
+                # Without rowid the rows are stored in the order of the key, a year or a month is one range
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{column} TEXT NOT NULL' for column in key_columns)},"
+                    f" {', '.join(f'{column} INTEGER NOT NULL' for column in sum_columns)},"
+                    f" PRIMARY KEY ({', '.join(key_columns)})) WITHOUT ROWID")
+            self.connection.execute(f"PRAGMA user_version = {archive_version}")
+
+    def close(self):
+        self.connection.close()
+
+    # Only one process writes at a time, the others wait (up to the timeout)
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    # Adds values to the sums of the row key of a revenue table. Negative values take an
+    # invoice out again, rows without invoices are removed.
+    def add_to_revenue(self, table, key, values):
+        key_columns, sum_columns = revenue_tables[table]
+        condition = " AND ".join(f"{column} = ?" for column in key_columns)
+        self.connection.execute(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(key_columns + sum_columns)})"
+            f" VALUES ({', '.join('?' * len(key_columns))}, {', '.join('0' * len(sum_columns))})", key)
+        self.connection.execute(
+            f"UPDATE {table} SET {', '.join(f'{column} = {column} + ?' for column in sum_columns)} WHERE {condition}",
+            tuple(values) + tuple(key))
+        if values[0] < 0:
+            self.connection.execute(f"DELETE FROM {table} WHERE {condition} AND count = 0", key)
+
+    # Adds the invoice to the revenue tables, sign -1 takes it out again
+    def update_revenue(self, month, customer, currency, netto, vat, brutto, vat_groups, sign):
+        sums = (sign, sign * netto, sign * vat, sign * brutto)
+        self.add_to_revenue("revenue_month", (month, currency), sums)
+        self.add_to_revenue("revenue_customer", (customer, currency), sums)
+        self.add_to_revenue("revenue_year_customer", (month[:4], customer, currency), sums)
+        self.add_to_revenue("revenue_month_customer", (month, customer, currency), sums)
+        for rate, basis, tax in vat_groups:
+            self.add_to_revenue("revenue_vat", (month, rate, currency), (sign, sign * basis, sign * tax))
+
+    # Call only inside a transaction()
+    def remove_invoice(self, number):
+        row = self.connection.execute(
+            "SELECT month, customer, currency, netto, vat, brutto FROM invoices WHERE number = ?", (number,)).fetchone()
+        if row == None:
+            return
+        vat_groups = self.connection.execute("SELECT rate, basis, tax FROM invoice_vat WHERE number = ?", (number,)).fetchall()
+        self.update_revenue(*row, vat_groups, -1)
+        self.connection.execute("DELETE FROM invoices WHERE number = ?", (number,))
+        self.connection.execute("DELETE FROM invoice_vat WHERE number = ?", (number,))
+
+    # Adds the entries of get_archive_entry() or read_archive_entry() in one transaction.
+    # An invoice saved again under the same number replaces the old entry.
+    def add_invoices(self, entries):
+        with self.transaction():
+            for entry in entries:
+                self.remove_invoice(entry["number"])
+                month = entry["date"][:7]
+                self.connection.execute(
+                    "INSERT INTO invoices (number, date, month, customer, netto, vat, brutto, currency, pdfPath, xmlPath, stamp)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry["number"], entry["date"], month, entry["customer"], entry["netto"], entry["vat"], entry["brutto"],
+                        entry["currency"], entry["pdfPath"], entry["xmlPath"], entry["stamp"]))
+                self.connection.executemany(
+                    "INSERT INTO invoice_vat (number, rate, basis, tax) VALUES (?, ?, ?, ?)",
+                    [(entry["number"],) + tuple(group) for group in entry["vatGroups"]])
+                self.update_revenue(month, entry["customer"], entry["currency"], entry["netto"], entry["vat"],
+                    entry["brutto"], entry["vatGroups"], 1)
+
+    # Adds the Rechnung-*.xml files of invoice_dir/<year>/<month> that are new or changed since
+    # they were added and removes the invoices whose pdf and xml are both gone.
+    # Returns numbers about the run.
+    def reindex(self, invoice_dir, block_size=500):
+        start_time = time.monotonic()
+        invoice_dir = normalize_path(invoice_dir)
+        stamps = {xml_path: stamp for xml_path, stamp in self.connection.execute("SELECT xmlPath, stamp FROM invoices WHERE xmlPath != ''")}
+        found = set()
+        entries = []
+        added = 0
+        errors = []
+        for year in sorted(os.listdir(invoice_dir)):
+            if not re.match(r"^\d{4}$", year) or not os.path.isdir(f"{invoice_dir}/{year}"):
+                continue
+            for month in sorted(os.listdir(f"{invoice_dir}/{year}")):
+                month_dir = f"{invoice_dir}/{year}/{month}"
+                if not re.match(r"^\d{2}$", month) or not os.path.isdir(month_dir):
+                    continue
+                for file in sorted(os.listdir(month_dir)):
+                    if not re.match(r"^Rechnung-.+\.xml$", file):
+                        continue
+                    xml_path = f"{month_dir}/{file}"
+                    found.add(xml_path)
+                    if stamps.get(xml_path) == get_file_stamp(xml_path):
+                        continue
+                    try:
+                        entries.append(read_archive_entry(xml_path))
+                    except Exception as e:
+                        errors.append(f"{xml_path}: {e}")
+                        continue
+                    if len(entries) >= block_size:
+                        self.add_invoices(entries)
+                        added += len(entries)
+                        entries = []
+        self.add_invoices(entries)
+        added += len(entries)
+
+        removed = 0
+        with self.transaction():
+            for number, pdf_path, xml_path in self.connection.execute("SELECT number, pdfPath, xmlPath FROM invoices").fetchall():
+                if xml_path in found or (xml_path != "" and os.path.exists(xml_path)) or (pdf_path != "" and os.path.exists(pdf_path)):
+                    continue
+                self.remove_invoice(number)
+                removed += 1
+        return {
+            "files": len(found),
+            "added": added,
+            "removed": removed,
+            "errors": errors,
+            "seconds": time.monotonic() - start_time,
+        }
+
+    # Invoices whose number or customer starts with text (ignoring case), the newest first.
+    # A few matches are found with the indexes of number and customer and then sorted. Sorting
+    # many matches (e.g. "2" matches every invoice) would take longer than reading the date
+    # index from the newest invoice on until there are enough.
+    def search(self, text, limit=50):
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        condition = "number LIKE ? ESCAPE '\\' OR customer LIKE ? ESCAPE '\\'"
+        matches = self.connection.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM invoices WHERE {condition} LIMIT 10000)", (pattern, pattern)).fetchone()[0]
+        index = "INDEXED BY invoices_date" if matches >= 10000 else ""
+        rows = self.connection.execute(
+            f"SELECT {', '.join(archive_columns)} FROM invoices WHERE rowid IN"
+            f" (SELECT rowid FROM invoices {index} WHERE {condition} ORDER BY date DESC, number DESC LIMIT ?)"
+            " ORDER BY date DESC, number DESC", (pattern, pattern, int(limit)))
+        return [dict(zip(archive_columns, row)) for row in rows]
+
+    # Sums of the invoices grouped by "month", "customer" or "vat" (month and rate).
+    # period restricts them to a year (YYYY) or a month (YYYY-MM).
+    # Every row is a dict with the group columns, count and the sums in cents.
+    def get_revenue(self, group, period=""):
+        if period != "" and not re.match(r"^\d{4}(-\d{2})?$", period):
+            raise ValueError(f'Not a year or a month (YYYY or YYYY-MM): "{period}"')
+        condition = ""
+        parameters = ()
+        if len(period) == 4:
+            condition = "WHERE month BETWEEN ? AND ?"
+            parameters = (period + "-01", period + "-12")
+        elif period != "":
+            condition = "WHERE month = ?"
+            parameters = (period,)
+        if group == "month":
+            columns = ("month", "currency", "count", "netto", "vat", "brutto")
+            query = f"SELECT {', '.join(columns)} FROM revenue_month {condition} ORDER BY month, currency"
+        elif group == "customer":
+            columns = ("customer", "currency", "count", "netto", "vat", "brutto")
+            if period == "":
+                table = "revenue_customer"
+            elif len(period) == 4:
+                table, condition, parameters = "revenue_year_customer", "WHERE year = ?", (period,)
+            else:
+                table = "revenue_month_customer"
+            query = (f"SELECT customer, currency, SUM(count), SUM(netto), SUM(vat), SUM(brutto) FROM {table} {condition}"
+                " GROUP BY customer, currency ORDER BY SUM(brutto) DESC, customer")
+        elif group == "vat":
+            columns = ("month", "rate", "currency", "count", "basis", "tax")
+            query = f"SELECT {', '.join(columns)} FROM revenue_vat {condition} ORDER BY month, CAST(rate AS REAL), currency"
+        else:
+            raise ValueError(f'Unknown revenue group: "{group}"')
+        return [dict(zip(columns, row)) for row in self.connection.execute(query, parameters)]
+
+
+def open_invoice_archive(invoice_dir):
+    return InvoiceArchive(os.path.join(invoice_dir, "data"))
+
+
+# Adds invoices right after they were committed. entries_by_invoice_dir: invoice dir -> entries.
+# The invoices are saved already, so a failing archive only costs a warning, --reindexArchive
+# adds them later.
+def archive_invoices(entries_by_invoice_dir):
+    for invoice_dir, entries in entries_by_invoice_dir.items():
+        if len(entries) == 0:
+            continue
+        try:
+            archive = open_invoice_archive(invoice_dir)
+            try:
+                archive.add_invoices(entries)
+            finally:
+                archive.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not add {len(entries)} invoice(s) to the archive ({e}). --reindexArchive adds them later.")
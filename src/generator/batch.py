@@ -0,0 +1,406 @@
+# --batch: many invoices from one manifest
+import csv
+import base64
+import collections
+import itertools
+import json
+import time
+import multiprocessing.util
+import concurrent.futures
+
+from .util import InvoiceError, argkeys_customer
+from .invoice import parse_articles, parse_discounts, parse_payment_days
+from .numbering import allocate_invoice_numbers, commit_invoice_number, get_invoice_dir, release_invoice_numbers
+from .data import resolve_data_ids
+from .archive import archive_invoices
+from .generate import generate_invoice, print_result_paths
+from .metrics import StageStatistics, get_invoice_record, open_metrics
+
+
+# Reads the manifest of a batch run and yields one dict per invoice.
+# .jsonl: one json object per line, "article" and "discount" are a string or a list of strings.
+# .csv: comma separated with a header row, the "article", "articleId" and "discount" columns may
+# appear multiple times. Empty cells count as missing values.
+def read_batch_manifest(manifest_path):
+    if manifest_path.endswith(".jsonl"):
+        with open(manifest_path, "r") as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    # Only this row fails, see prepare_batch_rows()
+                    yield InvoiceError(f"Invalid json: {e}")
+    else:
+        with open(manifest_path, "r", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            for values in reader:
+                if len(values) == 0:
+                    continue
+                row = {}
+                for key, value in zip(header, values):
+                    key = key.strip()
+                    if value == "":
+                        continue
+                    # These columns can be repeated
+                    if key in list_argkeys:
+                        row.setdefault(key, []).append(value)
+                    else:
+                        row[key] = value
+                yield row
+
+
+# Values of switches like dryRun in a csv cell (or a json string), the others are errors
+boolean_values = {"true": True, "yes": True, "ja": True, "1": True, "false": False, "no": False, "nein": False, "0": False}
+# The arguments that take one or more values
+list_argkeys = ("article", "articleId", "discount")
+
+
+def get_switch_value(key, value):
+    if type(value) == bool:
+        return value
+    if type(value) == str and value.strip().lower() in boolean_values:
+        return boolean_values[value.strip().lower()]
+    raise InvoiceError(f'Wrong format for {key}: {json.dumps(value)}. Use true or false')
+
+
+# Numbers are written as they are, e.g. a zip code in a json row
+def get_text_value(key, value):
+    if type(value) == str:
+        return value
+    if type(value) in (int, float):
+        return str(value)
+    raise InvoiceError(f'Wrong format for {key}: {json.dumps(value)}. Use a text or a number')
+
+
+# The arguments of the command line, overridden by the values of one invoice of a batch or a --serve request.
+# The values get the types the command line gives them: switches are booleans, the arguments with
+# several values lists of texts and all others texts. Missing values (null) keep the value of the
+# command line. Raises an InvoiceError for a value of the wrong type.
+def get_invoice_params(defaults, row):
+    params = dict(defaults)
+    for key, value in row.items():
+        if value == None:
+            continue
+        if type(defaults.get(key)) == bool:
+            params[key] = get_switch_value(key, value)
+        elif key in list_argkeys:
+            params[key] = [get_text_value(key, element) for element in (value if type(value) == list else [value])]
+        else:
+            params[key] = get_text_value(key, value)
+    # A row without company or contact person is fine, the invoice just leaves the line out
+    for key in argkeys_customer:
+        if params.get(key[0]) == None:
+            params[key[0]] = ""
+    return params
+
+
+# Yields (row_number, row) with the values of the manifest, see prepare_batch_rows()
+def read_batch_rows(args):
+    yield from enumerate(read_batch_manifest(args.batch), start=1)
+
+
+# The rows are checked before they are numbered, a row with an error doesn't take a number.
+# Returns (row_number, params, invoice_dir) for the rows that can be generated, invoice_dir is None
+# if the row needs no number (it has its own or is a dry run), and (row_number, None, error) for the others.
+def prepare_batch_rows(rows, defaults, directories):
+    prepared = []
+    errors = []
+    # One data store per data dir for all rows, opening it imports changed csv files
+    stores = {}
+    try:
+        for row_number, row in rows:
+            try:
+                if isinstance(row, InvoiceError):
+                    raise row
+                if type(row) != dict:
+                    raise InvoiceError(f"Wrong format of the row: {json.dumps(row)}. Use a json object")
+                params = get_invoice_params(defaults, row)
+                resolve_data_ids(params, stores)
+                parse_articles(params)
+                parse_discounts(params)
+                parse_payment_days(params)
+            except InvoiceError as e:
+                errors.append((row_number, None, str(e)))
+                continue
+            invoice_dir = None
+            if not params["dryRun"]:
+                # The batch adds the invoices to the archive, see BatchNumbers.commit()
+                params["archiveInvoice"] = False
+            if params["invoiceNumber"] == "" and not params["dryRun"]:
+                invoice_dir = get_invoice_dir(params)
+                # The batch commits the numbers, see BatchNumbers.commit()
+                params["commitNumber"] = False
+            prepared.append((row_number, params, invoice_dir))
+    finally:
+        for store in stores.values():
+            store.close()
+    return prepared, errors
+
+
+# Only the process reading the manifest hands out invoice numbers. They are allocated in
+# blocks, one per invoice dir, and every row takes the smallest number left just before it is
+# generated. A row that fails gives its number back for the next row, and release() gives
+# the numbers no invoice was saved under back to the invoice dir, also when the batch is
+# cancelled. So a batch leaves no gaps between the numbers.
+class BatchNumbers:
+    def __init__(self, directories):
+        self.directories = directories
+        # invoice dir -> numbers left, the smallest first
+        self.free = {}
+        # invoice dir -> numbers taken by rows that are not done yet
+        self.taken = {}
+        # invoice dir -> number of the last saved invoice
+        self.last_numbers = {}
+        # invoice dir (the argument) -> entries for the archive
+        self.archive_entries = {}
+
+    def allocate(self, rows):
+        counts = {}
+        for row_number, params, invoice_dir in rows:
+            if invoice_dir != None:
+                counts[invoice_dir] = counts.get(invoice_dir, 0) + 1
+        for invoice_dir, count in counts.items():
+            count -= len(self.free.get(invoice_dir, []))
+            if count > 0:
+                self.free.setdefault(invoice_dir, []).extend(allocate_invoice_numbers(self.directories, invoice_dir, count))
+
+    def take(self, invoice_dir):
+        number = self.free[invoice_dir].pop(0)
+        self.taken.setdefault(invoice_dir, set()).add(number)
+        return number
+
+    def give_back(self, invoice_dir, number):
+        self.taken[invoice_dir].discard(number)
+        self.free[invoice_dir].append(number)
+        self.free[invoice_dir].sort(key=get_number_sequence)
+
+    # An invoice was saved under the number, result is its result
+    def done(self, params, invoice_dir, result):
+        if invoice_dir != None:
+            self.taken[invoice_dir].discard(params["invoiceNumber"])
+            last_number = self.last_numbers.get(invoice_dir)
+            if last_number == None or get_number_sequence(params["invoiceNumber"]) > get_number_sequence(last_number):
+                self.last_numbers[invoice_dir] = params["invoiceNumber"]
+        # Takes the archive entry out of the result, it is not part of the records
+        archive_entry = result.pop("archiveEntry", None)
+        if archive_entry != None:
+            self.archive_entries.setdefault(params["invoiceDir"], []).append(archive_entry)
+
+    # The numbers of the saved invoices are stored as used in the invoice dir once per block
+    # instead of after every invoice, their archive entries are added in one transaction.
+    def commit(self):
+        for invoice_dir, number in self.last_numbers.items():
+            commit_invoice_number(self.directories, invoice_dir, number)
+        self.last_numbers.clear()
+        archive_invoices(self.archive_entries)
+        self.archive_entries.clear()
+
+    # Call after commit(). Numbers of rows that were interrupted count as unused unless a
+    # document was saved under them.
+    def release(self):
+        for invoice_dir in set(self.free) | set(self.taken):
+            numbers = self.free.get(invoice_dir, []) + list(self.taken.get(invoice_dir, []))
+            if len(numbers) > 0:
+                release_invoice_numbers(self.directories, invoice_dir, numbers)
+        self.free.clear()
+        self.taken.clear()
+
+
+# 2024-05-12 -> 12
+def get_number_sequence(number):
+    return int(number.rsplit("-", 1)[1])
+
+
+# Rows a sequential run checks and numbers at once. Taking the numbers one by one would
+# lock the number files for every invoice, which is slower than writing an xml.
+batch_block_size = 500
+
+
+# Yields (row_number, result, error) for every row of the manifest.
+def generate_batch_sequential(args, resources, directories):
+    rows = read_batch_rows(args)
+    numbers = BatchNumbers(directories)
+    try:
+        while True:
+            block = list(itertools.islice(rows, batch_block_size))
+            if len(block) == 0:
+                return
+            prepared, errors = prepare_batch_rows(block, vars(args), directories)
+            yield from errors
+            numbers.allocate(prepared)
+            try:
+                for row_number, params, invoice_dir in prepared:
+                    if invoice_dir != None:
+                        params["invoiceNumber"] = numbers.take(invoice_dir)
+                    try:
+                        result = generate_invoice(params, resources, directories)
+                    except Exception as e:
+                        if invoice_dir != None:
+                            numbers.give_back(invoice_dir, params["invoiceNumber"])
+                        yield row_number, None, str(e)
+                        continue
+                    numbers.done(params, invoice_dir, result)
+                    yield row_number, result, None
+            finally:
+                numbers.commit()
+    finally:
+        numbers.release()
+
+
+# State of a worker process of generate_batch_parallel()
+worker_state = {}
+
+
+def init_batch_worker(directories):
+    # Every worker gets its own renderer
+    worker_state["directories"] = directories
+    worker_state["resources"] = {}
+    multiprocessing.util.Finalize(None, close_batch_worker, exitpriority=10)
+
+
+def close_batch_worker():
+    if worker_state["resources"].get("renderer") != None:
+        worker_state["resources"]["renderer"].close()
+
+
+def generate_invoice_in_worker(params):
+    try:
+        return generate_invoice(params, worker_state["resources"], worker_state["directories"]), None
+    except Exception as e:
+        return None, str(e)
+
+
+# Rows a worker gets in advance. A row takes its number when it is handed to a worker, so the
+# number of a failed row goes to the next row. Only the numbers of rows failing at the end can
+# stay free, release() gives them to the next invoices.
+batch_rows_per_worker = 4
+
+
+def generate_batch_parallel(args, directories, jobs):
+    rows, errors = prepare_batch_rows(read_batch_rows(args), vars(args), directories)
+    yield from errors
+    for row_number, params, invoice_dir in rows:
+        # A worker renders sequentially, so more than one chromium per worker would only idle
+        params["poolSize"] = "1"
+
+    numbers = BatchNumbers(directories)
+    numbers.allocate(rows)
+    rows = iter(rows)
+    running = collections.deque()
+    count = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker, initargs=(directories,)) as executor:
+            try:
+                while True:
+                    while len(running) < jobs * batch_rows_per_worker:
+                        row = next(rows, None)
+                        if row == None:
+                            break
+                        row_number, params, invoice_dir = row
+                        if invoice_dir != None:
+                            params["invoiceNumber"] = numbers.take(invoice_dir)
+                        running.append((row, executor.submit(generate_invoice_in_worker, params)))
+                    if len(running) == 0:
+                        break
+                    (row_number, params, invoice_dir), future = running.popleft()
+                    result, error = future.result()
+                    if error != None:
+                        if invoice_dir != None:
+                            numbers.give_back(invoice_dir, params["invoiceNumber"])
+                    else:
+                        numbers.done(params, invoice_dir, result)
+                    yield row_number, result, error
+                    count += 1
+                    if count % batch_block_size == 0:
+                        numbers.commit()
+            finally:
+                # A cancelled batch doesn't start the rows that are waiting for a worker
+                for row, future in running:
+                    future.cancel()
+    finally:
+        numbers.commit()
+        numbers.release()
+
+
+# {"row": 1, "invoiceNumber": "2024-05-1", "xml": "<?xml ...", "html": "...", "pdf": "<base64>"}
+def write_batch_documents(output_file, row_number, result):
+    line = {"row": row_number, "invoiceNumber": result["invoiceNumber"]}
+    for output, document in result["documents"].items():
+        if output == "pdf":
+            document = base64.b64encode(document).decode()
+        line[output] = document
+    output_file.write(json.dumps(line).encode() + b"\n")
+
+
+# startup_seconds: the start of the generator until the batch begins
+def run_batch(args, resources, directories, startup_seconds=0.0):
+    metrics = open_metrics(vars(args))
+    progress = resources.get("progress")
+    if progress != None:
+        # The manifest is read once more, so the progress knows how many invoices there are
+        progress.start(sum(1 for row in read_batch_manifest(args.batch)))
+    statistics = StageStatistics()
+    count = 0
+    failures = []
+    start_time = time.monotonic()
+    if args.jobs > 1:
+        results = generate_batch_parallel(args, directories, args.jobs)
+    else:
+        results = generate_batch_sequential(args, resources, directories)
+    # --outputFd: one json line per row with its documents instead of saved files
+    output_file = None
+    if args.outputFd != None:
+        output_file = open(int(args.outputFd), "wb", closefd=False)
+    render_cache_counts = {"hit": 0, "miss": 0, "off": 0}
+    try:
+        for row_number, result, error in results:
+            count += 1
+            if metrics != None or progress != None:
+                record = get_invoice_record(result, error, row_number)
+                if metrics != None:
+                    metrics.write(record)
+                if progress != None:
+                    progress.invoice_done(record)
+            if error == None:
+                render_cache_counts[result["renderCache"]] += 1
+                statistics.add(result["timings"])
+                if output_file != None:
+                    write_batch_documents(output_file, row_number, result)
+                else:
+                    print_result_paths(result)
+            else:
+                failures.append((row_number, error))
+                print(f'Error in row {row_number}: {error}')
+                if output_file != None:
+                    output_file.write(json.dumps({"row": row_number, "error": error}).encode() + b"\n")
+    except BaseException:
+        # A cancelled batch has no summary, the records so far are kept
+        if metrics != None:
+            metrics.close()
+        raise
+    finally:
+        if output_file != None:
+            output_file.close()
+    duration = time.monotonic() - start_time
+
+    if metrics != None:
+        metrics.write({
+            "type": "batch",
+            "count": count,
+            "failed": len(failures),
+            "seconds": round(duration, 6),
+            "invoicesPerSecond": round(count / duration if duration > 0 else 0, 2),
+            "arguments": round(startup_seconds, 6),
+            "stages": statistics.get_summary(),
+        })
+        metrics.close()
+
+    print(f"Batch finished: {count - len(failures)} of {count} invoices generated in {duration:.2f} s ({count / duration if duration > 0 else 0:.2f} invoices/s)")
+    if render_cache_counts["hit"] + render_cache_counts["miss"] > 0:
+        print(f'Render cache: {render_cache_counts["hit"]} hits, {render_cache_counts["miss"]} misses')
+    for row_number, message in failures:
+        print(f"Failed row {row_number}: {message}")
+    return len(failures) == 0
@@ -0,0 +1,219 @@
+# Printing the invoice.html with chromium
+import os
+import base64
+import fcntl
+import json
+import queue
+import select
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+from .util import InvoiceError
+
+
+# Check if chromium folder is present next to the script
+def get_chromium_exec(current_dir):
+    if os.path.exists(f"{current_dir}/chromium"):
+        return f"{current_dir}/chromium/chrome"
+    return "chromium"
+
+
+# Starts a new chromium for every invoice.
+class ChromiumRenderer:
+    def __init__(self, chromium_exec):
+        self.chromium_exec = chromium_exec
+
+    def print_pdf(self, html_path, pdf_path):
+        try:
+            process = subprocess.run([self.chromium_exec, "--no-sandbox", "--headless", "--disable-gpu", f"--print-to-pdf={pdf_path}", "--no-margins", "--no-pdf-header-footer", f"file://{html_path}"])
+        except OSError as e:
+            raise InvoiceError(f'Could not start chromium "{self.chromium_exec}": {e}')
+        if process.returncode != 0:
+            raise InvoiceError(f"Could not print the pdf: chromium exited with code {process.returncode}")
+        # Chromium also exits with 0 when it could not write the pdf
+        if not os.path.exists(pdf_path) or os.path.getsize(pdf_path) == 0:
+            raise InvoiceError("Could not print the pdf: chromium did not write it")
+
+    def close(self):
+        pass
+
+
+class ChromiumWorkerError(Exception):
+    pass
+
+
+# One long running headless chromium, controlled with the DevTools protocol.
+# With --remote-debugging-pipe chromium reads the commands from fd 3 and writes
+# the answers to fd 4. Every message is a json object terminated by a null byte.
+class ChromiumWorker:
+    def __init__(self, chromium_exec, work_dir):
+        self.chromium_exec = chromium_exec
+        self.work_dir = work_dir
+        self.pid = None
+
+    def start(self):
+        self.profile_dir = tempfile.mkdtemp(prefix="chromium-", dir=self.work_dir)
+        command_read, self.command_write = os.pipe()
+        self.result_read, result_write = os.pipe()
+        # Move the pipe ends of chromium to fd 3 and 4. They are first moved above 10,
+        # so one can't overwrite the other while they are duplicated.
+        command_read = self.move_fd_above(command_read, 10)
+        result_write = self.move_fd_above(result_write, 10)
+        try:
+            self.pid = os.posix_spawnp(self.chromium_exec, [
+                self.chromium_exec, "--no-sandbox", "--headless", "--disable-gpu", "--no-first-run",
+                "--remote-debugging-pipe", f"--user-data-dir={self.profile_dir}",
+            ], os.environ, file_actions=[
+                (os.POSIX_SPAWN_DUP2, command_read, 3),
+                (os.POSIX_SPAWN_DUP2, result_write, 4),
+                (os.POSIX_SPAWN_OPEN, 1, "/dev/null", os.O_WRONLY, 0),
+                (os.POSIX_SPAWN_OPEN, 2, "/dev/null", os.O_WRONLY, 0),
+            ])
+        except OSError:
+            os.close(self.command_write)
+            os.close(self.result_read)
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            raise
+        finally:
+            os.close(command_read)
+            os.close(result_write)
+        self.exited = False
+        self.buffer = b""
+        self.next_id = 0
+
+    def move_fd_above(self, fd, minimum):
+        moved_fd = fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, minimum)
+        os.close(fd)
+        return moved_fd
+
+    def is_running(self):
+        if self.pid == None or self.exited:
+            return False
+        # A chromium that has exited is reaped here
+        if os.waitpid(self.pid, os.WNOHANG) != (0, 0):
+            self.exited = True
+        return not self.exited
+
+    def stop(self):
+        if self.pid == None:
+            return
+        try:
+            self.send("Browser.close", wait=False)
+        except OSError:
+            pass
+        # Give chromium two seconds to shut down cleanly
+        deadline = time.monotonic() + 2
+        while self.is_running() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.is_running():
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        os.close(self.command_write)
+        os.close(self.result_read)
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.pid = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def read_message(self, deadline):
+        while True:
+            end = self.buffer.find(b"\0")
+            if end != -1:
+                message = self.buffer[:end]
+                self.buffer = self.buffer[end + 1:]
+                return json.loads(message)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ChromiumWorkerError("Timeout while waiting for chromium")
+            ready, _, _ = select.select([self.result_read], [], [], remaining)
+            if ready:
+                data = os.read(self.result_read, 65536)
+                if data == b"":
+                    raise ChromiumWorkerError("Chromium exited unexpectedly")
+                self.buffer += data
+
+    # Sends a command and returns its result. Events that arrive in between are collected in self.events.
+    def send(self, method, params=None, session_id=None, deadline=None, wait=True):
+        self.next_id += 1
+        message = {"id": self.next_id, "method": method, "params": params or {}}
+        if session_id != None:
+            message["sessionId"] = session_id
+        os.write(self.command_write, json.dumps(message).encode() + b"\0")
+        if not wait:
+            return None
+        while True:
+            answer = self.read_message(deadline)
+            if answer.get("id") == self.next_id:
+                if "error" in answer:
+                    raise ChromiumWorkerError(f'{method} failed: {answer["error"].get("message")}')
+                return answer.get("result", {})
+            self.events.append(answer)
+
+    def wait_for_event(self, method, session_id, deadline):
+        while True:
+            for event in self.events:
+                if event.get("method") == method and event.get("sessionId") == session_id:
+                    self.events.remove(event)
+                    return event
+            self.events.append(self.read_message(deadline))
+
+    def print_pdf(self, html_path, pdf_path, timeout):
+        if not self.is_running():
+            self.restart()
+        deadline = time.monotonic() + timeout
+        self.events = []
+        target_id = self.send("Target.createTarget", {"url": "about:blank"}, deadline=deadline)["targetId"]
+        session_id = self.send("Target.attachToTarget", {"targetId": target_id, "flatten": True}, deadline=deadline)["sessionId"]
+        self.send("Page.enable", session_id=session_id, deadline=deadline)
+        self.send("Page.navigate", {"url": f"file://{html_path}"}, session_id=session_id, deadline=deadline)
+        self.wait_for_event("Page.loadEventFired", session_id, deadline)
+        # Same as --no-margins --no-pdf-header-footer, the page size comes from the @page rule
+        result = self.send("Page.printToPDF", {
+            "printBackground": True,
+            "preferCSSPageSize": True,
+            "displayHeaderFooter": False,
+            "marginTop": 0,
+            "marginBottom": 0,
+            "marginLeft": 0,
+            "marginRight": 0,
+        }, session_id=session_id, deadline=deadline)
+        # If anything above failed, the worker is restarted anyway and the tab is gone with it
+        self.send("Target.closeTarget", {"targetId": target_id}, deadline=deadline)
+        with open(pdf_path, "wb") as f:
+            f.write(base64.b64decode(result["data"]))
+
+
+# Keeps pool_size chromium workers running and hands every pdf to the next free one.
+# A worker that crashed or ran into the timeout is restarted and the job is tried once more.
+class ChromiumPoolRenderer:
+    def __init__(self, chromium_exec, pool_size, timeout, work_dir):
+        self.timeout = timeout
+        self.workers = [ChromiumWorker(chromium_exec, work_dir) for i in range(pool_size)]
+        self.idle_workers = queue.Queue()
+        for worker in self.workers:
+            self.idle_workers.put(worker)
+
+    def print_pdf(self, html_path, pdf_path):
+        worker = self.idle_workers.get()
+        try:
+            for attempt in range(2):
+                try:
+                    worker.print_pdf(html_path, pdf_path, self.timeout)
+                    return
+                except (ChromiumWorkerError, OSError, KeyError, ValueError) as e:
+                    error = e
+                    print(f"Chromium worker failed ({e}), restarting it...")
+                    # The next print_pdf() starts a fresh chromium
+                    worker.stop()
+            raise InvoiceError(f"Could not print the pdf: {error}")
+        finally:
+            self.idle_workers.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
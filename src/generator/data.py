@@ -0,0 +1,386 @@
+# CUSTOMERS AND ARTICLES
+# data/customers.csv and data/articles.csv stay the files other tools read and write.
+# They are imported into data/data.sqlite whenever they changed. The lookups by id and the
+# prefix searches use the indexed tables instead of reading the csv files. The app finds, adds
+# and deletes customers and articles through the generator service (see service.py), a new row
+# is only appended to the csv.
+import os
+import contextlib
+import hashlib
+import select
+import sqlite3
+import struct
+import threading
+import time
+
+from .util import InvoiceError, argkeys_customer
+
+
+# Columns of the csv files, in their order
+data_columns = {
+    "customers": ("companyName", "name", "street", "zip", "city", "country"),
+    "articles": ("description", "pricePerUnit", "amount", "summary"),
+}
+# Columns the prefix search looks at
+data_search_columns = {
+    "customers": ("companyName", "name", "zip"),
+    "articles": ("description",),
+}
+
+
+# The rows of csv data, empty lines are skipped. Missing columns are empty.
+def read_data_rows(table, data):
+    columns = data_columns[table]
+    rows = []
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if line.strip() == "":
+            continue
+        values = line.split(";")
+        rows.append(tuple(values[:len(columns)] + [""] * (len(columns) - len(values))))
+    return rows
+
+
+class DataStore:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        # Transactions are started explicitly, see transaction()
+        self.connection = sqlite3.connect(f"{data_dir}/data.sqlite", timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            for table, columns in data_columns.items():
+                # NOCASE lets LIKE 'abc%' use the indexes
+                column_definitions = ", ".join(f"{column} TEXT NOT NULL DEFAULT '' COLLATE NOCASE" for column in columns)
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, {column_definitions})")
+                for column in data_search_columns[table]:
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})")
+        # Numbers about the imports done while opening
+        self.imports = []
+        for table in data_columns:
+            result = self.import_csv_if_changed(table)
+            if result != None:
+                self.imports.append(result)
+
+    def close(self):
+        self.connection.close()
+
+    # Only one process writes at a time, the others wait (up to the timeout)
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def get_csv_path(self, table):
+        return f"{self.data_dir}/{table}.csv"
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row == None else row[0]
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_csv_stamp(self, table):
+        try:
+            stat = os.stat(self.get_csv_path(table))
+        except FileNotFoundError:
+            return ""
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def is_csv_imported(self, table):
+        return self.get_meta(f"{table}.csv") == self.get_csv_stamp(table)
+
+    # Remembers what was imported: the length and the sha256 of the content, so the next
+    # import can tell if rows were only appended
+    def set_csv_imported(self, table):
+        try:
+            with open(self.get_csv_path(table), "rb") as f:
+                data = f.read()
+                stat = os.fstat(f.fileno())
+            stamp = f"{stat.st_mtime_ns}:{stat.st_size}"
+        except FileNotFoundError:
+            data = b""
+            stamp = ""
+        self.set_meta(f"{table}.csv", stamp)
+        self.set_meta(f"{table}.csv-length", str(len(data)))
+        self.set_meta(f"{table}.csv-sha256", hashlib.sha256(data).hexdigest())
+
+    # Imports the changes of the csv file. Rows appended at the end are just added. After any other
+    # change the rows are compared with the table: rows that did not change keep their id, so ids
+    # stay valid when the csv is edited from outside.
+    # Returns None if the file did not change, otherwise numbers about the import.
+    def import_csv_if_changed(self, table):
+        if self.is_csv_imported(table):
+            return None
+        start_time = time.monotonic()
+        with self.transaction():
+            # Another process might have imported it in the meantime
+            if self.is_csv_imported(table):
+                return None
+            columns = data_columns[table]
+            try:
+                with open(self.get_csv_path(table), "rb") as f:
+                    data = f.read()
+                    modified_time = os.fstat(f.fileno()).st_mtime
+            except FileNotFoundError:
+                data = b""
+                modified_time = time.time()
+
+            length = int(self.get_meta(f"{table}.csv-length") or 0)
+            appended = (0 < length <= len(data)
+                and hashlib.sha256(data[:length]).hexdigest() == self.get_meta(f"{table}.csv-sha256")
+                # The last row must not have been continued
+                and (data[length - 1:length] == b"\n" or data[length:length + 1] in (b"", b"\r", b"\n")))
+            if appended:
+                rows = read_data_rows(table, data[length:])
+                new_rows = rows
+                removed_ids = []
+            else:
+                # The first line is the header
+                rows = read_data_rows(table, data)[1:]
+                existing_rows = {}
+                for row in self.connection.execute(f"SELECT id, {', '.join(columns)} FROM {table} ORDER BY id"):
+                    existing_rows.setdefault(tuple(row[1:]), []).append(row[0])
+                new_rows = []
+                for values in rows:
+                    ids = existing_rows.get(values)
+                    if ids:
+                        ids.pop(0)
+                    else:
+                        new_rows.append(values)
+                removed_ids = [(id,) for ids in existing_rows.values() for id in ids]
+            self.connection.executemany(f"DELETE FROM {table} WHERE id = ?", removed_ids)
+            self.connection.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", new_rows)
+            self.set_csv_imported(table)
+        return {
+            "table": table,
+            "rows": len(rows),
+            "added": len(new_rows),
+            "removed": len(removed_ids),
+            "appended": appended,
+            "seconds": time.monotonic() - start_time,
+            # Time between writing the file and the end of the import
+            "lag": max(0.0, time.time() - modified_time),
+        }
+
+    # Call only inside a transaction(), it keeps other writers out while the file is replaced
+    def export_csv(self, table):
+        columns = data_columns[table]
+        csv_path = self.get_csv_path(table)
+        with open(f"{csv_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            f.write(";".join(columns) + "\n")
+            for row in self.connection.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id"):
+                f.write(";".join(row) + "\n")
+        os.replace(f"{csv_path}.{os.getpid()}.tmp", csv_path)
+        self.set_csv_imported(table)
+
+    # values: dict column -> value. Returns the id of the new row.
+    # The row is appended to the csv, the rest of the file is not written again.
+    def add(self, table, values):
+        self.import_csv_if_changed(table)
+        columns = data_columns[table]
+        # ; separates the columns and every row is one line
+        row = tuple(str(values.get(column, "")).replace(";", ",").replace("\n", "<br>") for column in columns)
+        with self.transaction():
+            cursor = self.connection.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", row)
+            with open(self.get_csv_path(table), "a+b") as f:
+                if f.tell() == 0:
+                    f.write(";".join(columns).encode() + b"\n")
+                else:
+                    # The last line might not end with a line break
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(";".join(row).encode() + b"\n")
+            self.set_csv_imported(table)
+        return cursor.lastrowid
+
+    # Removing a row writes the csv again, the other changes only append to it
+    def delete(self, table, id):
+        self.import_csv_if_changed(table)
+        with self.transaction():
+            self.connection.execute(f"DELETE FROM {table} WHERE id = ?", (int(id),))
+            self.export_csv(table)
+
+    # Returns a dict with the id and the columns, None if there is no row with this id
+    def get(self, table, id):
+        columns = data_columns[table]
+        row = self.connection.execute(f"SELECT id, {', '.join(columns)} FROM {table} WHERE id = ?", (int(id),)).fetchone()
+        if row == None:
+            return None
+        return dict(zip(("id",) + columns, row))
+
+    # Rows where one of the search columns starts with text (ignoring case)
+    def search(self, table, text, limit=50):
+        columns = data_columns[table]
+        search_columns = data_search_columns[table]
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        condition = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in search_columns)
+        rows = self.connection.execute(
+            f"SELECT id, {', '.join(columns)} FROM {table} WHERE {condition} ORDER BY {search_columns[0]}, id LIMIT ?",
+            (pattern,) * len(search_columns) + (int(limit),))
+        return [dict(zip(("id",) + columns, row)) for row in rows]
+
+
+# Imports data/customers.csv and data/articles.csv right after they were written, so other
+# programs can drop their files there while --serve is running. Uses inotify, and checks the
+# files every few seconds where inotify is not available.
+class DataWatcher:
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.mode = "polling"
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        for table in data_columns:
+            self.stats[table] = {"imports": 0, "rows": 0, "seconds": 0.0, "lastImport": None, "lastLag": None}
+
+    def start(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(5)
+
+    def open_inotify(self):
+        # Only the watcher of --serve needs ctypes, and ctypes.util is slow to import
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if inotify_fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(inotify_fd, os.fsencode(self.data_dir), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(inotify_fd)
+            raise OSError(error, "inotify_add_watch failed")
+        return inotify_fd
+
+    # Names of the files in the events read from the inotify fd
+    def read_inotify_names(self, inotify_fd):
+        names = set()
+        try:
+            data = os.read(inotify_fd, 65536)
+        except BlockingIOError:
+            return names
+        position = 0
+        # struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len, char name[len]
+        while position + 16 <= len(data):
+            name_length = struct.unpack_from("iIII", data, position)[3]
+            names.add(data[position + 16:position + 16 + name_length].rstrip(b"\0").decode(errors="replace"))
+            position += 16 + name_length
+        return names
+
+    def run(self):
+        store = DataStore(self.data_dir)
+        for result in store.imports:
+            self.add_import(result)
+        inotify_fd = None
+        try:
+            inotify_fd = self.open_inotify()
+            self.mode = "inotify"
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"Could not watch {self.data_dir} with inotify ({e}), checking it every 2 seconds instead", flush=True)
+        try:
+            while not self.stop_event.is_set():
+                tables = data_columns.keys()
+                if inotify_fd != None:
+                    readable = select.select([inotify_fd], [], [], 1.0)[0]
+                    if len(readable) == 0:
+                        continue
+                    names = self.read_inotify_names(inotify_fd)
+                    tables = [table for table in data_columns if f"{table}.csv" in names]
+                else:
+                    self.stop_event.wait(2.0)
+                for table in tables:
+                    try:
+                        result = store.import_csv_if_changed(table)
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"Error: Could not import {table}.csv: {e}", flush=True)
+                        continue
+                    if result != None:
+                        self.add_import(result)
+        finally:
+            if inotify_fd != None:
+                os.close(inotify_fd)
+            store.close()
+
+    def add_import(self, result):
+        table = result["table"]
+        rows_per_second = result["rows"] / result["seconds"] if result["seconds"] > 0 else 0
+        print(f'Imported {table}.csv: {result["added"]} added, {result["removed"]} removed, {result["rows"]} rows read'
+            f'{" (appended)" if result["appended"] else ""} in {result["seconds"] * 1000:.1f} ms'
+            f' ({rows_per_second:.0f} rows/s, {result["lag"] * 1000:.0f} ms after the file was written)', flush=True)
+        with self.stats_lock:
+            stats = self.stats[table]
+            stats["imports"] += 1
+            stats["rows"] += result["rows"]
+            stats["seconds"] += result["seconds"]
+            stats["lastImport"] = result
+            stats["lastLag"] = result["lag"]
+
+    # For the dataStatus request of --serve
+    def get_status(self):
+        status = {"dataDir": self.data_dir, "mode": self.mode}
+        with self.stats_lock:
+            for table, stats in self.stats.items():
+                status[table] = dict(stats)
+                status[table]["rowsPerSecond"] = stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else 0
+        return status
+
+
+def open_data_store(params):
+    return DataStore(os.path.join(params["invoiceDir"], "data"))
+
+
+# Replaces --customerId and --articleId with the customer and the articles they stand for.
+# Customer arguments that are given keep their value. stores (data dir -> DataStore) keeps the
+# stores open for the next call, the caller closes them. Without it the store is closed again.
+def resolve_data_ids(params, stores=None):
+    customer_id = params.get("customerId")
+    article_ids = params.get("articleId")
+    if customer_id in (None, "") and not article_ids:
+        return
+    data_dir = os.path.join(params["invoiceDir"], "data")
+    if stores != None and data_dir in stores:
+        store = stores[data_dir]
+    else:
+        store = DataStore(data_dir)
+        if stores != None:
+            stores[data_dir] = store
+    try:
+        if customer_id not in (None, ""):
+            customer = store.get("customers", customer_id) if str(customer_id).isdigit() else None
+            if customer == None:
+                raise InvoiceError(f'Unknown customer id: "{customer_id}"')
+            for argkey, column in zip(argkeys_customer, ("companyName", "name", "street", "zip", "city")):
+                if params.get(argkey[0]) in (None, ""):
+                    params[argkey[0]] = customer[column]
+        articles = list(params.get("article") or [])
+        for article_id in article_ids or []:
+            # "<id>" or "<id>;<amount>"
+            segments = str(article_id).split(";")
+            article = store.get("articles", segments[0]) if segments[0].isdigit() else None
+            if article == None:
+                raise InvoiceError(f'Unknown article id: "{article_id}"')
+            amount = segments[1] if len(segments) > 1 else article["amount"]
+            if amount == "":
+                amount = "1"
+            articles.append(f'{article["description"]};{article["pricePerUnit"]};{amount};{article["summary"]}')
+        params["article"] = articles
+    finally:
+        if stores == None:
+            store.close()
+    params["customerId"] = None
+    params["articleId"] = None
@@ -0,0 +1,499 @@
+# Generating one invoice: html, xml and pdf
+import os
+import io
+import errno
+import itertools
+import time
+
+from .util import argkeys_customer, does_file_exist, get_all_lines_from_file, InvoiceError
+from .template import compile_template, load_template, render_template
+from .invoice import Invoice, convert_to_euro_string, convert_to_percent_string, create_items_html, create_vat_rows_html
+from .numbering import allocate_invoice_numbers, commit_invoice_number, get_invoice_dir, release_invoice_numbers
+from .rendering import prepare_renderer
+from .zugferd import write_invoice_xml
+from .metrics import StageTimer
+
+
+# Loads the invoice.html and the template.csv.
+# invoice.html is stored in the resources dict and the templates are cached by load_template(),
+# so a batch run reads every file only once.
+def load_resources(resources, current_dir, template_path):
+    if "html_template" not in resources:
+        html_lines = get_all_lines_from_file(f"{current_dir}/html/invoice.html")
+        if len(html_lines) == 0:
+            raise InvoiceError(f'Could not open template file: "{current_dir}/html/invoice.html"')
+        resources["html_template"] = compile_template("".join(html_lines))
+
+    return load_template(template_path)
+
+
+# Hard links the file if possible, which costs no copy at all
+def link_or_copy_file(source_path, target_path):
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        # shutil.copyfile() copies in the kernel (sendfile) on Linux
+        import shutil
+        shutil.copyfile(source_path, target_path)
+
+
+# The logos are copied once into ~/.cache/rechnungs-assistent/logos/ and linked into the scratch
+# dir of every invoice from there. A logo is only copied again after its file changed.
+# Returns the path of the copy and the sha256 of the logo.
+def get_cached_logo(resources, directories, logo_path):
+    stat = os.stat(logo_path)
+    key = (os.path.realpath(logo_path), stat.st_mtime_ns, stat.st_size)
+    logos = resources.setdefault("logos", {})
+    if key not in logos:
+        # hashlib loads OpenSSL, which is noticeable in a short run, so only a new logo pays for it
+        import hashlib
+        with open(logo_path, "rb") as f:
+            logo = f.read()
+        logo_digest = hashlib.sha256(logo).hexdigest()
+        logo_dir = f'{directories["cache_dir"]}/logos'
+        os.makedirs(logo_dir, exist_ok=True)
+        cached_logo_path = f"{logo_dir}/{logo_digest}.png"
+        if not does_file_exist(cached_logo_path):
+            # The threads of --serve may copy the same logo at the same time
+            temp_path = f"{cached_logo_path}.{os.getpid()}-{next(job_counter)}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(logo)
+            os.replace(temp_path, cached_logo_path)
+        logos[key] = (cached_logo_path, logo_digest)
+    return logos[key]
+
+
+# Moves the finished file to its place in one step, so nobody ever sees a half written invoice.
+def commit_file(source_path, target_path):
+    try:
+        os.replace(source_path, target_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Different file systems: copy next to the target first
+        import shutil
+        temp_path = f"{target_path}.{os.getpid()}-{next(job_counter)}.tmp"
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, target_path)
+
+
+# Numbers of the scratch dirs of this process
+job_counter = itertools.count(1)
+
+
+# tempfile.mkdtemp() and shutil.rmtree() would do the same, but importing tempfile and shutil
+# takes longer than generating the xml of a short invoice.
+def create_work_dir(jobs_dir):
+    while True:
+        work_dir = f"{jobs_dir}/job-{os.getpid()}-{next(job_counter)}"
+        try:
+            os.mkdir(work_dir, 0o700)
+            return work_dir
+        except FileExistsError:
+            # Left behind by a generator that had the same pid and was killed
+            continue
+
+
+# The scratch dir contains files only
+def remove_work_dir(work_dir):
+    try:
+        for entry in os.scandir(work_dir):
+            os.unlink(entry.path)
+        os.rmdir(work_dir)
+    except OSError:
+        pass
+
+
+# Every dry run gets its own dir under cache_dir/dry-runs, so previews generated at the same
+# time don't overwrite each other. The dirs of dry runs older than a day are removed.
+dry_run_max_age = 24 * 60 * 60
+
+
+def create_dry_run_dir(cache_dir):
+    dry_runs_dir = f"{cache_dir}/dry-runs"
+    os.makedirs(dry_runs_dir, exist_ok=True)
+    now = time.time()
+    for entry in os.scandir(dry_runs_dir):
+        try:
+            if now - entry.stat().st_mtime > dry_run_max_age:
+                remove_work_dir(entry.path)
+        except OSError:
+            pass
+    return create_work_dir(dry_runs_dir)
+
+
+# --output: the documents an invoice consists of
+output_types = ("html", "xml", "pdf")
+
+
+def get_outputs(params):
+    outputs = set()
+    for output in str(params.get("output") or "pdf,xml").split(","):
+        output = output.strip()
+        if output not in output_types:
+            raise InvoiceError(f'Unknown output: "{output}". Use: --output html,xml,pdf')
+        outputs.add(output)
+    if params["renderer"] == "none":
+        outputs.discard("pdf")
+    if len(outputs) == 0:
+        raise InvoiceError("Nothing to generate: --renderer none prints no pdf, add html or xml to --output")
+    return outputs
+
+
+# Generates one invoice. params contains the values of the command line arguments.
+# Returns a dict with the paths of the saved documents, the invoice number, the totals and
+# the seconds every stage took (see metrics.stage_names).
+# With --outputFd the documents are not saved, the dict contains them under "documents".
+def generate_invoice(params, resources, directories):
+    print("Generating invoice...")
+
+    timer = StageTimer(resources.get("progress"))
+    outputs = get_outputs(params)
+    if "pdf" not in outputs:
+        # The html and the xml are written straight to their place, only printing needs a scratch dir
+        result = generate_invoice_files(params, resources, directories, outputs, None, timer)
+    else:
+        # Every invoice gets its own scratch dir, so generators running at the same time don't
+        # overwrite each other's files
+        jobs_dir = f'{directories["cache_dir"]}/jobs'
+        os.makedirs(jobs_dir, exist_ok=True)
+        work_dir = create_work_dir(jobs_dir)
+        timer.lap("scratch")
+        try:
+            result = generate_invoice_files(params, resources, directories, outputs, work_dir, timer)
+        finally:
+            remove_work_dir(work_dir)
+            timer.lap("scratch")
+    result["timings"] = timer.get_timings()
+    return result
+
+
+def generate_invoice_files(params, resources, directories, outputs, work_dir, timer):
+    current_dir = directories["current_dir"]
+
+    template = load_resources(resources, current_dir, params["template"])
+    timer.lap("template")
+
+    if params.get("customerId") not in (None, "") or params.get("articleId"):
+        # sqlite is only loaded by invoices that need it
+        from .data import resolve_data_ids
+        resolve_data_ids(params)
+    invoice = Invoice(params, template)
+    timer.lap("invoice")
+
+    # INVOICE NUMBER
+    invoice_dir = get_invoice_dir(params)
+    reserved = invoice.number == "" and not params["dryRun"]
+    if invoice.number == "":
+        # A dry run only shows the next number, it does not use it up
+        invoice.number = allocate_invoice_numbers(directories, invoice_dir, 1, reserve=reserved)[0]
+    timer.lap("number")
+
+    try:
+        return write_invoice_files(params, resources, directories, outputs, work_dir, timer, template, invoice, invoice_dir)
+    except BaseException:
+        if reserved:
+            # Nothing was saved under the number, so the next invoice gets it
+            release_invoice_numbers(directories, invoice_dir, [invoice.number])
+        raise
+
+
+# The documents of the numbered invoice
+def write_invoice_files(params, resources, directories, outputs, work_dir, timer, template, invoice, invoice_dir):
+    cache_dir = directories["cache_dir"]
+    current_dir = directories["current_dir"]
+    invoice_number = invoice.number
+
+    to_fd = params.get("outputFd") not in (None, "")
+    pdf_path = f"{work_dir}/invoice.pdf"
+    renderer = None
+    if "pdf" in outputs:
+        prepare_renderer(resources, params, directories)
+        renderer = resources["renderer"]
+        timer.lap("renderer")
+    # The native renderer lays out the values itself and attaches the xml, chromium prints the html
+    native_pdf = hasattr(renderer, "print_invoice")
+
+    base_path = f"{invoice_dir}/Rechnung-{invoice_number}"
+    if params["dryRun"] and not to_fd:
+        print("Dry run. Not saving the invoice to the invoice Dir.")
+        base_path = f"{create_dry_run_dir(cache_dir)}/Rechnung"
+
+    documents = {}
+    html = None
+    logo_digest = None
+    if "html" in outputs or "pdf" in outputs:
+        values = create_html_values(params, template, invoice)
+        if "html" in outputs or not native_pdf:
+            # The items table, split into pages with the header repeated on every page.
+            # Imported here, an xml-only run doesn't need the font metrics.
+            from .pagination import paginate_html_items
+            values["ITEMS"] = create_items_html(invoice, template, paginate_html_items(values, invoice))
+            timer.lap("pages")
+            html, unresolved_keys = render_template(resources["html_template"], values)
+            if len(unresolved_keys) > 0:
+                print("Warning: No value for " + ", ".join("#!" + key for key in unresolved_keys) + ". These lines are left out.")
+            if "pdf" in outputs:
+                # Save .html file to the scratch dir
+                with open(f"{work_dir}/invoice.html", "w") as f:
+                    f.write(html)
+        timer.lap("html")
+
+        logo_path = find_logo_path(params, template, current_dir)
+        if "html" in outputs:
+            # The logo is put into the html, so the file can be sent on its own
+            documents["html"] = embed_logo(html, logo_path)
+        if "pdf" in outputs:
+            # Link logo to the scratch dir
+            cached_logo_path, logo_digest = get_cached_logo(resources, directories, logo_path)
+            link_or_copy_file(cached_logo_path, f"{work_dir}/logo.png")
+        timer.lap("logo")
+
+    xml_path = None
+    if "xml" in outputs or native_pdf:
+        if work_dir != None:
+            xml_path = f"{work_dir}/invoice.xml"
+            with open(xml_path, "w", encoding="utf-8") as f:
+                write_invoice_xml(invoice, template, f)
+        else:
+            xml_file = io.StringIO()
+            write_invoice_xml(invoice, template, xml_file)
+            documents["xml"] = xml_file.getvalue()
+        timer.lap("xml")
+
+    render_cache_result = "off"
+    if "pdf" in outputs:
+        if native_pdf:
+            # The native renderer is fast enough without the render cache. The xml is attached to the pdf.
+            renderer.print_invoice(values, invoice, template, f"{work_dir}/logo.png", xml_path, pdf_path)
+        elif "render_cache" in resources:
+            render_cache = resources["render_cache"]
+            if render_cache.print_pdf(renderer, html, f"{work_dir}/invoice.html", logo_digest, pdf_path):
+                render_cache_result = "hit"
+            else:
+                render_cache_result = "miss"
+            print(f"Render cache: {render_cache_result} ({render_cache.hits} hits, {render_cache.misses} misses)")
+        else:
+            # Chromium can't attach the xml to the pdf, it is saved next to it
+            renderer.print_pdf(f"{work_dir}/invoice.html", pdf_path)
+        timer.lap("pdf")
+
+    result = {
+        "invoicePath": "",
+        "xmlPath": "",
+        "htmlPath": "",
+        "invoiceNumber": invoice_number,
+        "sumWithoutVat": float(invoice.sum_netto),
+        "vat": float(invoice.vat_sum),
+        "sumWithVat": float(invoice.sum_brutto),
+        "renderCache": render_cache_result,
+    }
+
+    if to_fd:
+        # The caller writes them to the fd, nothing is saved
+        if "pdf" in outputs:
+            with open(pdf_path, "rb") as f:
+                documents["pdf"] = f.read()
+        if "xml" in outputs and "xml" not in documents:
+            with open(xml_path, "r", encoding="utf-8") as f:
+                documents["xml"] = f.read()
+        result["documents"] = {output: documents[output] for output in outputs}
+    else:
+        # Move the documents to the invoice directory
+        if "pdf" in outputs:
+            commit_file(pdf_path, f"{base_path}.pdf")
+            result["invoicePath"] = f"{base_path}.pdf"
+        if "xml" in outputs:
+            if xml_path != None:
+                commit_file(xml_path, f"{base_path}.xml")
+            else:
+                save_file(documents["xml"], f"{base_path}.xml")
+            result["xmlPath"] = f"{base_path}.xml"
+        if "html" in outputs:
+            save_file(documents["html"], f"{base_path}.html")
+            result["htmlPath"] = f"{base_path}.html"
+
+    # A batch commits the numbers it handed out itself
+    if not params["dryRun"] and params.get("commitNumber", True):
+        commit_invoice_number(directories, invoice_dir, invoice_number)
+    timer.lap("commit")
+
+    if not params["dryRun"] and (result["invoicePath"] != "" or result["xmlPath"] != ""):
+        # Imported here, sqlite is only loaded when an invoice is saved
+        from .archive import archive_invoices, get_archive_entry
+        archive_entry = get_archive_entry(invoice, result)
+        if params.get("archiveInvoice", True):
+            archive_invoices({params["invoiceDir"]: [archive_entry]})
+        else:
+            # A batch adds the invoices of a block at once, see BatchNumbers.commit()
+            result["archiveEntry"] = archive_entry
+        timer.lap("archive")
+
+    return result
+
+
+# The lines the app and scripts take the paths of the saved documents from
+def print_result_paths(result):
+    if result["invoicePath"] != "":
+        print("InvoicePath: " + result["invoicePath"])
+    if result["xmlPath"] != "":
+        print("XmlPath: " + result["xmlPath"])
+    if result["htmlPath"] != "":
+        print("HtmlPath: " + result["htmlPath"])
+
+
+# Values of the #!KEY placeholders of invoice.html
+def create_html_values(params, template, invoice):
+    date = invoice.date.strftime("%d.%m.%Y")
+    payment_date = invoice.payment_date.strftime("%d.%m.%Y")
+    invoice_number = invoice.number
+
+    # Generate html for sender info
+    sen_info_description = ""
+    sen_info_data = ""
+    if template.is_present("SEN-COMPANY"):
+        sen_info_description += "<br>"
+        sen_company = template.get("SEN-COMPANY")
+        sen_info_data += f"<strong>{sen_company}</strong> <br>"
+
+    if template.is_present("SEN-NAME") and template.is_present("SEN-STREET") and template.is_present("SEN-CITY"):
+        sen_info_description += "Anschrift <br> <br> <br> <br>"
+        sen_name = template.get("SEN-NAME")
+        sen_name = template.get("SEN-NAME")
+        sen_street = template.get("SEN-STREET")
+        sen_zip = template.get("SEN-ZIP")
+        sen_city = template.get("SEN-CITY")
+        sen_info_data += f"{sen_name} <br> {sen_street} <br> {sen_zip} {sen_city} <br> <br>"
+    if template.is_present("SEN-EMAIL"):
+        sen_info_description += "E-Mail <br>"
+        sen_email = template.get("SEN-EMAIL")
+        sen_info_data += f"<a style=\"color: grey; text-decoration: none;\" href=\"mailto:{sen_email}\">{sen_email}</a> <br>"
+    if template.is_present("SEN-PHONE"):
+        sen_info_description += "Telefon <br>"
+        sen_phone = template.get("SEN-PHONE")
+        sen_info_data += f"<a style=\"color: grey; text-decoration: none;\" href=\"tel:{sen_phone}\">{sen_phone}</a> <br>"
+    if template.is_present("SEN-WEBSITE"):
+        sen_info_description += "Website <br>"
+        sen_website = template.get("SEN-WEBSITE")
+        sen_info_data += f"<a style=\"color: grey; text-decoration: none;\" href=\"https://{sen_website}\">{sen_website}</a> <br>"
+    sen_info_description += "<br>"
+    sen_info_data += "<br>"
+    if template.is_present("SEN-TAX-ID"):
+        sen_info_description += "Ust-IdNr. <br>"
+        sen_tax_id = template.get("SEN-TAX-ID")
+        sen_info_data += f"{sen_tax_id} <br>"
+    sen_info_description += "<br>"
+    sen_info_data += "<br>"
+    if template.is_present("MONEY-INSTITUTE"):
+        sen_info_description += "Institut <br>"
+        sen_money_institute = template.get("MONEY-INSTITUTE")
+        sen_info_data += f"{sen_money_institute} <br>"
+    if template.is_present("IBAN"):
+        sen_info_description += "IBAN <br>"
+        sen_iban = template.get("IBAN")
+        sen_info_data += f"{sen_iban} <br>"
+    if template.is_present("BIC"):
+        sen_info_description += "BIC <br>"
+        sen_bic = template.get("BIC")
+        sen_info_data += f"{sen_bic} <br>"
+    
+    sen_info_description += "<br>"
+    sen_info_data += "<br>"
+
+    # Add invoiceDate to the table in sen_info section
+    sen_info_description += "Rechnungsdatum <br>"
+    sen_info_data += f"{date} <br>"
+
+    # Add invoiceNumber to the table in sen_info section
+    sen_info_description += "Rechnungsnummer <br>"
+    sen_info_data += f"{invoice_number} <br>"
+
+    # Add serviceDate (Leistungsdatum) to the table in sen_info section
+    sen_info_description += "Leistungsdatum <br>"
+    sen_info_data += f"{invoice.service_date} <br>"
+
+    
+
+    # Values of the #!KEY placeholders (GENERATE THE HTML FILE)
+    # None leaves the line of the placeholder out (e.g. an empty customer company)
+    values = {
+        # Date
+        "DATE": date,
+        "PAY-DATE": payment_date,
+        # Invoice number
+        "INVOICE-NUM": invoice_number,
+        # Sum with VAT
+        "SUM-WITHOUT-VAT": convert_to_euro_string(template, invoice.sum_netto),
+        "VAT-PERCENT": ", ".join(convert_to_percent_string(group.vat) for group in invoice.vat_groups),
+        "VAT-ADDITION": convert_to_euro_string(template, invoice.vat_sum),
+        "VAT-ROWS": create_vat_rows_html(invoice, template),
+        "SUM-WITH-VAT": convert_to_euro_string(template, invoice.sum_brutto),
+        # Sender info
+        "SEN-INFO-DESCRIPTION": sen_info_description,
+        "SEN-INFO-DATA": sen_info_data,
+    }
+
+    # Customer data
+    for j in range(len(argkeys_customer)):
+        value = params.get(argkeys_customer[j][0])
+        values[argkeys_customer[j][3]] = value if type(value) == str and value != "" else None
+
+    # Template data. A value can contain placeholders itself, like the #!INVOICE-NUM in MESSAGE.
+    template_values = {}
+    for key, template_value in template.values.items():
+        if template_value.find("#!") != -1:
+            template_value = render_template(compile_template(template_value), values)[0]
+        template_values[key] = template_value
+    values.update(template_values)
+    return values
+
+
+def find_logo_path(params, template, current_dir):
+    logo_path = template.get("ICON-PATH")
+    if params["logo"] != "":
+        logo_path = params["logo"]
+    logo_path = logo_path.replace("//", "/").strip()
+    print("Logo path: " + logo_path)
+    print("Template Dir: " + os.path.dirname(params["template"]))
+    # Find the logo file
+    if logo_path != "":
+        if not os.path.exists(logo_path):
+            # Try with local path directly next to the template.csv
+            # Get the path of the template.csv
+            template_dir = os.path.dirname(params["template"])
+            logo_path = template_dir + "/" + logo_path
+            logo_path = logo_path.replace("//", "/").strip()
+            if not os.path.exists(logo_path):
+                print(f'Error: Could not open logo file: "{logo_path}"')
+                # Use the default logo
+                logo_path = f"{current_dir}/html/logo.png"
+    else:
+        # Use the default logo
+        logo_path = f"{current_dir}/html/logo.png"
+    return logo_path
+
+
+logo_image_types = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+# Replaces the logo.png of invoice.html with the logo itself
+def embed_logo(html, logo_path):
+    import base64
+    with open(logo_path, "rb") as f:
+        logo = base64.b64encode(f.read()).decode()
+    mime_type = logo_image_types.get(os.path.splitext(logo_path)[1].lower(), "image/png")
+    return html.replace('src="logo.png"', f'src="data:{mime_type};base64,{logo}"', 1)
+
+
+# Saves text under path in one step, like commit_file()
+def save_file(text, path):
+    temp_path = f"{path}.{os.getpid()}-{next(job_counter)}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
@@ -0,0 +1,229 @@
+# The invoice model: articles, discounts, money and VAT
+import datetime
+import decimal
+
+from .util import InvoiceError, argkeys_customer
+
+
+# All money is calculated with Decimal and rounded commercially (0.005 -> 0.01) to full cents
+CENT = decimal.Decimal("0.01")
+
+
+def to_decimal(value):
+    if isinstance(value, decimal.Decimal):
+        return value
+    return decimal.Decimal(str(value))
+
+
+def round_money(value):
+    return to_decimal(value).quantize(CENT, rounding=decimal.ROUND_HALF_UP)
+
+
+# Unit prices keep their own precision (0.0042 stays 0.0042), but have at least two decimal places.
+# Only the amounts calculated from them are rounded to cents.
+def round_price(value):
+    value = to_decimal(value)
+    if value.normalize().as_tuple().exponent > -2:
+        return value.quantize(CENT)
+    return value.normalize()
+
+
+def convert_to_euro_string(template, value):
+    return str(round_money(value)).replace(".", ",") + " " + template.currency
+
+
+# 0.0042 -> "0,0042 €", 10 -> "10,00 €"
+def convert_price_to_euro_string(template, value):
+    return "{:f}".format(round_price(value)).replace(".", ",") + " " + template.currency
+
+
+# 19 -> "19 %", 5.5 -> "5,5 %"
+def convert_to_percent_string(value):
+    return "{:f}".format(to_decimal(value).normalize()).replace(".", ",") + " %"
+
+
+# Get Articles
+def parse_articles(params):
+    articles = []
+    articles_string_list = params["article"]
+    if articles_string_list != None:
+        for article_string in articles_string_list:
+            # Parse the article
+            segments = article_string.split(";")
+            # The VAT rate is optional, without it DEFAULT-VAT of the template is used
+            if len(segments) == 5 and segments[4] != "" and not is_number(segments[4]):
+                segments = []
+            if len(segments) not in (4, 5) or not is_number(segments[1]) or not is_number(segments[2]):
+                raise InvoiceError(f'Wrong format for article: "{article_string}". Use: --article "<description>;<pricePerUnit>;<amount>;<summary>[;<vatPercent>]" "<description>;<pricePerUnit>;<amount>;<summary>[;<vatPercent>]"')
+            articles.append(segments)
+    return articles
+
+
+def parse_payment_days(params):
+    payment_days = str(params["paymentDays"]).strip()
+    if not payment_days.isdigit():
+        raise InvoiceError(f'Wrong format for paymentDays: "{params["paymentDays"]}". Use a number of days, e.g. --paymentDays 14')
+    return int(payment_days)
+
+
+# Get Discount
+def parse_discounts(params):
+    discounts = []
+    discount_string_list = params["discount"]
+    if discount_string_list != None:
+        for discount_string in discount_string_list:
+            segments = discount_string.split(";")
+            if len(segments) == 3 and segments[2] != "" and not is_number(segments[2]):
+                segments = []
+            if len(segments) not in (2, 3) or not is_number(segments[1]):
+                raise InvoiceError(f'Wrong format for discount: "{discount_string}". Use: --discount "Discount;10[;<vatPercent>]"')
+            discounts.append(segments)
+    return discounts
+
+
+def is_number(value):
+    try:
+        return decimal.Decimal(value).is_finite()
+    except decimal.InvalidOperation:
+        return False
+
+
+# One row of the invoice table. A discount is a line with a negative total.
+# The total is calculated once here and used by the html and the xml.
+class InvoiceLine:
+    def __init__(self, line_id, name, summary, price, quantity, vat, is_discount=False):
+        self.line_id = line_id
+        self.name = name
+        self.summary = summary
+        self.price = to_decimal(price)
+        # The quantity stays the text that was given, only the total is calculated from it
+        self.quantity = quantity
+        self.vat = to_decimal(vat)
+        self.is_discount = is_discount
+        if is_discount:
+            self.total = -round_money(self.price)
+        else:
+            self.total = round_money(self.price * to_decimal(quantity))
+
+
+# The lines of one VAT rate and the tax on them
+class VatGroup:
+    def __init__(self, vat):
+        self.vat = vat
+        self.basis = decimal.Decimal(0)
+        self.tax = decimal.Decimal(0)
+
+
+# Everything an invoice consists of. The html and the xml are both written from this,
+# so they always show the same lines and the same totals.
+class Invoice:
+    def __init__(self, params, template):
+        now = datetime.datetime.now()
+        self.number = params["invoiceNumber"]
+        self.date = now
+        self.payment_date = now + datetime.timedelta(days=parse_payment_days(params))
+        self.service_date = params["serviceDate"]
+        if self.service_date == "today":
+            self.service_date = now.strftime("%d.%m.%Y")
+
+        self.customer = {}
+        for argkey in argkeys_customer:
+            value = params.get(argkey[0])
+            self.customer[argkey[0]] = value if type(value) == str else ""
+
+        default_vat = template.get("DEFAULT-VAT", "0")
+        if not is_number(default_vat):
+            raise InvoiceError(f'Wrong format for DEFAULT-VAT in the template: "{default_vat}". Use a percentage, e.g. DEFAULT-VAT;19')
+        self.vat = to_decimal(default_vat)
+        self.lines = []
+        for article in parse_articles(params):
+            vat = article[4] if len(article) == 5 and article[4] != "" else self.vat
+            self.lines.append(InvoiceLine(len(self.lines) + 1, article[0], article[3], article[1], article[2], vat))
+        for discount in parse_discounts(params):
+            vat = discount[2] if len(discount) == 3 and discount[2] != "" else self.vat
+            self.lines.append(InvoiceLine(len(self.lines) + 1, discount[0], "", discount[1], "1", vat, is_discount=True))
+
+        # The tax is calculated per VAT rate from the sum of its lines, not per line
+        vat_groups = {}
+        for line in self.lines:
+            if line.vat not in vat_groups:
+                vat_groups[line.vat] = VatGroup(line.vat)
+            vat_groups[line.vat].basis += line.total
+        if len(vat_groups) == 0:
+            vat_groups[self.vat] = VatGroup(self.vat)
+        self.vat_groups = sorted(vat_groups.values(), key=lambda group: group.vat)
+        for group in self.vat_groups:
+            group.tax = round_money(group.basis * group.vat / 100)
+
+        self.sum_netto = sum((group.basis for group in self.vat_groups), decimal.Decimal(0))
+        self.vat_sum = sum((group.tax for group in self.vat_groups), decimal.Decimal(0))
+        self.sum_brutto = self.sum_netto + self.vat_sum
+
+        self.currency_code = template.currency
+        if self.currency_code == "€":
+            self.currency_code = "EUR"
+        elif self.currency_code == "$":
+            self.currency_code = "USD"
+
+
+# Generate html code for the invoice lines
+# Example:
+#   <tr>
+#     <td class="invoice-item-name">Product 1</td>
+#     <td>$10.00</td>
+#     <td>1</td>
+#     <td>$10.00</td>
+#   </tr>
+# With pages (see pagination.paginate_items()) every page gets its own table, the ones that
+# don't end the table end with the "Übertrag" row the next page starts with.
+def create_items_html(invoice, template, pages=None):
+    rows = []
+    for page_index, page in enumerate(pages or []):
+        if page_index > 0:
+            # The table of this page ends and the next page starts with a table of its own
+            rows.append(items_page_break_html)
+            if page.carry_in != None:
+                rows.append(f'<tr class="carried-over"><td colspan="3">Übertrag</td><td>{convert_to_euro_string(template, page.carry_in)}</td></tr>\n')
+        append_items_rows_html(rows, invoice.lines[page.start:page.end], template)
+        if page.carry_out != None:
+            rows.append(f'<tr class="carry-over"><td colspan="3">Übertrag</td><td>{convert_to_euro_string(template, page.carry_out)}</td></tr>\n')
+    if pages == None:
+        append_items_rows_html(rows, invoice.lines, template)
+    return "".join(rows)
+
+
+def append_items_rows_html(rows, lines, template):
+    for line in lines:
+        if line.is_discount:
+            rows.append(f'<tr><td class="invoice-item-name">{line.name}</td><td> - </td><td> - </td><td>- {convert_to_euro_string(template, line.price)}</td></tr>\n')
+            continue
+        description = ""
+        if line.summary != "":
+            description = f'<br>{line.summary}'
+        rows.append(f'<tr><td class="invoice-item-name"><strong>{line.name}</strong>{description}</td><td>{convert_price_to_euro_string(template, line.price)}</td><td>{line.quantity}</td><td>{convert_to_euro_string(template, line.total)}</td></tr>\n')
+
+
+# Closes the items table and the page of invoice.html and opens the next page with the table header
+items_page_break_html = """        </tbody>
+    </table>
+</div>
+<div class="page">
+    <table class="invoice-table">
+        <thead>
+          <tr>
+            <th style="width: 60%; text-align: left;">Bezeichnung</th>
+            <th>Preis/Einheit</th>
+            <th>Menge</th>
+            <th>Betrag</th>
+          </tr>
+        </thead>
+        <tbody>
+"""
+
+
+# One "zzgl. Umsatzsteuer" row per VAT rate
+def create_vat_rows_html(invoice, template):
+    rows = []
+    for group in invoice.vat_groups:
+        rows.append(f'<tr><td colspan="2">zzgl. Umsatzsteuer</td><td>{convert_to_percent_string(group.vat)}</td><td>{convert_to_euro_string(template, group.tax)}</td></tr>\n')
+    return "".join(rows)
@@ -0,0 +1,165 @@
+# --metrics: how long the stages of the generator took, as json lines
+import os
+import sys
+import threading
+import time
+
+
+# The stages of one invoice in the order they run. A stage that an invoice doesn't need is left out.
+stage_names = ("arguments", "scratch", "template", "invoice", "number", "renderer", "pages", "html", "logo", "xml", "pdf", "commit", "archive")
+
+
+# Measures the stages of one invoice. lap() ends the current stage, so the stages add up to the total.
+# With a ProgressWriter (--progress) every finished stage is reported right away.
+class StageTimer:
+    def __init__(self, progress=None):
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.timings = {}
+        self.progress = progress
+        if progress != None:
+            progress.begin_invoice()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last_time
+        self.last_time = now
+        if self.progress != None:
+            self.progress.stage_done(stage)
+
+    # Seconds per stage and the total
+    def get_timings(self):
+        timings = {stage: round(seconds, 6) for stage, seconds in self.timings.items()}
+        timings["total"] = round(self.last_time - self.start_time, 6)
+        return timings
+
+
+# The target of --metrics: a file the records are appended to, "-" for stderr.
+# Without --metrics the path of the environment variable RECHNUNGS_ASSISTENT_METRICS is used.
+class MetricsWriter:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        if path == "-":
+            self.file = sys.stderr
+        else:
+            self.file = open(path, "a", encoding="utf-8")
+
+    # One record per line, e.g. {"type": "invoice", "ok": true, "invoiceNumber": "2024-05-1", ..., "timings": {"template": 0.0002, ...}}
+    def write(self, record):
+        # Imported here, so a run without metrics doesn't load json for the timer
+        import json
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        if self.file != sys.stderr:
+            self.file.close()
+
+
+# --progress: json lines on stdout while the generator runs, for the job queue of the app.
+#   {"type": "start", "count": 3}                             count is null if it is not known
+#   {"type": "stage", "invoice": 1, "stage": "xml", "seconds": 0.012}   a stage of the invoice is done
+#   {"type": "invoice", "ok": true, "invoicePath": ..., ...}   the record of get_invoice_record()
+#   {"type": "progress", "done": 1, "failed": 0, "count": 3, "seconds": 0.05, "eta": 0.1}
+# eta is the seconds the rest of the invoices will take at the speed so far.
+class ProgressWriter:
+    def __init__(self, file):
+        self.file = file
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.count = None
+        self.started = 0
+        self.done = 0
+        self.failed = 0
+
+    def write(self, record):
+        import json
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def get_seconds(self):
+        return round(time.perf_counter() - self.start_time, 6)
+
+    def start(self, count):
+        self.count = count
+        self.write({"type": "start", "count": count})
+
+    def begin_invoice(self):
+        self.started += 1
+
+    def stage_done(self, stage):
+        self.write({"type": "stage", "invoice": self.started, "stage": stage, "seconds": self.get_seconds()})
+
+    def invoice_done(self, record):
+        self.done += 1
+        if not record["ok"]:
+            self.failed += 1
+        seconds = self.get_seconds()
+        eta = None
+        if self.count != None:
+            eta = round(seconds / self.done * max(0, self.count - self.done), 3)
+        self.write(record)
+        self.write({"type": "progress", "done": self.done, "failed": self.failed, "count": self.count, "seconds": seconds, "eta": eta})
+
+    def close(self):
+        self.file.close()
+
+
+def open_metrics(params):
+    path = params.get("metrics") or os.environ.get("RECHNUNGS_ASSISTENT_METRICS")
+    if path in (None, ""):
+        return None
+    return MetricsWriter(path)
+
+
+# The record of one invoice: the result without the documents
+def get_invoice_record(result, error=None, row_number=None):
+    record = {"type": "invoice"}
+    if row_number != None:
+        record["row"] = row_number
+    if error != None:
+        record["ok"] = False
+        record["error"] = error
+        return record
+    record["ok"] = True
+    for key, value in result.items():
+        if key != "documents":
+            record[key] = value
+    return record
+
+
+# Nearest-rank percentile of sorted values
+def get_percentile(values, percent):
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+# Collects the timings of the invoices of a batch run and sums them up per stage
+class StageStatistics:
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, timings):
+        for stage, seconds in timings.items():
+            self.timings.setdefault(stage, []).append(seconds)
+
+    # {"template": {"count": 1000, "sum": 0.21, "p50": 0.0002, "p90": ..., "p99": ..., "max": ...}, ...}
+    def get_summary(self, stages=stage_names + ("total",)):
+        summary = {}
+        for stage in stages:
+            if stage not in self.timings:
+                continue
+            values = sorted(self.timings[stage])
+            summary[stage] = {
+                "count": len(values),
+                "sum": round(sum(values), 6),
+                "p50": get_percentile(values, 50),
+                "p90": get_percentile(values, 90),
+                "p99": get_percentile(values, 99),
+                "max": values[-1],
+            }
+        return summary
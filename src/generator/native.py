@@ -0,0 +1,431 @@
+# NATIVE RENDERER
+# Writes the pdf directly, without a browser. It lays out the fixed structure of
+# html/invoice.html (header, sender and recipient, items table, totals, hint, closing)
+# with the standard pdf fonts Helvetica and Helvetica-Bold.
+# The pdf gets the invoice.xml attached as factur-x.xml (AFRelationship /Alternative).
+# It is not a PDF/A-3 file (the standard fonts are not embedded and there is no output
+# intent), so the XMP metadata doesn't claim Factur-X conformance. The e-invoice is the
+# xml, which is also saved next to the pdf.
+import datetime
+import hashlib
+import struct
+import zlib
+
+from .util import InvoiceError
+from .template import compile_template, render_template
+from .invoice import convert_price_to_euro_string, convert_to_euro_string, convert_to_percent_string
+from .zugferd import escape_xml
+from .pagination import CARRY_OVER_LABEL, CELL_PADDING, CONTENT_WIDTH, FONT_SIZE, LINE_HEIGHT, PAGE_HEIGHT, PAGE_MARGIN, PAGE_WIDTH, ROW_HEIGHT, TABLE_COLUMNS, get_text_width, html_to_lines, measure_item_rows, paginate_items, wrap_text
+
+
+GREY = 0.502
+
+
+def pdf_number(value):
+    text = "%.3f" % value
+    return text.rstrip("0").rstrip(".").encode()
+
+
+def pdf_string(text):
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r") + b")"
+
+
+# Text strings outside of the page content (file names, document info) are UTF-16
+def pdf_text_string(text):
+    return b"<feff" + text.encode("utf-16-be").hex().encode() + b">"
+
+
+def pdf_date(date):
+    offset = date.strftime("%z")
+    return "D:" + date.strftime("%Y%m%d%H%M%S") + offset[:3] + "'" + offset[3:] + "'"
+
+
+# The objects of a pdf file. Objects are numbered from 1 in the order they are added.
+class PdfWriter:
+    def __init__(self):
+        self.objects = []
+
+    def reserve(self):
+        self.objects.append(None)
+        return len(self.objects)
+
+    def add(self, body, number=None):
+        if number == None:
+            number = self.reserve()
+        self.objects[number - 1] = body
+        return number
+
+    def add_stream(self, dictionary, data, number=None, compress=True):
+        if compress:
+            data = zlib.compress(data)
+            dictionary += b"/Filter/FlateDecode"
+        return self.add(b"<<" + dictionary + b"/Length %d>>\nstream\n" % len(data) + data + b"\nendstream", number)
+
+    def write(self, path, root, info):
+        output = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(len(output))
+            output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref_offset = len(output)
+        output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1)
+        for offset in offsets:
+            output += b"%010d 00000 n \n" % offset
+        file_id = hashlib.md5(output).hexdigest().encode()
+        output += b"trailer\n<</Size %d/Root %d 0 R/Info %d 0 R/ID[<%s><%s>]>>\nstartxref\n%d\n%%%%EOF\n" % (len(self.objects) + 1, root, info, file_id, file_id, xref_offset)
+        with open(path, "wb") as f:
+            f.write(output)
+
+
+# Undoes the png filter of every row. Returns the rows without the filter byte.
+def unfilter_png_rows(data, height, row_length, pixel_length):
+    rows = []
+    previous = bytearray(row_length)
+    position = 0
+    for _ in range(height):
+        filter_type = data[position]
+        row = bytearray(data[position + 1:position + 1 + row_length])
+        position += 1 + row_length
+        if filter_type == 1:
+            for i in range(pixel_length, row_length):
+                row[i] = (row[i] + row[i - pixel_length]) & 255
+        elif filter_type == 2:
+            for i in range(row_length):
+                row[i] = (row[i] + previous[i]) & 255
+        elif filter_type == 3:
+            for i in range(row_length):
+                left = row[i - pixel_length] if i >= pixel_length else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 255
+        elif filter_type == 4:
+            for i in range(row_length):
+                left = row[i - pixel_length] if i >= pixel_length else 0
+                up = previous[i]
+                up_left = previous[i - pixel_length] if i >= pixel_length else 0
+                estimate = left + up - up_left
+                distance_left = abs(estimate - left)
+                distance_up = abs(estimate - up)
+                distance_up_left = abs(estimate - up_left)
+                if distance_left <= distance_up and distance_left <= distance_up_left:
+                    predictor = left
+                elif distance_up <= distance_up_left:
+                    predictor = up
+                else:
+                    predictor = up_left
+                row[i] = (row[i] + predictor) & 255
+        rows.append(row)
+        previous = row
+    return rows
+
+
+# Adds a png as image XObject to the pdf. Returns (object number, width, height).
+# Without transparency the compressed png data is used as it is. With an alpha channel
+# the image is split into the colors and a soft mask.
+def add_png_image(writer, png_path):
+    with open(png_path, "rb") as f:
+        data = f.read()
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise InvoiceError(f'The logo is not a png file: "{png_path}"')
+    header = None
+    palette = b""
+    image_data = []
+    position = 8
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            palette = chunk
+        elif chunk_type == b"IDAT":
+            image_data.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+    if header == None:
+        raise InvoiceError(f'The logo is not a png file: "{png_path}"')
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if interlace != 0:
+        raise InvoiceError(f'Interlaced png logos are not supported by the native renderer: "{png_path}"')
+    colors = {0: 1, 2: 3, 3: 1, 4: 1, 6: 3}[color_type]
+    if color_type == 3:
+        color_space = b"[/Indexed/DeviceRGB %d<%s>]" % (len(palette) // 3 - 1, palette.hex().encode())
+    elif colors == 3:
+        color_space = b"/DeviceRGB"
+    else:
+        color_space = b"/DeviceGray"
+    image_data = b"".join(image_data)
+
+    if color_type not in (4, 6):
+        dictionary = b"/Type/XObject/Subtype/Image/Width %d/Height %d/ColorSpace%s/BitsPerComponent %d/Filter/FlateDecode/DecodeParms<</Predictor 15/Colors %d/BitsPerComponent %d/Columns %d>>" % (width, height, color_space, bit_depth, colors, bit_depth, width)
+        number = writer.add_stream(dictionary, image_data, compress=False)
+        return number, width, height
+
+    if bit_depth != 8:
+        raise InvoiceError(f'16 bit png logos with transparency are not supported by the native renderer: "{png_path}"')
+    pixel_length = colors + 1
+    rows = unfilter_png_rows(zlib.decompress(image_data), height, width * pixel_length, pixel_length)
+    alpha = bytearray()
+    for row in rows:
+        alpha += row[colors::pixel_length]
+        del row[colors::pixel_length]
+    mask = writer.add_stream(b"/Type/XObject/Subtype/Image/Width %d/Height %d/ColorSpace/DeviceGray/BitsPerComponent 8" % (width, height), bytes(alpha))
+    dictionary = b"/Type/XObject/Subtype/Image/Width %d/Height %d/ColorSpace%s/BitsPerComponent 8/SMask %d 0 R" % (width, height, color_space, mask)
+    number = writer.add_stream(dictionary, b"".join(rows))
+    return number, width, height
+
+
+# Places text and lines on the pages. y is measured from the top of the page like in html.
+class PdfLayout:
+    def __init__(self):
+        self.pages = []
+        self.content = None
+        self.y = 0
+        # Vertical margins of paragraphs collapse like in html
+        self.margin = 0
+        self.new_page()
+
+    def new_page(self):
+        self.content = []
+        self.pages.append(self.content)
+        self.y = PAGE_MARGIN
+        self.margin = 0
+
+    def space_left(self):
+        return PAGE_HEIGHT - PAGE_MARGIN - self.y
+
+    # Starts a new page if height does not fit on this one anymore. Returns True if it did.
+    def ensure_space(self, height):
+        if height > self.space_left() and self.y > PAGE_MARGIN:
+            self.new_page()
+            return True
+        return False
+
+    def add_margin(self, margin):
+        self.margin = max(self.margin, margin)
+
+    def apply_margin(self):
+        self.y += self.margin
+        self.margin = 0
+
+    # Draws one line of text, the line box starts at y (top) and is line_height high
+    def text(self, x, y, text, size=FONT_SIZE, bold=False, grey=False, align="left", line_height=None):
+        if text == "":
+            return
+        if line_height == None:
+            line_height = size * 1.5
+        if align == "right":
+            x -= get_text_width(text, size, bold)
+        # The baseline of Arial in a css line box
+        baseline = y + (line_height - 1.117 * size) / 2 + 0.905 * size
+        color = b"%s g " % pdf_number(GREY) if grey else b""
+        self.content.append(b"BT %s/%s %s Tf %s %s Td %s Tj ET%s\n" % (
+            color, b"F2" if bold else b"F1", pdf_number(size), pdf_number(x), pdf_number(PAGE_HEIGHT - baseline), pdf_string(text), b" 0 g" if grey else b""))
+
+    def rule(self, x, y, width, thickness=0.75):
+        self.content.append(b"%s %s %s %s re f\n" % (pdf_number(x), pdf_number(PAGE_HEIGHT - y - thickness), pdf_number(width), pdf_number(thickness)))
+
+    def image(self, name, x, y, width, height):
+        self.content.append(b"q %s 0 0 %s %s %s cm /%s Do Q\n" % (pdf_number(width), pdf_number(height), pdf_number(x), pdf_number(PAGE_HEIGHT - y - height), name))
+
+    # A paragraph over the full width. lines: [(text, bold), ...]
+    def paragraph(self, lines, margin=FONT_SIZE):
+        self.add_margin(margin)
+        self.apply_margin()
+        for text, bold in lines:
+            for line in wrap_text(text, CONTENT_WIDTH, FONT_SIZE, bold) or [""]:
+                self.ensure_space(LINE_HEIGHT)
+                self.text(PAGE_MARGIN, self.y, line, bold=bold)
+                self.y += LINE_HEIGHT
+        self.add_margin(margin)
+
+
+class NativeRenderer:
+    # values are the values of the #!KEY placeholders of invoice.html.
+    # The xml is attached if xml_path is not None.
+    def print_invoice(self, values, invoice, template, logo_path, xml_path, pdf_path):
+        # A line of invoice.html: left out if one of its placeholders has no value
+        def fill(line):
+            return render_template(compile_template(line), values)[0]
+
+        writer = PdfWriter()
+        layout = PdfLayout()
+        x = PAGE_MARGIN
+        top = PAGE_MARGIN
+
+        # Logo, sender and recipient in the left half
+        logo = None
+        try:
+            logo = add_png_image(writer, logo_path)
+        except (InvoiceError, OSError, KeyError, struct.error, zlib.error) as e:
+            print(f"Error: Could not draw the logo: {e}")
+        y = top
+        if logo != None:
+            logo_height = 72
+            layout.image(b"Im1", x, y, logo_height * logo[1] / logo[2], logo_height)
+        y += 72 + 67.5
+        sender = fill("#!SEN-NAME - #!SEN-STREET, #!SEN-ZIP #!SEN-CITY")
+        if sender != "":
+            layout.text(x, y, sender, size=7.5)
+            y += 7.5 * 1.5
+            layout.rule(x, y + 1.5, get_text_width(sender, 7.5))
+        y += 2.25 + 7.5
+        for line in ("#!REC-COMPANY", "#!REC-NAME", "#!REC-STREET", "#!REC-ZIP #!REC-CITY"):
+            text = fill(line)
+            if text != "":
+                layout.text(x, y, text)
+                y += LINE_HEIGHT
+        header_bottom = y
+
+        # Sender info on the right, description and data next to each other
+        y = top + 52.5
+        descriptions = html_to_lines(values.get("SEN-INFO-DESCRIPTION") or "")
+        data = html_to_lines(values.get("SEN-INFO-DATA") or "")
+        for i in range(max(len(descriptions), len(data))):
+            if i < len(descriptions):
+                layout.text(x + CONTENT_WIDTH * 0.68, y, descriptions[i][0], bold=descriptions[i][1], grey=True, align="right")
+            if i < len(data):
+                layout.text(x + CONTENT_WIDTH * 0.70, y, data[i][0], bold=data[i][1], grey=True)
+            y += LINE_HEIGHT
+        header_bottom = max(header_bottom, y)
+
+        # The text starts below the header, but not before the 330px spacer, then 5 <br>
+        layout.y = max(top + 247.5, header_bottom) + 5 * LINE_HEIGHT
+
+        heading_size = FONT_SIZE * 1.17
+        layout.add_margin(heading_size)
+        layout.apply_margin()
+        layout.text(x, layout.y, "Rechnung", size=heading_size, bold=True)
+        layout.y += heading_size * 1.5
+        layout.add_margin(heading_size)
+
+        layout.paragraph(html_to_lines(fill("#!SALUTATION")))
+        layout.paragraph(html_to_lines(fill("#!MESSAGE")))
+        layout.apply_margin()
+
+        # Items table, split into pages by paginate_items()
+        column_x = [x]
+        for column_width in TABLE_COLUMNS:
+            column_x.append(column_x[-1] + column_width * CONTENT_WIDTH)
+
+        def table_header():
+            y = layout.y + CELL_PADDING
+            layout.text(column_x[0] + CELL_PADDING, y, "Bezeichnung", bold=True)
+            for column, title in ((1, "Preis/Einheit"), (2, "Menge"), (3, "Betrag")):
+                layout.text(column_x[column + 1] - CELL_PADDING, y, title, bold=True, align="right")
+            layout.y += ROW_HEIGHT
+            layout.rule(x, layout.y, CONTENT_WIDTH)
+            layout.y += 0.75
+
+        def carry_over_row(subtotal):
+            y = layout.y + CELL_PADDING
+            layout.text(column_x[3] - CELL_PADDING, y, CARRY_OVER_LABEL, align="right")
+            layout.text(column_x[4] - CELL_PADDING, y, convert_to_euro_string(template, subtotal), align="right")
+            layout.y += ROW_HEIGHT
+
+        totals = [("Gesamtbetrag (Netto)", None, convert_to_euro_string(template, invoice.sum_netto), False)]
+        for group in invoice.vat_groups:
+            totals.append(("zzgl. Umsatzsteuer", convert_to_percent_string(group.vat), convert_to_euro_string(template, group.tax), False))
+        totals.append(("Gesamtbetrag (Brutto)", None, convert_to_euro_string(template, invoice.sum_brutto), True))
+
+        rows = measure_item_rows(invoice)
+        pages = paginate_items(rows, layout.space_left(), PAGE_HEIGHT - 2 * PAGE_MARGIN, len(totals) * ROW_HEIGHT + 0.75)
+        for page_index, page in enumerate(pages):
+            if page_index > 0:
+                layout.new_page()
+            elif page.start == page.end and len(pages) > 1:
+                # The table starts on the next page
+                continue
+            table_header()
+            if page.carry_in != None:
+                carry_over_row(page.carry_in)
+            for row in rows[page.start:page.end]:
+                y = layout.y + CELL_PADDING
+                for i in range(len(row.lines)):
+                    layout.text(column_x[0] + CELL_PADDING, y + i * LINE_HEIGHT, row.lines[i][0], bold=row.lines[i][1])
+                line = row.line
+                if line.is_discount:
+                    cells = ("-", "-", "- " + convert_to_euro_string(template, line.price))
+                else:
+                    cells = (convert_price_to_euro_string(template, line.price), line.quantity, convert_to_euro_string(template, line.total))
+                for column in range(3):
+                    layout.text(column_x[column + 2] - CELL_PADDING, y, cells[column], align="right")
+                layout.y += row.height
+            if page.carry_out != None:
+                layout.rule(x, layout.y, CONTENT_WIDTH)
+                layout.y += 0.75
+                carry_over_row(page.carry_out)
+
+        # Totals, kept together on one page with the last rows
+        layout.ensure_space(len(totals) * ROW_HEIGHT + 0.75)
+        layout.rule(x, layout.y, CONTENT_WIDTH)
+        layout.y += 0.75
+        for label, percent, amount, bold in totals:
+            y = layout.y + CELL_PADDING
+            layout.text(column_x[2] - CELL_PADDING, y, label, bold=bold, align="right")
+            if percent != None:
+                layout.text(column_x[3] - CELL_PADDING, y, percent, bold=bold, align="right")
+            layout.text(column_x[4] - CELL_PADDING, y, amount, bold=bold, align="right")
+            layout.y += ROW_HEIGHT
+
+        layout.paragraph(html_to_lines(fill("#!HINT")))
+        layout.apply_margin()
+        # The closing and the name are not split up
+        closing = html_to_lines(fill("#!CLOSING")) + [("", False)] + html_to_lines(fill("#!SEN-NAME"))
+        layout.ensure_space(len(closing) * LINE_HEIGHT)
+        layout.paragraph(closing, margin=0)
+
+        self.write_pdf(writer, layout, logo, invoice, xml_path, pdf_path)
+
+    def write_pdf(self, writer, layout, logo, invoice, xml_path, pdf_path):
+        now = datetime.datetime.now().astimezone()
+        title = f"Rechnung {invoice.number}"
+
+        regular_font = writer.add(b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica/Encoding/WinAnsiEncoding>>")
+        bold_font = writer.add(b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica-Bold/Encoding/WinAnsiEncoding>>")
+        resources = b"/Font<</F1 %d 0 R/F2 %d 0 R>>" % (regular_font, bold_font)
+        if logo != None:
+            resources += b"/XObject<</Im1 %d 0 R>>" % logo[0]
+
+        pages = writer.reserve()
+        page_numbers = []
+        for content in layout.pages:
+            contents = writer.add_stream(b"", b"".join(content))
+            page_numbers.append(writer.add(b"<</Type/Page/Parent %d 0 R/MediaBox[0 0 %s %s]/Resources<<%s>>/Contents %d 0 R>>" % (
+                pages, pdf_number(PAGE_WIDTH), pdf_number(PAGE_HEIGHT), resources, contents)))
+        writer.add(b"<</Type/Pages/Kids[%s]/Count %d>>" % (b" ".join(b"%d 0 R" % number for number in page_numbers), len(page_numbers)), pages)
+
+        catalog = b"/Type/Catalog/Pages %d 0 R" % pages
+        if xml_path != None:
+            with open(xml_path, "rb") as f:
+                xml_data = f.read()
+            embedded_file = writer.add_stream(b"/Type/EmbeddedFile/Subtype/text#2Fxml/Params<</Size %d/ModDate%s>>" % (len(xml_data), pdf_string(pdf_date(now))), xml_data)
+            file_spec = writer.add(b"<</Type/Filespec/F%s/UF%s/Desc%s/AFRelationship/Alternative/EF<</F %d 0 R/UF %d 0 R>>>>" % (
+                pdf_string("factur-x.xml"), pdf_text_string("factur-x.xml"), pdf_string("Factur-X Rechnung"), embedded_file, embedded_file))
+            metadata = writer.add_stream(b"/Type/Metadata/Subtype/XML", self.create_xmp(title, now).encode(), compress=False)
+            catalog += b"/Names<</EmbeddedFiles<</Names[%s %d 0 R]>>>>/AF[%d 0 R]/Metadata %d 0 R" % (pdf_string("factur-x.xml"), file_spec, file_spec, metadata)
+        root = writer.add(b"<<" + catalog + b">>")
+        info = writer.add(b"<</Title%s/Producer%s/CreationDate%s/ModDate%s>>" % (
+            pdf_text_string(title), pdf_string("Rechnungs-Assistent"), pdf_string(pdf_date(now)), pdf_string(pdf_date(now))))
+        writer.write(pdf_path, root, info)
+
+    # XMP metadata without the Factur-X fields, they are only allowed in a PDF/A-3 file
+    def create_xmp(self, title, now):
+        date = now.isoformat(timespec="seconds")
+        return (
+            '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+            '  <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+            '    <rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmlns:pdf="http://ns.adobe.com/pdf/1.3/">\n'
+            f'      <dc:title><rdf:Alt><rdf:li xml:lang="x-default">{escape_xml(title)}</rdf:li></rdf:Alt></dc:title>\n'
+            f'      <xmp:CreateDate>{date}</xmp:CreateDate>\n'
+            f'      <xmp:ModifyDate>{date}</xmp:ModifyDate>\n'
+            '      <pdf:Producer>Rechnungs-Assistent</pdf:Producer>\n'
+            '    </rdf:Description>\n'
+            '  </rdf:RDF>\n'
+            '</x:xmpmeta>\n'
+            '<?xpacket end="w"?>'
+        )
+
+    def close(self):
+        pass
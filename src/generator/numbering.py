@@ -0,0 +1,128 @@
+# Handing out invoice numbers
+import os
+import contextlib
+import datetime
+import fcntl
+import re
+
+from .util import getValue, get_all_lines_from_file, saveValue
+
+
+# Ensure that this directory exists: invoices/currentyear/currentmonth
+def get_invoice_dir(params):
+    current_year = datetime.datetime.now().strftime("%Y")
+    current_month = datetime.datetime.now().strftime("%m")
+    # if the invoice directory does not exist, create it
+    invoice_dir = params["invoiceDir"] + "/" + current_year + "/" + current_month
+    if not os.path.exists(invoice_dir):
+        os.makedirs(invoice_dir, exist_ok=True)
+    return invoice_dir
+
+
+@contextlib.contextmanager
+def invoice_number_lock(directories):
+    with open(f'{directories["config_dir"]}/invoice-numbers.lock', "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+# Number of the last invoice saved in invoice_dir. It is stored in invoice_dir/.invoice-sequence,
+# which is rebuilt from the Rechnung-YYYY-MM-<number>.pdf and .xml files if it is missing.
+# Call only while holding the invoice_number_lock().
+def read_invoice_sequence(invoice_dir):
+    lines = get_all_lines_from_file(f"{invoice_dir}/.invoice-sequence")
+    if len(lines) > 0 and lines[0].strip().isdigit():
+        return int(lines[0])
+    last_number = 0
+    for file in os.listdir(invoice_dir):
+        match = re.match(r"^Rechnung-\d{4}-\d{2}-(\d+)\.(pdf|xml)$", file)
+        if match != None:
+            last_number = max(last_number, int(match.group(1)))
+    write_invoice_sequence(invoice_dir, last_number)
+    return last_number
+
+
+def write_invoice_sequence(invoice_dir, number):
+    with open(f"{invoice_dir}/.invoice-sequence.tmp", "w") as f:
+        f.write(str(number) + "\n")
+    os.replace(f"{invoice_dir}/.invoice-sequence.tmp", f"{invoice_dir}/.invoice-sequence")
+
+
+def get_number_prefix():
+    return datetime.datetime.now().strftime("%Y-%m-")
+
+
+def write_counter_lines(counter_path, counter_lines):
+    with open(counter_path + ".tmp", "w") as f:
+        f.writelines(counter_lines)
+    os.replace(counter_path + ".tmp", counter_path)
+
+
+# Returns count invoice numbers in the format YYYY-MM-<number>.
+# The numbers follow the last invoice saved in the invoice folder and the numbers
+# already handed out, which are stored in the config dir. A lock file makes sure that
+# two generators running at the same time never get the same number.
+# Numbers that were given back with release_invoice_numbers() but could not be taken back
+# from the counter, because another generator took numbers after them, come first.
+# With reserve=False the numbers are only looked up and not stored as handed out.
+def allocate_invoice_numbers(directories, invoice_dir, count, reserve=True):
+    counter_path = f'{directories["config_dir"]}/invoice-numbers.csv'
+    counter_key = os.path.realpath(invoice_dir)
+    prefix = get_number_prefix()
+    with invoice_number_lock(directories):
+        counter_lines = get_all_lines_from_file(counter_path)
+        last_number = max(read_invoice_sequence(invoice_dir), int(getValue(counter_lines, counter_key, "0")))
+        free_numbers = [number for number in getValue(counter_lines, counter_key + ":free").split(",") if number.startswith(prefix)]
+
+        numbers = free_numbers[:count]
+        numbers += [prefix + str(last_number + i) for i in range(1, count - len(numbers) + 1)]
+
+        if reserve:
+            counter_lines = saveValue(counter_lines, counter_key, str(last_number + count - min(count, len(free_numbers))))
+            counter_lines = saveValue(counter_lines, counter_key + ":free", ",".join(free_numbers[count:]))
+            write_counter_lines(counter_path, counter_lines)
+    return numbers
+
+
+# Gives back numbers of allocate_invoice_numbers() that no invoice was saved under, e.g. because
+# the invoice failed or the batch was cancelled. If they are the last numbers handed out, the
+# counter goes back, so the next invoice gets the first of them. Otherwise (another generator
+# took numbers in the meantime) the next invoices take them before any new number.
+# Numbers of a past month are dropped, every month starts at 1.
+def release_invoice_numbers(directories, invoice_dir, numbers):
+    counter_path = f'{directories["config_dir"]}/invoice-numbers.csv'
+    counter_key = os.path.realpath(invoice_dir)
+    prefix = get_number_prefix()
+    with invoice_number_lock(directories):
+        counter_lines = get_all_lines_from_file(counter_path)
+        free = set(number for number in getValue(counter_lines, counter_key + ":free").split(",") if number.startswith(prefix))
+        sequence = read_invoice_sequence(invoice_dir)
+        for number in numbers:
+            if not number.startswith(prefix) or not number[len(prefix):].isdigit():
+                continue
+            # A number a document was saved under stays used, e.g. the invoices a cancelled
+            # parallel batch still finished
+            if any(os.path.exists(f"{invoice_dir}/Rechnung-{number}.{extension}") for extension in ("pdf", "xml", "html")):
+                if int(number[len(prefix):]) > sequence:
+                    sequence = int(number[len(prefix):])
+                    write_invoice_sequence(invoice_dir, sequence)
+                continue
+            free.add(number)
+        counter = int(getValue(counter_lines, counter_key, "0"))
+        while counter > sequence and prefix + str(counter) in free:
+            free.remove(prefix + str(counter))
+            counter -= 1
+        counter_lines = saveValue(counter_lines, counter_key, str(counter))
+        counter_lines = saveValue(counter_lines, counter_key + ":free", ",".join(sorted(free, key=lambda number: int(number[len(prefix):]))))
+        write_counter_lines(counter_path, counter_lines)
+
+
+# Called after the pdf of invoice_number was saved in invoice_dir.
+def commit_invoice_number(directories, invoice_dir, invoice_number):
+    prefix = get_number_prefix()
+    if not invoice_number.startswith(prefix) or not invoice_number[len(prefix):].isdigit():
+        return
+    number = int(invoice_number[len(prefix):])
+    with invoice_number_lock(directories):
+        if number > read_invoice_sequence(invoice_dir):
+            write_invoice_sequence(invoice_dir, number)
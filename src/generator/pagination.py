@@ -0,0 +1,247 @@
+# PAGINATION
+# Splits the items table into pages, for the native renderer and for the html chromium prints.
+# The rows are measured with the metrics of Helvetica (Arial, the font of invoice.html, has the
+# same widths). Every page repeats the table header, a page that doesn't end the table ends with
+# the subtotal so far ("Übertrag"), which the next page starts with. The totals are kept together
+# with the last rows.
+import decimal
+import functools
+import html
+import itertools
+import re
+import unicodedata
+
+from .template import compile_template, render_template
+
+
+# Sizes in pt. One css px of invoice.html is 0.75 pt.
+PAGE_WIDTH = 595.28
+PAGE_HEIGHT = 841.89
+PAGE_MARGIN = 56.69
+CONTENT_WIDTH = PAGE_WIDTH - 2 * PAGE_MARGIN
+FONT_SIZE = 9.75
+LINE_HEIGHT = FONT_SIZE * 1.5
+CELL_PADDING = 1.5
+# Bezeichnung, Preis/Einheit, Menge, Betrag
+TABLE_COLUMNS = (0.6, 0.15, 0.1, 0.15)
+
+# Widths of the characters 32-126 in 1/1000 of the font size (from the Adobe font metrics)
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+# Characters outside of ASCII that are not just a letter with an accent
+SPECIAL_CHARACTER_WIDTHS = {
+    "ß": 611, "€": 556, "§": 556, "°": 400, "–": 556, "—": 1000, "…": 1000, "•": 350,
+    "„": 333, "“": 333, "”": 333, "‚": 222, "‘": 222, "’": 222, "«": 556, "»": 556,
+    "µ": 556, "²": 333, "³": 333, "×": 584, "·": 278, "©": 737, "®": 737, "\xa0": 278,
+}
+# No character is wider than this, a text with few characters fits without measuring it
+MAX_CHARACTER_WIDTH = 1015
+
+
+@functools.lru_cache(1024)
+def get_character_width(character, bold):
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    if " " <= character <= "~":
+        return widths[ord(character) - 32]
+    if character in SPECIAL_CHARACTER_WIDTHS:
+        return SPECIAL_CHARACTER_WIDTHS[character]
+    # Ä is as wide as A
+    base = unicodedata.normalize("NFD", character)[0]
+    if " " <= base <= "~":
+        return widths[ord(base) - 32]
+    return 556
+
+
+def get_text_width(text, size, bold=False):
+    return sum(get_character_width(character, bold) for character in text) * size / 1000
+
+
+# The width of a word in 1/1000 of the font size. The names and summaries of long invoices
+# repeat the same words, so they are only measured once.
+@functools.lru_cache(4096)
+def get_word_units(word, bold):
+    return sum(get_character_width(character, bold) for character in word)
+
+
+# Breaks the text into lines that fit into width. A single word that is too long stays on its own line.
+# The line grows word by word, so its width is added up instead of measuring the line again.
+def wrap_text(text, width, size, bold=False):
+    if len(text) * MAX_CHARACTER_WIDTH * size / 1000 <= width:
+        line = " ".join(text.split())
+        return [line] if line != "" else []
+    lines = []
+    line = []
+    line_units = 0
+    space_units = get_character_width(" ", bold)
+    for word in text.split():
+        word_units = get_word_units(word, bold)
+        if len(line) > 0 and (line_units + space_units + word_units) * size / 1000 > width:
+            lines.append(" ".join(line))
+            line = [word]
+            line_units = word_units
+        elif len(line) > 0:
+            line.append(word)
+            line_units += space_units + word_units
+        else:
+            line = [word]
+            line_units = word_units
+    if len(line) > 0:
+        lines.append(" ".join(line))
+    return lines
+
+
+# Turns a html snippet like "<strong>Company</strong> <br> Street" into its lines: [(text, bold), ...]
+def html_to_lines(text):
+    if text.strip() == "":
+        return []
+    if "<" not in text and "&" not in text:
+        return [(" ".join(text.split()), False)]
+    lines = []
+    for part in re.split(r"<br\s*/?>", text, flags=re.IGNORECASE):
+        bold = re.search(r"<(strong|b)\b", part, flags=re.IGNORECASE) != None
+        part = html.unescape(re.sub(r"<[^>]*>", "", part))
+        lines.append((" ".join(part.split()), bold))
+    # The <br> at the end of the last line does not start another line
+    if len(lines) > 1 and lines[-1][0] == "":
+        lines.pop()
+    return lines
+
+
+ROW_HEIGHT = LINE_HEIGHT + 2 * CELL_PADDING
+# The header row and the line below it
+HEADER_HEIGHT = ROW_HEIGHT + 0.75
+# The "Übertrag" row at the end of a page and the line above it
+CARRY_OUT_HEIGHT = ROW_HEIGHT + 0.75
+CARRY_OVER_LABEL = "Übertrag"
+# Chromium's fonts and the css layout differ a little from the measured sizes, the html
+# leaves some space at the end of every page for it
+HTML_PAGE_RESERVE = 2 * LINE_HEIGHT
+
+
+# One measured row of the items table. lines: [(text, bold), ...] of the first column.
+class ItemRow:
+    def __init__(self, line, lines):
+        self.line = line
+        self.lines = lines
+        self.height = max(1, len(lines)) * LINE_HEIGHT + 2 * CELL_PADDING
+
+
+def measure_item_rows(invoice):
+    name_width = TABLE_COLUMNS[0] * CONTENT_WIDTH - 2 * CELL_PADDING
+    rows = []
+    for line in invoice.lines:
+        if line.is_discount:
+            lines = [(text, False) for text in wrap_text(line.name, name_width, FONT_SIZE)]
+        else:
+            lines = [(text, True) for text in wrap_text(line.name, name_width, FONT_SIZE, True) or [""]]
+            # The summary below the name is not bold
+            for summary, summary_bold in html_to_lines(line.summary):
+                lines += [(text, summary_bold) for text in wrap_text(summary, name_width, FONT_SIZE, summary_bold) or [""]]
+        rows.append(ItemRow(line, lines))
+    return rows
+
+
+# The rows start:end of one page. carry_in is the subtotal the page starts with, carry_out the
+# one it ends with, None on the first and the last page.
+class ItemPage:
+    def __init__(self, start, end, carry_in, carry_out):
+        self.start = start
+        self.end = end
+        self.carry_in = carry_in
+        self.carry_out = carry_out
+
+
+# Splits the measured rows into pages. first_page_space is the height from the top of the table
+# to the bottom margin of the first page, page_space the one of the following pages.
+# A first page without rows means the table starts on the next page.
+def paginate_items(rows, first_page_space, page_space, totals_height):
+    pages = []
+    # remaining_heights[i]: the height of the rows i to the end
+    remaining_heights = list(itertools.accumulate(row.height for row in reversed(rows)))[::-1] + [0]
+    start = 0
+    space = first_page_space
+    subtotal = decimal.Decimal(0)
+    carry_in = None
+    while True:
+        used = HEADER_HEIGHT + (ROW_HEIGHT if carry_in != None else 0)
+        # The rest of the table fits onto this page
+        if used + remaining_heights[start] + totals_height <= space:
+            pages.append(ItemPage(start, len(rows), carry_in, None))
+            return pages
+        end = start
+        while end < len(rows) and used + rows[end].height + CARRY_OUT_HEIGHT <= space:
+            used += rows[end].height
+            end += 1
+        if end == len(rows):
+            # The totals don't fit below the last rows, one row goes to the next page with them
+            if end - start > 1:
+                end -= 1
+            else:
+                pages.append(ItemPage(start, len(rows), carry_in, None))
+                return pages
+        elif end == start:
+            if len(pages) == 0 and space < page_space:
+                # Not even one row fits below the text of the first page
+                pages.append(ItemPage(start, start, None, None))
+                space = page_space
+                continue
+            # A row higher than a page gets a page of its own
+            end += 1
+        for row in rows[start:end]:
+            subtotal += row.line.total
+        pages.append(ItemPage(start, end, carry_in, subtotal))
+        carry_in = subtotal
+        start = end
+        space = page_space
+
+
+# The height from the top of the first page to the items table: the same layout as
+# NativeRenderer.print_invoice() uses, for the html chromium prints
+def measure_table_top(values):
+    def fill(line):
+        return render_template(compile_template(line), values)[0]
+
+    top = PAGE_MARGIN
+    y = top + 72 + 67.5
+    if fill("#!SEN-NAME - #!SEN-STREET, #!SEN-ZIP #!SEN-CITY") != "":
+        y += 7.5 * 1.5
+    y += 2.25 + 7.5
+    for line in ("#!REC-COMPANY", "#!REC-NAME", "#!REC-STREET", "#!REC-ZIP #!REC-CITY"):
+        if fill(line) != "":
+            y += LINE_HEIGHT
+    info_lines = max(len(html_to_lines(values.get("SEN-INFO-DESCRIPTION") or "")), len(html_to_lines(values.get("SEN-INFO-DATA") or "")))
+    y = max(top + 247.5, y, top + 52.5 + info_lines * LINE_HEIGHT) + 5 * LINE_HEIGHT
+
+    # "Rechnung", then the salutation and the message. Their margins collapse like in html.
+    heading_size = FONT_SIZE * 1.17
+    y += heading_size + heading_size * 1.5
+    margin = heading_size
+    for key in ("#!SALUTATION", "#!MESSAGE"):
+        y += max(margin, FONT_SIZE)
+        for text, bold in html_to_lines(fill(key)):
+            y += len(wrap_text(text, CONTENT_WIDTH, FONT_SIZE, bold) or [""]) * LINE_HEIGHT
+        margin = FONT_SIZE
+    return y + margin
+
+
+# The pages of the items table of invoice.html
+def paginate_html_items(values, invoice):
+    rows = measure_item_rows(invoice)
+    totals_height = (len(invoice.vat_groups) + 2) * ROW_HEIGHT + 0.75
+    first_page_space = PAGE_HEIGHT - PAGE_MARGIN - measure_table_top(values) - HTML_PAGE_RESERVE
+    page_space = PAGE_HEIGHT - 2 * PAGE_MARGIN - HTML_PAGE_RESERVE
+    return paginate_items(rows, first_page_space, page_space, totals_height)
@@ -0,0 +1,93 @@
+# Choosing the renderer and caching printed pdfs
+import os
+import itertools
+import threading
+
+
+
+# The renderers are imported only when they are used, so a run with the native renderer
+# never loads the chromium code and the other way round.
+# --renderer none returns None: only the html and the xml are written.
+def create_renderer(params, directories):
+    if params["renderer"] == "none":
+        return None
+    if params["renderer"] == "native":
+        from .native import NativeRenderer
+        return NativeRenderer()
+    from .chromium import ChromiumPoolRenderer, ChromiumRenderer, get_chromium_exec
+    chromium_exec = get_chromium_exec(directories["current_dir"])
+    if params["renderer"] == "pool":
+        return ChromiumPoolRenderer(chromium_exec, int(params["poolSize"]), float(params["renderTimeout"]), directories["cache_dir"])
+    return ChromiumRenderer(chromium_exec)
+
+
+# Printed pdfs by the hash of their html and logo, so printing the same invoice again
+# (e.g. pressing "Vorschau" twice) doesn't need chromium. As soon as the cache is bigger
+# than max_size bytes, the least recently used pdfs are removed.
+class RenderCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.counter_lock = threading.Lock()
+        self.temp_counter = itertools.count(1)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Prints the pdf with the renderer if it is not in the cache. Returns True on a cache hit.
+    # logo_digest is the sha256 of the logo, see get_cached_logo().
+    def print_pdf(self, renderer, html, html_path, logo_digest, pdf_path):
+        # Only chromium uses the render cache, so the other renderers don't import these
+        import hashlib
+        import shutil
+        key = hashlib.sha256(html.encode())
+        key.update(logo_digest.encode())
+        cached_path = f"{self.cache_dir}/{key.hexdigest()}.pdf"
+
+        try:
+            shutil.copyfile(cached_path, pdf_path)
+            # The modification time is the time of the last use
+            os.utime(cached_path)
+            with self.counter_lock:
+                self.hits += 1
+            return True
+        except FileNotFoundError:
+            pass
+
+        with self.counter_lock:
+            self.misses += 1
+        # Raises an InvoiceError if it could not print, so only printed pdfs are cached
+        renderer.print_pdf(html_path, pdf_path)
+        # Threads of --serve may print the same html at the same time, each writes its own file
+        temp_path = f"{cached_path}.{os.getpid()}-{next(self.temp_counter)}.tmp"
+        shutil.copyfile(pdf_path, temp_path)
+        os.replace(temp_path, cached_path)
+        self.remove_least_recently_used()
+        return False
+
+    def remove_least_recently_used(self):
+        entries = []
+        size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+        entries.sort()
+        for mtime, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+# Creates the renderer and the render cache on first use.
+# --serve calls this before it takes requests, so its threads share one renderer.
+def prepare_renderer(resources, params, directories):
+    if "renderer" not in resources:
+        resources["renderer"] = create_renderer(params, directories)
+    if "render_cache" not in resources and float(params["renderCacheSize"]) > 0 and params["renderer"] not in ("native", "none"):
+        resources["render_cache"] = RenderCache(f'{directories["cache_dir"]}/render-cache', float(params["renderCacheSize"]) * 1024 * 1024)
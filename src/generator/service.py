@@ -0,0 +1,228 @@
+# --serve: the generator service on a unix domain socket
+import os
+import json
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from .util import InvoiceError
+from .batch import get_invoice_params
+from .data import DataWatcher, open_data_store
+from .generate import generate_invoice
+from .metrics import get_invoice_record, open_metrics
+from .rendering import prepare_renderer
+
+
+# Arguments of the service itself, a request can't change them
+service_argkeys = ("serve", "socket", "idleTimeout", "batch", "jobs", "progress", "metrics", "outputFd", "profile_startup",
+    "findCustomer", "findArticle", "findInvoice", "revenue", "revenuePeriod", "reindexArchive")
+
+
+# The ops on the customers and articles: op -> (action, table)
+# find: "text" (the start of a company, name or zip code resp. description) and "limit"
+# add: "values" with the columns, the answer has the "id". delete: "id".
+data_ops = {
+    "findCustomers": ("find", "customers"),
+    "findArticles": ("find", "articles"),
+    "addCustomer": ("add", "customers"),
+    "addArticle": ("add", "articles"),
+    "deleteCustomer": ("delete", "customers"),
+    "deleteArticle": ("delete", "articles"),
+}
+
+
+class InvoiceRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.add_connection(self.connection)
+
+    def finish(self):
+        self.server.remove_connection(self.connection)
+        super().finish()
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"":
+                continue
+            self.server.begin_request()
+            try:
+                response = self.server.answer_request(line)
+            finally:
+                self.server.end_request()
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+# Generates invoices for the requests on a unix domain socket, every connection in its own thread.
+# Templates and the renderer stay loaded between the requests. Besides invoices ({"op": "generate"}, the default)
+# it answers {"op": "ping"} and {"op": "shutdown"}, and finds, adds and deletes customers and articles
+# (see data_ops).
+# After --idleTimeout minutes without requests it shuts down, so a service the app started doesn't
+# keep running after the app is closed.
+# The threads are no daemons: shutting down waits for the requests that are running, so no
+# invoice is stopped halfway with its number taken but neither committed nor given back.
+class InvoiceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, socket_path, args, resources, directories):
+        super().__init__(socket_path, InvoiceRequestHandler)
+        self.defaults = vars(args)
+        self.resources = resources
+        self.directories = directories
+        self.data_watcher = None
+        self.metrics = open_metrics(self.defaults)
+        self.idle_timeout = float(self.defaults["idleTimeout"]) * 60
+        self.active_requests = 0
+        self.last_request_time = time.monotonic()
+        self.activity_lock = threading.Lock()
+        self.shutting_down = False
+        self.connections = set()
+
+    def add_connection(self, connection):
+        with self.activity_lock:
+            self.connections.add(connection)
+
+    def remove_connection(self, connection):
+        with self.activity_lock:
+            self.connections.discard(connection)
+
+    # Lets the connections end after the request they are answering, server_close() waits for them.
+    # A connection waiting for its next request reads the end right away.
+    def stop_reading_requests(self):
+        with self.activity_lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+
+    def begin_request(self):
+        with self.activity_lock:
+            self.active_requests += 1
+
+    def end_request(self):
+        with self.activity_lock:
+            self.active_requests -= 1
+            self.last_request_time = time.monotonic()
+
+    # Called by serve_forever() between the requests
+    def service_actions(self):
+        if self.idle_timeout <= 0 or self.shutting_down:
+            return
+        with self.activity_lock:
+            idle = self.active_requests == 0 and time.monotonic() - self.last_request_time >= self.idle_timeout
+        if idle:
+            print("Shutting down after the idle timeout", flush=True)
+            self.shutting_down = True
+            # shutdown() waits for serve_forever() to return, so it can't be called from here
+            threading.Thread(target=self.shutdown).start()
+
+    # The arguments of a request, checked like the command line checks them.
+    # Raises an InvoiceError for unknown arguments, arguments only the service itself takes and
+    # values of the wrong type.
+    def get_request_params(self, request):
+        for key in request:
+            if key not in self.defaults:
+                raise InvoiceError(f'Unknown argument: "{key}"')
+            if key in service_argkeys:
+                raise InvoiceError(f'"{key}" can only be given when the service is started')
+        # The renderer is created once when the service starts, all requests share it
+        if request.get("renderer", self.defaults["renderer"]) != self.defaults["renderer"]:
+            raise InvoiceError(f'The service prints with the renderer "{self.defaults["renderer"]}", not "{request["renderer"]}". Start another generator for it.')
+        return get_invoice_params(self.defaults, request)
+
+    def answer_request(self, line):
+        start_time = time.monotonic()
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"ok": False, "error": f"Invalid request: {e}"}
+        if type(request) != dict:
+            return {"ok": False, "error": "Invalid request: not a json object"}
+        op = request.pop("op", "generate")
+        if op == "ping":
+            return {"ok": True}
+        if op == "shutdown":
+            # shutdown() waits for this request to finish, so it can't be called from here
+            threading.Thread(target=self.shutdown).start()
+            return {"ok": True}
+        if op in data_ops:
+            action, table = data_ops[op]
+            try:
+                text = str(request.pop("text", ""))
+                limit = int(request.pop("limit", 50))
+                values = request.pop("values", {})
+                row_id = str(request.pop("id", ""))
+                store = open_data_store(self.get_request_params(request))
+                try:
+                    if action == "find":
+                        return {"ok": True, table: store.search(table, text, limit)}
+                    if action == "add":
+                        if type(values) != dict:
+                            raise InvoiceError("Wrong format for values: use a json object with the columns")
+                        return {"ok": True, "id": store.add(table, values)}
+                    if not row_id.isdigit() or store.get(table, row_id) == None:
+                        raise InvoiceError(f'Unknown id: "{row_id}"')
+                    store.delete(table, row_id)
+                    return {"ok": True}
+                finally:
+                    store.close()
+            except Exception as e:
+                return {"ok": False, "error": str(e)}
+        if op == "dataStatus":
+            if self.data_watcher == None:
+                return {"ok": False, "error": "The data directory is not watched"}
+            return {"ok": True, "dataStatus": self.data_watcher.get_status()}
+        if op != "generate":
+            return {"ok": False, "error": f'Unknown op: "{op}"'}
+        try:
+            params = self.get_request_params(request)
+            # The documents are saved, fds of the service mean nothing to the client
+            params["outputFd"] = None
+            result = generate_invoice(params, self.resources, self.directories)
+        except Exception as e:
+            if self.metrics != None:
+                self.metrics.write(get_invoice_record(None, str(e)))
+            return {"ok": False, "error": str(e)}
+        result["ok"] = True
+        # The stages and the whole request
+        result["timings"]["total"] = round(time.monotonic() - start_time, 6)
+        if self.metrics != None:
+            self.metrics.write(get_invoice_record(result))
+        return result
+
+
+def serve(args, resources, directories):
+    socket_path = args.socket
+    if os.path.exists(socket_path):
+        # Remove the socket of a generator that did not shut down cleanly
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise InvoiceError(f'Another generator is already listening on "{socket_path}"')
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socket_path)
+        finally:
+            probe.close()
+
+    prepare_renderer(resources, vars(args), directories)
+    server = InvoiceServer(socket_path, args, resources, directories)
+    os.chmod(socket_path, 0o600)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.data_watcher = DataWatcher(os.path.join(args.invoiceDir, "data"))
+    server.data_watcher.start()
+    print(f"Listening on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.stop_reading_requests()
+        # Waits for the requests that are running
+        server.server_close()
+        server.data_watcher.stop()
+        if server.metrics != None:
+            server.metrics.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
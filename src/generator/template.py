@@ -0,0 +1,86 @@
+# template.csv and the #!KEY placeholders of invoice.html
+import os
+import re
+import functools
+
+from .util import InvoiceError, get_all_lines_from_file
+
+
+# The key;value pairs of a template.csv
+class Template:
+    def __init__(self, lines):
+        self.values = {}
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if line.find(";") == -1:
+                continue
+            # Only the first ; separates, the value may contain more of them
+            key, value = line.split(";", 1)
+            if key not in self.values:
+                self.values[key] = value
+        self.currency = self.get("CURRENCY", "€")
+
+    # Returns the value of key
+    def get(self, key, default=""):
+        return self.values.get(key, default)
+
+    # Returns True if the key is in the template and its value is not empty
+    def is_present(self, key):
+        return self.values.get(key, "") != ""
+
+
+# Parsed templates by path. A template is parsed again as soon as its file changes.
+template_cache = {}
+
+
+def load_template(template_path):
+    try:
+        stat = os.stat(template_path)
+    except OSError:
+        raise InvoiceError(f'Could not open template file: "{template_path}"')
+    file_version = (stat.st_mtime_ns, stat.st_size)
+    cached = template_cache.get(template_path)
+    if cached != None and cached[0] == file_version:
+        return cached[1]
+    template_lines = get_all_lines_from_file(template_path)
+    if len(template_lines) == 0:
+        raise InvoiceError(f'Could not open template file: "{template_path}"')
+    template = Template(template_lines)
+    template_cache[template_path] = (file_version, template)
+    return template
+
+
+# Splits a text with #!KEY placeholders into its lines. Every line is a tuple of
+# the literal chunks and the keys between them: chunks[0] key[0] chunks[1] key[1] ... chunks[-1]
+@functools.lru_cache(maxsize=64)
+def compile_template(text):
+    compiled = []
+    for line in text.splitlines(keepends=True):
+        parts = template_placeholder_pattern.split(line)
+        compiled.append((tuple(parts[0::2]), tuple(parts[1::2])))
+    return tuple(compiled)
+
+
+# A key ends at the first character that is not a letter, digit, _ or a - followed by one of these
+template_placeholder_pattern = re.compile(r"#!([A-Za-z0-9_]+(?:-[A-Za-z0-9_]+)*)")
+
+
+# Fills the compiled template in one pass. A line with a placeholder that has no
+# value (missing in values or None) is left out completely.
+# Returns the text and the keys that were missing in values.
+def render_template(compiled, values):
+    output = []
+    unresolved_keys = []
+    for chunks, keys in compiled:
+        parts = [chunks[0]]
+        for i in range(len(keys)):
+            value = values.get(keys[i])
+            if value == None:
+                if keys[i] not in values and keys[i] not in unresolved_keys:
+                    unresolved_keys.append(keys[i])
+                break
+            parts.append(value)
+            parts.append(chunks[i + 1])
+        else:
+            output.append("".join(parts))
+    return "".join(output), unresolved_keys
@@ -0,0 +1,56 @@
+# Small helpers shared by all parts of the generator. Only cheap modules are imported
+# here, because the command line entry needs this module before anything else.
+import os
+
+
+# argument key , description, default value, key in html
+argkeys_customer = [
+    ["customerCompany", "Name of the company" , "FirmaXYZ", "REC-COMPANY"],
+    ["customerName", "Name of the customer", "Max Mustermann" , "REC-NAME"],
+    ["customerStreet", "Street of the customer", "Robert-Koch-Str. 12", "REC-STREET"],
+    ["customerZIP", "Postal code of the customer", "12345", "REC-ZIP"],
+    ["customerCity", "City of the customer", "Musterstadt", "REC-CITY"],
+    # ["customerCountry", "Country of the customer", "Germany"]
+]
+
+def saveValue(lines, key, value):
+    for i in range(len(lines)):
+        if lines[i].startswith(key + ";"):
+            lines[i] = key + ";" + value + "\n"
+            return lines    
+    lines.append(key + ";" + value + "\n")
+    return lines
+
+
+def getValue(lines, key, default=''):
+    for i in range(len(lines)):
+        if lines[i].startswith(key + ";"):
+            return lines[i].split(";")[1].replace("\n", "")
+    return default
+
+
+def does_file_exist(file_path):
+    return os.path.exists(file_path) and os.path.isfile(file_path)
+
+
+def get_all_lines_from_file(file_path):
+    if not does_file_exist(file_path):
+        return []
+    with open(file_path, "r") as f:
+        return f.readlines()
+
+
+class InvoiceError(Exception):
+    """Raised when an invoice can not be generated from the given data."""
+    pass
+
+
+def get_directories():
+    home = os.path.expanduser("~")
+    return {
+        "home": home,
+        "cache_dir": home + "/.cache/rechnungs-assistent/",
+        "config_dir": home + "/.config/rechnungs-assistent/",
+        # The dir of generator-html.py, which contains html/ and chromium/
+        "current_dir": os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    }
@@ -0,0 +1,166 @@
+# The ZUGFeRD / Factur-X xml of an invoice
+from .invoice import round_money, round_price
+
+
+# xml.sax.saxutils.escape() would do the same, but importing it costs more than the whole
+# xml of a short invoice, because it pulls in urllib.request
+def escape_xml(value):
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+# Amounts in the xml always have two decimal places and a decimal point
+def format_amount(value):
+    return str(round_money(value))
+
+
+# Unit prices keep their decimal places, see invoice.round_price()
+def format_price(value):
+    return "{:f}".format(round_price(value))
+
+
+# Writes the ZUGFeRD / Factur-X xml (EN 16931, UN/CEFACT CII) of the invoice.
+# The xml is written to the text file f while it is built, so long invoices never have to be held in memory twice.
+def write_invoice_xml(invoice, template, f):
+    currency = escape_xml(invoice.currency_code)
+    sen_company = escape_xml(template.get("SEN-COMPANY"))
+    sen_tax_id = escape_xml(template.get("SEN-TAX-ID"))
+    customer = {key: escape_xml(value) for key, value in invoice.customer.items()}
+    customer_name = escape_xml((invoice.customer["customerCompany"] + " " + invoice.customer["customerName"]).strip())
+
+    invoice_message = template.get("MESSAGE", "")
+    invoice_message = invoice_message.replace("#!INVOICE-NUM", invoice.number)
+    invoice_message = invoice_message.replace("#!PAY-DATE", invoice.payment_date.strftime("%d.%m.%Y"))
+
+    f.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100" xmlns:qdt="urn:un:unece:uncefact:data:standard:QualifiedDataType:100" xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100" xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:udt="urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100">\n'
+        '  <rsm:ExchangedDocumentContext>\n'
+        '    <ram:GuidelineSpecifiedDocumentContextParameter>\n'
+        '      <ram:ID>urn:cen.eu:en16931:2017</ram:ID>\n'
+        '    </ram:GuidelineSpecifiedDocumentContextParameter>\n'
+        '  </rsm:ExchangedDocumentContext>\n'
+        '  <rsm:ExchangedDocument>\n'
+        f'    <ram:ID>{escape_xml(invoice.number)}</ram:ID>\n'
+        '    <ram:TypeCode>380</ram:TypeCode>\n'
+        '    <ram:IssueDateTime>\n'
+        f'      <udt:DateTimeString format="102">{invoice.date.strftime("%Y%m%d")}</udt:DateTimeString>\n'
+        '    </ram:IssueDateTime>\n'
+        '    <ram:IncludedNote>\n'
+        f'      <ram:Content>{escape_xml(invoice_message)}</ram:Content>\n'
+        '    </ram:IncludedNote>\n'
+        '  </rsm:ExchangedDocument>\n'
+        '  <rsm:SupplyChainTradeTransaction>\n'
+    )
+
+    # One IncludedSupplyChainTradeLineItem per line, the LineIDs of the discounts continue
+    # after the articles
+    for line in invoice.lines:
+        # A discount is an amount of its own, its price is the rounded line total
+        price = format_amount(-line.price) if line.is_discount else format_price(line.price)
+        f.write(
+            '    <ram:IncludedSupplyChainTradeLineItem>\n'
+            '      <ram:AssociatedDocumentLineDocument>\n'
+            f'        <ram:LineID>{line.line_id}</ram:LineID>\n'
+            '      </ram:AssociatedDocumentLineDocument>\n'
+            '      <ram:SpecifiedTradeProduct>\n'
+            f'        <ram:Name>{escape_xml(line.name)}</ram:Name>\n'
+            '      </ram:SpecifiedTradeProduct>\n'
+            '      <ram:SpecifiedLineTradeAgreement>\n'
+            '        <ram:GrossPriceProductTradePrice>\n'
+            f'          <ram:ChargeAmount>{price}</ram:ChargeAmount>\n'
+            '        </ram:GrossPriceProductTradePrice>\n'
+            '        <ram:NetPriceProductTradePrice>\n'
+            f'          <ram:ChargeAmount>{price}</ram:ChargeAmount>\n'
+            '        </ram:NetPriceProductTradePrice>\n'
+            '      </ram:SpecifiedLineTradeAgreement>\n'
+            '      <ram:SpecifiedLineTradeDelivery>\n'
+            f'        <ram:BilledQuantity unitCode="H87">{escape_xml(line.quantity)}</ram:BilledQuantity>\n'
+            '      </ram:SpecifiedLineTradeDelivery>\n'
+            '      <ram:SpecifiedLineTradeSettlement>\n'
+            '        <ram:ApplicableTradeTax>\n'
+            '          <ram:TypeCode>VAT</ram:TypeCode>\n'
+            '          <ram:CategoryCode>S</ram:CategoryCode>\n'
+            f'          <ram:RateApplicablePercent>{format_amount(line.vat)}</ram:RateApplicablePercent>\n'
+            '        </ram:ApplicableTradeTax>\n'
+            '        <ram:SpecifiedTradeSettlementLineMonetarySummation>\n'
+            f'          <ram:LineTotalAmount>{format_amount(line.total)}</ram:LineTotalAmount>\n'
+            '        </ram:SpecifiedTradeSettlementLineMonetarySummation>\n'
+            '      </ram:SpecifiedLineTradeSettlement>\n'
+            '    </ram:IncludedSupplyChainTradeLineItem>\n'
+        )
+
+    f.write(
+        '    <ram:ApplicableHeaderTradeAgreement>\n'
+        '      <ram:SellerTradeParty>\n'
+        '        <ram:ID></ram:ID>\n'
+        '        <ram:GlobalID schemeID="0088"></ram:GlobalID>\n'
+        f'        <ram:Name>{sen_company}</ram:Name>\n'
+        '        <ram:PostalTradeAddress>\n'
+        f'          <ram:PostcodeCode>{escape_xml(template.get("SEN-ZIP"))}</ram:PostcodeCode>\n'
+        f'          <ram:LineOne>{escape_xml(template.get("SEN-STREET"))}</ram:LineOne>\n'
+        f'          <ram:CityName>{escape_xml(template.get("SEN-CITY"))}</ram:CityName>\n'
+        '          <ram:CountryID></ram:CountryID>\n'
+        '        </ram:PostalTradeAddress>\n'
+        '        <ram:SpecifiedTaxRegistration>\n'
+        f'          <ram:ID schemeID="FC">{sen_tax_id}</ram:ID>\n'
+        '        </ram:SpecifiedTaxRegistration>\n'
+        '        <ram:SpecifiedTaxRegistration>\n'
+        f'          <ram:ID schemeID="VA">{sen_tax_id}</ram:ID>\n'
+        '        </ram:SpecifiedTaxRegistration>\n'
+        '      </ram:SellerTradeParty>\n'
+        '      <ram:BuyerTradeParty>\n'
+        '        <ram:ID></ram:ID>\n'
+        f'        <ram:Name>{customer_name}</ram:Name>\n'
+        '        <ram:PostalTradeAddress>\n'
+        f'          <ram:PostcodeCode>{customer["customerZIP"]}</ram:PostcodeCode>\n'
+        f'          <ram:LineOne>{customer["customerStreet"]}</ram:LineOne>\n'
+        f'          <ram:CityName>{customer["customerCity"]}</ram:CityName>\n'
+        '          <ram:CountryID></ram:CountryID>\n'
+        '        </ram:PostalTradeAddress>\n'
+        '      </ram:BuyerTradeParty>\n'
+        '    </ram:ApplicableHeaderTradeAgreement>\n'
+        '    <ram:ApplicableHeaderTradeDelivery/>\n'
+        '    <ram:ApplicableHeaderTradeSettlement>\n'
+        f'      <ram:InvoiceCurrencyCode>{currency}</ram:InvoiceCurrencyCode>\n'
+        '      <ram:SpecifiedTradeSettlementPaymentMeans>\n'
+        '        <ram:TypeCode>58</ram:TypeCode>\n'
+        '        <ram:Information>Zahlung per SEPA Überweisung.</ram:Information>\n'
+        '        <ram:PayeePartyCreditorFinancialAccount>\n'
+        f'          <ram:IBANID>{escape_xml(template.get("IBAN"))}</ram:IBANID>\n'
+        f'          <ram:AccountName>{sen_company}</ram:AccountName>\n'
+        '        </ram:PayeePartyCreditorFinancialAccount>\n'
+        '        <ram:PayeeSpecifiedCreditorFinancialInstitution>\n'
+        f'          <ram:BICID>{escape_xml(template.get("BIC"))}</ram:BICID>\n'
+        '        </ram:PayeeSpecifiedCreditorFinancialInstitution>\n'
+        '      </ram:SpecifiedTradeSettlementPaymentMeans>\n'
+    )
+    for group in invoice.vat_groups:
+        f.write(
+            '      <ram:ApplicableTradeTax>\n'
+            f'        <ram:CalculatedAmount>{format_amount(group.tax)}</ram:CalculatedAmount>\n'
+            '        <ram:TypeCode>VAT</ram:TypeCode>\n'
+            f'        <ram:BasisAmount>{format_amount(group.basis)}</ram:BasisAmount>\n'
+            '        <ram:CategoryCode>S</ram:CategoryCode>\n'
+            f'        <ram:RateApplicablePercent>{format_amount(group.vat)}</ram:RateApplicablePercent>\n'
+            '      </ram:ApplicableTradeTax>\n'
+        )
+    f.write(
+        '      <ram:SpecifiedTradePaymentTerms>\n'
+        '        <ram:DueDateDateTime>\n'
+        f'          <udt:DateTimeString format="102">{invoice.payment_date.strftime("%Y%m%d")}</udt:DateTimeString>\n'
+        '        </ram:DueDateDateTime>\n'
+        '      </ram:SpecifiedTradePaymentTerms>\n'
+        '      <ram:SpecifiedTradeSettlementHeaderMonetarySummation>\n'
+        f'        <ram:LineTotalAmount>{format_amount(invoice.sum_netto)}</ram:LineTotalAmount>\n'
+        '        <ram:ChargeTotalAmount>0.00</ram:ChargeTotalAmount>\n'
+        '        <ram:AllowanceTotalAmount>0.00</ram:AllowanceTotalAmount>\n'
+        f'        <ram:TaxBasisTotalAmount>{format_amount(invoice.sum_netto)}</ram:TaxBasisTotalAmount>\n'
+        f'        <ram:TaxTotalAmount currencyID="{currency}">{format_amount(invoice.vat_sum)}</ram:TaxTotalAmount>\n'
+        f'        <ram:GrandTotalAmount>{format_amount(invoice.sum_brutto)}</ram:GrandTotalAmount>\n'
+        '        <ram:TotalPrepaidAmount>0.00</ram:TotalPrepaidAmount>\n'
+        f'        <ram:DuePayableAmount>{format_amount(invoice.sum_brutto)}</ram:DuePayableAmount>\n'
+        '      </ram:SpecifiedTradeSettlementHeaderMonetarySummation>\n'
+        '    </ram:ApplicableHeaderTradeSettlement>\n'
+        '  </rsm:SupplyChainTradeTransaction>\n'
+        '</rsm:CrossIndustryInvoice>\n'
+    )
@@ -1,10 +1,13 @@
 class Article {
+  /// Id of the row in the data store of the generator, null until it is saved
+  int? id;
   String description;
   String pricePerUnit;
   String amount;
   String summary;
 
   Article({
+    this.id,
     this.description = "",
     this.pricePerUnit = "",
     this.amount = "",
@@ -1,4 +1,6 @@
 class Customer {
+  /// Id of the row in the data store of the generator, null until it is saved
+  int? id;
   String companyName;
   String name;
   String street;
@@ -7,6 +9,7 @@ class Customer {
   String country;
 
   Customer({
+    this.id,
     this.name = "",
     this.companyName = "",
     this.street = "",
@@ -10,6 +10,7 @@ import 'package:invoice/services/helpers.dart';
 import 'package:invoice/services/invoice_service.dart';
 import 'package:invoice/services/template_service.dart';
 import 'package:invoice/widgets/customer_widget.dart';
+import 'package:invoice/widgets/invoice_jobs_widget.dart';
 import 'package:invoice/widgets/mint_y.dart';
 import 'package:invoice/widgets/templateSelector.dart';
 
@@ -96,6 +97,7 @@ class InvoiceCreationPage extends StatelessWidget {
         ),
         InvoiceElementTableWidget(key: invoiceElementTableWidgetKey),
         // const InvoiceElementTableWidget(),
+        const InvoiceJobsWidget(),
       ],
       bottom: Row(
         mainAxisAlignment: MainAxisAlignment.spaceBetween,
@@ -489,10 +491,10 @@ class ArticleCreationWidget extends StatelessWidget {
                       children: [
                         MintYSelectionDialogWithFilter(
                           selectionCallback: (string) {
-                            Article article = ArticleService.articles
-                                .firstWhere((element) =>
-                                    "${element.description}, ${element.pricePerUnit}" ==
-                                    string);
+                            Article? article = ArticleService.found[string];
+                            if (article == null) {
+                              return;
+                            }
                             articleNameController.text = article.description;
                             articleName = article.description;
                             articlePricePerUnitController.text =
@@ -508,18 +510,14 @@ class ArticleCreationWidget extends StatelessWidget {
                             summary = article.summary;
                           },
                           deleteCallback: (string) {
-                            Article article = ArticleService.articles
-                                .firstWhere((element) =>
-                                    "${element.description}, ${element.pricePerUnit}" ==
-                                    string);
-                            ArticleService.articles.remove(article);
-                            ArticleService.save();
+                            Article? article = ArticleService.found[string];
+                            if (article != null) {
+                              ArticleService.delete(article).catchError((e) =>
+                                  print("Could not delete the article: $e"));
+                            }
                           },
-                          items: List.generate(ArticleService.articles.length,
-                              (index) {
-                            Article article = ArticleService.articles[index];
-                            return "${article.description}, ${article.pricePerUnit}";
-                          }),
+                          // Prefix search by description
+                          search: ArticleService.searchLabels,
                           buttonText: "Artikel auswählen",
                         ),
                         SizedBox(
@@ -536,13 +534,13 @@ class ArticleCreationWidget extends StatelessWidget {
                             if (articleName == "") {
                               return;
                             }
-                            ArticleService.articles.add(Article(
+                            ArticleService.add(Article(
                               description: articleName,
                               pricePerUnit: articlePricePerUnit.toString(),
                               amount: articleAmount.toString(),
                               summary: summary,
-                            ));
-                            ArticleService.save();
+                            )).catchError(
+                                (e) => print("Could not save the article: $e"));
                           },
                         ),
                       ],
@@ -1,9 +1,8 @@
 import 'package:flutter/material.dart';
 import 'package:invoice/pages/first_start/first_start.dart';
 import 'package:invoice/pages/invoice_creation/invoice_creation.dart';
-import 'package:invoice/services/article_service.dart';
 import 'package:invoice/services/config_service.dart';
-import 'package:invoice/services/customer_service.dart';
+import 'package:invoice/services/invoice_service.dart';
 import 'package:invoice/services/template_service.dart';
 import 'package:invoice/widgets/mint_y.dart';
 
@@ -14,8 +13,10 @@ class LoadingScreenPage extends StatelessWidget {
   Future<bool> loadingFunction() async {
     await ConfigHandler.ensureConfigIsLoaded();
     TemplateService.init();
-    CustomerService.init();
-    ArticleService.init();
+    // The customers and articles are looked up through the generator service, it starts
+    // while the app loads
+    InvoiceService.startGeneratorService()
+        .catchError((e) => print("Could not start the generator service: $e"));
 
     return ConfigHandler.getValueUnsafe("first_start_done", false);
   }
@@ -1,44 +1,63 @@
-import 'dart:io';
-
 import 'package:invoice/models/article.dart';
-import 'package:invoice/services/helpers.dart';
+import 'package:invoice/services/invoice_service.dart';
 
-// CSV: template: description;pricePerUnit;amount
+// The articles are kept by the generator service (data/articles.csv indexed in
+// data/data.sqlite). The app only asks for the ones matching a search, it never reads or
+// writes the whole .csv file.
 
 class ArticleService {
-  static List<Article> articles = [];
+  /// The articles of the last search by their label, see getLabel()
+  static Map<String, Article> found = {};
 
-  static void init() {
-    // load and parse .csv file from config folder
-    File articleFile = File("${getInvoicesDirectory()}/data/articles.csv");
-    if (!articleFile.existsSync()) {
-      articleFile.createSync(recursive: true);
-    }
-    List<String> lines = articleFile.readAsLinesSync();
-    for (int i = 1; i < lines.length; i++) {
-      String line = lines[i];
-      List<String> lineSplit = line.split(";");
-      while (lineSplit.length < 4) {
-        lineSplit.add("");
-      }
-      Article article = Article(
-        description: lineSplit[0],
-        pricePerUnit: lineSplit[1],
-        amount: lineSplit[2],
-        summary: lineSplit[3].replaceAll("<br>", "\n"),
-      );
-      articles.add(article);
-    }
+  static String getLabel(Article article) {
+    return "${article.description}, ${article.pricePerUnit}";
+  }
+
+  /// Articles whose description starts with text
+  static Future<List<Article>> search(String text) async {
+    Map<String, dynamic> response = await InvoiceService.requestGenerator(
+        {"op": "findArticles", "text": text, "limit": 100});
+    List<Article> articles = [
+      for (Map<String, dynamic> row in response["articles"])
+        Article(
+          id: row["id"],
+          description: row["description"],
+          pricePerUnit: row["pricePerUnit"],
+          amount: row["amount"],
+          summary: row["summary"].replaceAll("<br>", "\n"),
+        )
+    ];
+    found = {for (Article article in articles) getLabel(article): article};
+    return articles;
+  }
+
+  /// The labels of the articles matching text, for MintYSelectionDialogWithFilter
+  static Future<List<String>> searchLabels(String text) async {
+    return (await search(text)).map(getLabel).toList();
+  }
+
+  /// The article is appended to the .csv file, the rest of the file is not written again.
+  /// Line breaks of the summary are stored as <br> by the generator.
+  static Future<void> add(Article article) async {
+    Map<String, dynamic> response =
+        await InvoiceService.requestGenerator({
+      "op": "addArticle",
+      "values": {
+        "description": article.description,
+        "pricePerUnit": article.pricePerUnit,
+        "amount": article.amount,
+        "summary": article.summary,
+      },
+    });
+    article.id = response["id"];
   }
 
-  static void save() {
-    // save articles to .csv file in config folder
-    File articleFile = File("${getInvoicesDirectory()}/data/articles.csv");
-    List<String> lines = ["description;pricePerUnit;amount;summary"];
-    for (Article article in articles) {
-      lines.add(
-          '${article.description};${article.pricePerUnit};${article.amount};${article.summary.replaceAll("\n", "<br>")}');
+  static Future<void> delete(Article article) async {
+    if (article.id == null) {
+      return;
     }
-    articleFile.writeAsStringSync(lines.join("\n"));
+    await InvoiceService.requestGenerator(
+        {"op": "deleteArticle", "id": article.id});
+    found.removeWhere((label, element) => element.id == article.id);
   }
 }
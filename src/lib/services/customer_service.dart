@@ -1,43 +1,66 @@
-import 'dart:io';
-
 import 'package:invoice/models/customer.dart';
-import 'package:invoice/services/helpers.dart';
+import 'package:invoice/services/invoice_service.dart';
 
-// CSV: template: companyName;name;street;zip;city;country
+// The customers are kept by the generator service (data/customers.csv indexed in
+// data/data.sqlite). The app only asks for the ones matching a search, it never reads or
+// writes the whole .csv file.
 
 class CustomerService {
-  static List<Customer> customers = [];
+  /// The customers of the last search by their label, see getLabel()
+  static Map<String, Customer> found = {};
 
-  static void init() {
-    // load and parse .csv file from config folder
-    File customerFile = File("${getInvoicesDirectory()}/data/customers.csv");
-    if (!customerFile.existsSync()) {
-      customerFile.createSync(recursive: true);
-    }
-    List<String> lines = customerFile.readAsLinesSync();
-    for (int i = 1; i < lines.length; i++) {
-      String line = lines[i];
-      List<String> lineSplit = line.split(";");
-      Customer customer = Customer(
-        companyName: lineSplit[0],
-        name: lineSplit[1],
-        street: lineSplit[2],
-        zip: lineSplit[3],
-        city: lineSplit[4],
-        country: lineSplit[5],
-      );
-      customers.add(customer);
-    }
+  static String getLabel(Customer customer) {
+    return "${customer.name}, ${customer.city}, ${customer.companyName}";
+  }
+
+  /// Customers whose company, name or zip code starts with text
+  static Future<List<Customer>> search(String text) async {
+    Map<String, dynamic> response = await InvoiceService.requestGenerator(
+        {"op": "findCustomers", "text": text, "limit": 100});
+    List<Customer> customers = [
+      for (Map<String, dynamic> row in response["customers"])
+        Customer(
+          id: row["id"],
+          companyName: row["companyName"],
+          name: row["name"],
+          street: row["street"],
+          zip: row["zip"],
+          city: row["city"],
+          country: row["country"],
+        )
+    ];
+    found = {for (Customer customer in customers) getLabel(customer): customer};
+    return customers;
+  }
+
+  /// The labels of the customers matching text, for MintYSelectionDialogWithFilter
+  static Future<List<String>> searchLabels(String text) async {
+    return (await search(text)).map(getLabel).toList();
+  }
+
+  /// The customer is appended to the .csv file, the rest of the file is not written again
+  static Future<void> add(Customer customer) async {
+    Map<String, dynamic> response =
+        await InvoiceService.requestGenerator({
+      "op": "addCustomer",
+      "values": {
+        "companyName": customer.companyName,
+        "name": customer.name,
+        "street": customer.street,
+        "zip": customer.zip,
+        "city": customer.city,
+        "country": customer.country,
+      },
+    });
+    customer.id = response["id"];
   }
 
-  static void save() {
-    // save customers to .csv file in config folder
-    File customerFile = File("${getInvoicesDirectory()}/data/customers.csv");
-    List<String> lines = ["companyName;name;street;zip;city;country"];
-    for (Customer customer in customers) {
-      lines.add(
-          '${customer.companyName};${customer.name};${customer.street};${customer.zip};${customer.city};${customer.country}');
+  static Future<void> delete(Customer customer) async {
+    if (customer.id == null) {
+      return;
     }
-    customerFile.writeAsStringSync(lines.join("\n"));
+    await InvoiceService.requestGenerator(
+        {"op": "deleteCustomer", "id": customer.id});
+    found.removeWhere((label, element) => element.id == customer.id);
   }
 }
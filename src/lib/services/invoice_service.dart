@@ -1,8 +1,11 @@
 import 'dart:async';
+import 'dart:convert';
 import 'dart:io';
+import 'dart:math';
 
 import 'package:flutter/material.dart';
 import 'package:invoice/models/invoice_element.dart';
+import 'package:invoice/pages/invoice_creation/invoice_creation.dart';
 import 'package:invoice/pages/invoice_creation/invoice_waiting_screen.dart';
 import 'package:invoice/services/helpers.dart';
 import 'package:invoice/services/template_service.dart';
@@ -58,103 +61,504 @@ class InvoiceService {
       return;
     }
 
-    // Navigate to waiting screen
-    Navigator.push(
-        context,
-        MaterialPageRoute(
-            builder: (context) => InvoiceCreationWaitingPage(
-                  creationFunction: _generateInvoice(preview: preview),
-                )));
+    if (preview) {
+      // The preview is shown as soon as it is ready, navigate to waiting screen
+      Navigator.push(
+          context,
+          MaterialPageRoute(
+              builder: (context) => InvoiceCreationWaitingPage(
+                    creationFunction: _generatePreview(),
+                  )));
+      return;
+    }
+
+    // The invoice is generated in the background (see InvoiceJobsWidget), the next one can be
+    // entered right away
+    InvoiceJob job = jobQueue.add(_createRequest(),
+        description: currentCompanyName != ""
+            ? currentCompanyName
+            : currentContactPerson);
+    job.finished.then(_openInvoice);
+    clearInvoiceElements();
+    Navigator.pushReplacement(context,
+        MaterialPageRoute(builder: (context) => const InvoiceCreationPage()));
+  }
+
+  /// Generates the invoices in the background, see InvoiceJobQueue
+  static final InvoiceJobQueue jobQueue = InvoiceJobQueue();
+
+  /// Every preview is printed to a file of its own. A failed preview shows its error in the
+  /// list of jobs, there is nothing to open then.
+  static Future<void> _generatePreview() async {
+    InvoiceJob job = await jobQueue
+        .add(_createRequest(preview: true), description: "Vorschau")
+        .finished;
+    if (job.state != InvoiceJobState.done || job.invoicePaths.isEmpty) {
+      return;
+    }
+    Process.run("xdg-open", [job.invoicePaths.first]);
   }
 
-  static Future<void> _generateInvoice({
-    bool preview = false,
-  }) async {
-    var arguments = [
-      "generator-html.py",
-      "--template",
-      "${getInvoicesDirectory()}/data/templates/${TemplateService.currentTemplate.fileName}",
+  /// Opens the invoice folder (once) and the printed invoice of a finished job
+  static void _openInvoice(InvoiceJob job) {
+    if (job.state != InvoiceJobState.done) {
+      return;
+    }
+
+    // Get current month and year
+    var now = DateTime.now();
+    String month = now.month.toString().padLeft(2, "0");
+    String year = now.year.toString();
+
+    if (opendInvoiceFolder == false) {
+      opendInvoiceFolder = true;
+      Process.run("xdg-open", ["${getInvoicesDirectory()}/$year/$month/"]);
+    }
+    for (String path in job.invoicePaths) {
+      Process.run("xdg-open", [path]);
+    }
+  }
+
+  /// The arguments of generator-html.py for the invoice that is entered right now
+  static Map<String, dynamic> _createRequest({bool preview = false}) {
+    Map<String, dynamic> request = {
+      "template":
+          "${getInvoicesDirectory()}/data/templates/${TemplateService.currentTemplate.fileName}",
       // "${getConfigDirectory()}/template.csv", // TODO: Change path
-      "--customerCompany",
-      currentCompanyName,
-      "--customerName",
-      currentContactPerson,
-      "--customerStreet",
-      currentCustomerStreet,
-      "--customerZIP",
-      currentCustomerZip,
-      "--customerCity",
-      currentCustomerCity,
-    ];
+      "customerCompany": currentCompanyName,
+      "customerName": currentContactPerson,
+      "customerStreet": currentCustomerStreet,
+      "customerZIP": currentCustomerZip,
+      "customerCity": currentCustomerCity,
+    };
 
     if (overrideInvoiceNumber != "") {
-      arguments.add("--invoiceNumber");
-      arguments.add(overrideInvoiceNumber);
+      request["invoiceNumber"] = overrideInvoiceNumber;
     }
 
     if (overrideServiceDate != "") {
-      arguments.add("--serviceDate");
-      arguments.add(overrideServiceDate);
+      request["serviceDate"] = overrideServiceDate;
     }
 
     if (preview) {
-      arguments.add("--dryRun");
+      request["dryRun"] = true;
     }
 
     // Add articles
     var articles = invoiceElements
         .where((element) => element.type == InvoiceElementType.article);
     if (articles.isNotEmpty) {
-      arguments.add("--article");
-      for (var element in articles) {
-        String s =
-            "${element.name};${element.pricePerUnit};${element.amount};${element.summary.replaceAll("\n", "<br>")}";
-        arguments.add(s);
-      }
+      request["article"] = [
+        for (var element in articles)
+          "${element.name};${element.pricePerUnit};${element.amount};${element.summary.replaceAll("\n", "<br>")}"
+      ];
     }
 
     // Add discount
     var discount = invoiceElements
         .where((element) => element.type == InvoiceElementType.discount);
     if (discount.isNotEmpty) {
-      arguments.add("--discount");
-      for (var element in discount) {
-        String s = "${element.name};${element.price}";
-        arguments.add(s);
+      request["discount"] = [
+        for (var element in discount) "${element.name};${element.price}"
+      ];
+    }
+
+    return request;
+  }
+
+  static String _getGeneratorSocketPath() {
+    return "${getCacheDirectory()}generator.sock";
+  }
+
+  /// Sends the request to the running generator (generator-html.py --serve).
+  /// Returns null if the generator is not running. Once the request is sent, a failure
+  /// throws a GeneratorServiceException: the generator might have numbered and saved the
+  /// invoice already, so the request must not be sent anywhere else again.
+  static Future<Map<String, dynamic>?> _requestGeneratorService(
+      Map<String, dynamic> request) async {
+    Socket socket;
+    try {
+      socket = await Socket.connect(
+          InternetAddress(_getGeneratorSocketPath(),
+              type: InternetAddressType.unix),
+          0,
+          timeout: const Duration(seconds: 1));
+    } on SocketException {
+      return null;
+    }
+    try {
+      socket.write("${jsonEncode(request)}\n");
+      await socket.flush();
+      String answer = await utf8.decoder
+          .bind(socket)
+          .transform(const LineSplitter())
+          .first;
+      return jsonDecode(answer);
+    } catch (e) {
+      print("Generator service failed: $e");
+      throw GeneratorServiceException("$e");
+    } finally {
+      socket.destroy();
+    }
+  }
+
+  /// Sends a request to the generator service and starts the service first if it is not
+  /// running. Throws a GeneratorServiceException if the service can't be reached or
+  /// answers with an error.
+  static Future<Map<String, dynamic>> requestGenerator(
+      Map<String, dynamic> request) async {
+    Map<String, dynamic>? response = await _requestGeneratorService(request);
+    if (response == null) {
+      await startGeneratorService();
+      response = await _requestGeneratorService(request);
+    }
+    if (response == null) {
+      throw GeneratorServiceException("The service is not running");
+    }
+    if (response["ok"] != true) {
+      throw GeneratorServiceException("${response["error"]}");
+    }
+    return response;
+  }
+
+  static Future<void>? _generatorServiceStarting;
+
+  /// Starts the generator service unless it is running. Completes as soon as it answers,
+  /// callers at the same time share one start.
+  static Future<void> startGeneratorService() {
+    return _generatorServiceStarting ??= _startGeneratorServiceAndWait()
+        .whenComplete(() => _generatorServiceStarting = null);
+  }
+
+  static Future<void> _startGeneratorServiceAndWait() async {
+    if (await _requestGeneratorService({"op": "ping"}) != null) {
+      return;
+    }
+    _startGeneratorService();
+    // It answers after it has loaded its modules and opened the socket
+    for (int i = 0; i < 50; i++) {
+      await Future.delayed(const Duration(milliseconds: 200));
+      if (await _requestGeneratorService({"op": "ping"}) != null) {
+        return;
       }
     }
+  }
+
+  /// The service exits by itself after 30 minutes without requests (--idleTimeout), so it
+  /// doesn't outlive the app for long. Once it is gone, the next invoice starts it again.
+  static void _startGeneratorService() {
+    Process.start("/usr/bin/python3", ["generator-html.py", "--serve"],
+        mode: ProcessStartMode.detached);
+  }
+
+  /// The command line arguments of generator-html.py for a request of the generator service
+  static List<String> _getGeneratorArguments(Map<String, dynamic> request) {
+    var arguments = ["generator-html.py"];
+    request.forEach((key, value) {
+      if (value is bool) {
+        if (value) {
+          arguments.add("--$key");
+        }
+      } else if (value is List) {
+        arguments.add("--$key");
+        for (var element in value) {
+          arguments.add(element);
+        }
+      } else {
+        arguments.add("--$key");
+        arguments.add(value);
+      }
+    });
+    return arguments;
+  }
+}
+
+/// The generator service got the request, but its answer did not arrive
+class GeneratorServiceException implements Exception {
+  final String message;
+
+  GeneratorServiceException(this.message);
+
+  @override
+  String toString() => "The generator service failed: $message";
+}
+
+enum InvoiceJobState { queued, running, done, failed, cancelled }
+
+/// One request to the generator: a single invoice or a batch (request["batch"] is the path
+/// of the manifest). InvoiceJobQueue runs it and fills in the progress.
+class InvoiceJob {
+  final int id;
+  final Map<String, dynamic> request;
+
+  /// Shown in the list of jobs, e.g. the customer
+  final String description;
+
+  InvoiceJobState state = InvoiceJobState.queued;
+
+  /// The last stage of the generator that is done (e.g. "html", "pdf"), see --progress
+  String stage = "";
+
+  /// Number of invoices of the job, null until the generator has read a batch
+  int? invoiceCount;
+  int invoicesDone = 0;
+  int invoicesFailed = 0;
+
+  /// Time until the job is done, null as long as there is nothing to estimate it from
+  Duration? eta;
+
+  DateTime? startTime;
+  List<String> invoicePaths = [];
+  List<String> errors = [];
+
+  Process? _process;
+  final Completer<InvoiceJob> _finished = Completer();
 
+  InvoiceJob(this.id, this.request, this.description);
+
+  /// Completes as soon as the job is done, failed or cancelled
+  Future<InvoiceJob> get finished => _finished.future;
+
+  bool get isFinished =>
+      state == InvoiceJobState.done ||
+      state == InvoiceJobState.failed ||
+      state == InvoiceJobState.cancelled;
+
+  /// A request to the generator service can't be taken back, a generator process can
+  bool get canCancel =>
+      state == InvoiceJobState.queued ||
+      (state == InvoiceJobState.running && _process != null);
+
+  /// Between 0 and 1, null if the number of invoices is not known yet
+  double? get fraction {
+    int? count = invoiceCount;
+    if (count == null || count == 0) {
+      return null;
+    }
+    return invoicesDone / count;
+  }
+}
+
+/// Runs the jobs of the generator in the background, at most maxRunningJobs at the same time.
+/// A single invoice goes to the generator service if it is running. Everything else starts
+/// generator-html.py --progress and follows the json lines it writes to stdout.
+/// Listeners are notified whenever a job changes.
+class InvoiceJobQueue extends ChangeNotifier {
+  int maxRunningJobs;
+  final List<InvoiceJob> jobs = [];
+  int _nextJobId = 1;
+
+  /// Seconds one invoice took on average, for the eta of a job before its first invoice is done
+  double _averageInvoiceSeconds = 0;
+  int _measuredJobs = 0;
+
+  InvoiceJobQueue({this.maxRunningJobs = 2});
+
+  InvoiceJob add(Map<String, dynamic> request, {String description = ""}) {
+    InvoiceJob job = InvoiceJob(_nextJobId++, request, description);
+    jobs.add(job);
+    notifyListeners();
+    _startJobs();
+    return job;
+  }
+
+  void cancel(InvoiceJob job) {
+    if (!job.canCancel) {
+      return;
+    }
+    if (job.state == InvoiceJobState.queued) {
+      job.state = InvoiceJobState.cancelled;
+      _finish(job);
+      return;
+    }
+    // The generator exits through its cleanup, _run() finishes the job when it is gone
+    job.state = InvoiceJobState.cancelled;
+    job._process?.kill(ProcessSignal.sigterm);
+    notifyListeners();
+  }
+
+  /// Removes the jobs that are done, failed or cancelled from the list
+  void removeFinished() {
+    jobs.removeWhere((job) => job.isFinished);
+    notifyListeners();
+  }
+
+  int get runningJobs =>
+      jobs.where((job) => job.state == InvoiceJobState.running).length;
+
+  void _startJobs() {
+    for (InvoiceJob job in jobs) {
+      if (runningJobs >= maxRunningJobs) {
+        return;
+      }
+      if (job.state == InvoiceJobState.queued) {
+        _run(job);
+      }
+    }
+  }
+
+  Future<void> _run(InvoiceJob job) async {
+    job.state = InvoiceJobState.running;
+    job.startTime = DateTime.now();
+    _estimate(job);
+    notifyListeners();
+
+    if (!job.request.containsKey("batch")) {
+      Map<String, dynamic>? response;
+      try {
+        response = await InvoiceService._requestGeneratorService(job.request);
+      } on GeneratorServiceException catch (e) {
+        // Generating the invoice again could give it a second number
+        job.errors.add(e.toString());
+        job.state = InvoiceJobState.failed;
+        _finish(job);
+        return;
+      }
+      if (response != null) {
+        job.invoiceCount = 1;
+        _handleInvoiceRecord(job, response);
+        job.invoicesDone = 1;
+        job.state = job.invoicesFailed == 0
+            ? InvoiceJobState.done
+            : InvoiceJobState.failed;
+        _finish(job);
+        return;
+      }
+    }
+
+    var arguments = InvoiceService._getGeneratorArguments(job.request);
+    arguments.add("--progress");
     // Print the whole command for debugging
     print("/usr/bin/python3 ${arguments.join(" ")}");
+    Process process;
+    try {
+      process = await Process.start("/usr/bin/python3", arguments);
+    } on ProcessException catch (e) {
+      job.errors.add("Could not start the generator: ${e.message}");
+      job.state = InvoiceJobState.failed;
+      _finish(job);
+      return;
+    }
+    job._process = process;
+    if (job.state == InvoiceJobState.cancelled) {
+      process.kill(ProcessSignal.sigterm);
+    }
 
-    var result = await Process.run("/usr/bin/python3", arguments);
+    // The messages of the generator are only shown if it fails without a json result
+    List<String> messages = [];
+    Future<void> stderrDone = process.stderr
+        .transform(utf8.decoder)
+        .transform(const LineSplitter())
+        .forEach((line) {
+      messages.add(line);
+      if (messages.length > 20) {
+        messages.removeAt(0);
+      }
+    });
+    await process.stdout
+        .transform(utf8.decoder)
+        .transform(const LineSplitter())
+        .forEach((line) => _handleProgress(job, line));
+    await stderrDone;
+    int exitCode = await process.exitCode;
+    job._process = null;
 
-    String pathOfPrintedInvoice = "";
-    for (String line in result.stdout.split("\n")) {
-      if (line.startsWith("InvoicePath:")) {
-        pathOfPrintedInvoice = line.replaceAll("InvoicePath:", "").trim();
+    if (job.state != InvoiceJobState.cancelled) {
+      if (exitCode != 0 && job.errors.isEmpty) {
+        job.errors.add(messages.isNotEmpty
+            ? messages.last
+            : "The generator exited with $exitCode");
       }
+      job.state = exitCode == 0 && job.invoicesFailed == 0
+          ? InvoiceJobState.done
+          : InvoiceJobState.failed;
     }
+    _finish(job);
 
-    // print(result.stdout);
-    // print(result.stderr);
+    if (!job.request.containsKey("batch")) {
+      // The service was not running, start it for the next invoice
+      InvoiceService._startGeneratorService();
+    }
+  }
 
-    // Get current month and year
-    var now = DateTime.now();
-    String month = now.month.toString().padLeft(2, "0");
-    String year = now.year.toString();
+  /// One json line of generator-html.py --progress
+  void _handleProgress(InvoiceJob job, String line) {
+    if (!line.startsWith("{")) {
+      return;
+    }
+    Map<String, dynamic> event;
+    try {
+      event = jsonDecode(line);
+    } on FormatException {
+      return;
+    }
+    switch (event["type"]) {
+      case "start":
+        job.invoiceCount = event["count"];
+        break;
+      case "stage":
+        job.stage = event["stage"];
+        break;
+      case "invoice":
+        _handleInvoiceRecord(job, event);
+        break;
+      case "progress":
+        job.invoicesDone = event["done"];
+        job.invoicesFailed = event["failed"];
+        if (event["eta"] != null) {
+          job.eta = Duration(milliseconds: (event["eta"] * 1000).round());
+        }
+        break;
+    }
+    _estimate(job);
+    notifyListeners();
+  }
 
-    if (preview) {
-      Process.run("xdg-open", ["${getCacheDirectory()}/Rechnung.pdf"]);
-    } else {
-      if (opendInvoiceFolder == false) {
-        opendInvoiceFolder = true;
-        Process.run("xdg-open", ["${getInvoicesDirectory()}/$year/$month/"]);
+  /// The result of one invoice, from the service or a "invoice" line of --progress
+  void _handleInvoiceRecord(InvoiceJob job, Map<String, dynamic> record) {
+    if (record["ok"] == true) {
+      print("Generator timings: ${record["timings"]}");
+      if ((record["invoicePath"] ?? "") != "") {
+        job.invoicePaths.add(record["invoicePath"]);
       }
-      if (pathOfPrintedInvoice != "") {
-        Process.run("xdg-open", [pathOfPrintedInvoice]);
-      }
-      clearInvoiceElements();
+    } else {
+      print("Generator error: ${record["error"]}");
+      job.errors.add(record["row"] != null
+          ? "Zeile ${record["row"]}: ${record["error"]}"
+          : "${record["error"]}");
+      job.invoicesFailed++;
+    }
+  }
+
+  /// Until the generator reports an eta itself (after the first invoice of the job), the eta
+  /// comes from the time the invoices of the jobs before took
+  void _estimate(InvoiceJob job) {
+    if (job.invoicesDone > 0 || _measuredJobs == 0 || job.startTime == null) {
+      return;
+    }
+    double elapsed =
+        DateTime.now().difference(job.startTime!).inMilliseconds / 1000;
+    double seconds =
+        _averageInvoiceSeconds * (job.invoiceCount ?? 1) - elapsed;
+    job.eta = Duration(milliseconds: (max(0, seconds) * 1000).round());
+  }
+
+  void _finish(InvoiceJob job) {
+    if (job.state == InvoiceJobState.done && job.invoicesDone > 0) {
+      double seconds =
+          DateTime.now().difference(job.startTime!).inMilliseconds / 1000;
+      _measuredJobs++;
+      _averageInvoiceSeconds += (seconds / job.invoicesDone -
+              _averageInvoiceSeconds) /
+          _measuredJobs;
+    }
+    if (job.isFinished) {
+      job.eta = Duration.zero;
+    }
+    if (!job._finished.isCompleted) {
+      job._finished.complete(job);
     }
+    notifyListeners();
+    _startJobs();
   }
 }
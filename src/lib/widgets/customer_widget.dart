@@ -103,10 +103,10 @@ class CustomerWidget extends StatelessWidget {
                 children: [
                   MintYSelectionDialogWithFilter(
                     selectionCallback: (string) {
-                      Customer customer = CustomerService.customers.firstWhere(
-                          (element) =>
-                              "${element.name}, ${element.city}, ${element.companyName}" ==
-                              string);
+                      Customer? customer = CustomerService.found[string];
+                      if (customer == null) {
+                        return;
+                      }
                       InvoiceService.currentCompanyName = customer.companyName;
                       InvoiceService.currentContactPerson = customer.name;
                       InvoiceService.currentCustomerStreet = customer.street;
@@ -119,19 +119,14 @@ class CustomerWidget extends StatelessWidget {
                       customerCityController.text = customer.city;
                     },
                     deleteCallback: (string) {
-                      Customer customer = CustomerService.customers.firstWhere(
-                          (element) =>
-                              "${element.name}, ${element.city}, ${element.companyName}" ==
-                              string);
-                      CustomerService.customers.remove(customer);
-                      CustomerService.save();
+                      Customer? customer = CustomerService.found[string];
+                      if (customer != null) {
+                        CustomerService.delete(customer).catchError(
+                            (e) => print("Could not delete the customer: $e"));
+                      }
                     },
-                    items: List.generate(CustomerService.customers.length,
-                        (index) {
-                      // generate string from customer.companyName and customer.name and city
-                      Customer customer = CustomerService.customers[index];
-                      return "${customer.name}, ${customer.city}, ${customer.companyName}";
-                    }),
+                    // Prefix search by company, name or zip code
+                    search: CustomerService.searchLabels,
                     buttonText: "Kunde auswählen",
                   ),
                   SizedBox(
@@ -161,8 +156,8 @@ class CustomerWidget extends StatelessWidget {
                         zip: InvoiceService.currentCustomerZip,
                         city: InvoiceService.currentCustomerCity,
                       );
-                      CustomerService.customers.add(customer);
-                      CustomerService.save();
+                      CustomerService.add(customer).catchError(
+                          (e) => print("Could not save the customer: $e"));
                     },
                   ),
                 ],
@@ -0,0 +1,102 @@
+import 'package:flutter/material.dart';
+import 'package:invoice/services/invoice_service.dart';
+import 'package:invoice/widgets/mint_y.dart';
+
+/// The invoices that are generated in the background (InvoiceService.jobQueue): stage,
+/// progress and the time left of every job, running jobs can be cancelled.
+class InvoiceJobsWidget extends StatelessWidget {
+  const InvoiceJobsWidget({super.key});
+
+  static const Map<InvoiceJobState, String> stateTexts = {
+    InvoiceJobState.queued: "Wartet",
+    InvoiceJobState.running: "Wird erstellt",
+    InvoiceJobState.done: "Fertig",
+    InvoiceJobState.failed: "Fehler",
+    InvoiceJobState.cancelled: "Abgebrochen",
+  };
+
+  @override
+  Widget build(BuildContext context) {
+    InvoiceJobQueue queue = InvoiceService.jobQueue;
+    return AnimatedBuilder(
+        animation: queue,
+        builder: (context, child) {
+          if (queue.jobs.isEmpty) {
+            return Container();
+          }
+          return Padding(
+            padding: const EdgeInsets.all(8.0),
+            child: Column(
+              crossAxisAlignment: CrossAxisAlignment.start,
+              children: [
+                Row(
+                  mainAxisAlignment: MainAxisAlignment.spaceBetween,
+                  children: [
+                    Text("Rechnungen in Arbeit", style: MintY.heading4),
+                    TextButton(
+                      onPressed: queue.removeFinished,
+                      child: const Text("Fertige ausblenden"),
+                    ),
+                  ],
+                ),
+                for (InvoiceJob job in queue.jobs) _buildJob(queue, job),
+              ],
+            ),
+          );
+        });
+  }
+
+  Widget _buildJob(InvoiceJobQueue queue, InvoiceJob job) {
+    String text = stateTexts[job.state]!;
+    if (job.state == InvoiceJobState.running) {
+      int? count = job.invoiceCount;
+      if (count != null && count > 1) {
+        text += " (${job.invoicesDone} von $count)";
+      }
+      if (job.stage != "") {
+        text += ", Schritt: ${job.stage}";
+      }
+      Duration? eta = job.eta;
+      if (eta != null) {
+        text += ", noch ca. ${eta.inSeconds + 1} s";
+      }
+    } else if (job.errors.isNotEmpty) {
+      text += ": ${job.errors.first}";
+    }
+
+    return Padding(
+      padding: const EdgeInsets.all(2.0),
+      child: Container(
+        decoration: BoxDecoration(
+          borderRadius: BorderRadius.circular(10),
+          color: Colors.grey[200],
+        ),
+        padding: const EdgeInsets.symmetric(horizontal: 10.0),
+        height: 50,
+        child: Row(
+          children: [
+            SizedBox(
+              width: 200,
+              child: Text(job.description, overflow: TextOverflow.ellipsis),
+            ),
+            SizedBox(
+              width: 150,
+              child: job.state == InvoiceJobState.running
+                  ? LinearProgressIndicator(
+                      value: job.fraction, color: MintY.currentColor)
+                  : Container(),
+            ),
+            const SizedBox(width: 10),
+            Expanded(child: Text(text, overflow: TextOverflow.ellipsis)),
+            if (job.canCancel)
+              IconButton(
+                tooltip: "Abbrechen",
+                icon: const Icon(Icons.close),
+                onPressed: () => queue.cancel(job),
+              ),
+          ],
+        ),
+      ),
+    );
+  }
+}
@@ -3,6 +3,9 @@ import 'package:flutter/material.dart';
 
 typedef StringCallback = void Function(String);
 
+/// Returns the items matching the search text
+typedef SearchCallback = Future<List<String>> Function(String);
+
 class MintY {
   static Color currentColor = Color(0xff09928b);
 
@@ -1013,18 +1016,22 @@ class MintYTextField extends StatelessWidget {
 }
 
 /// Its a button which pop ups a dialog with a list of items and search function
+/// Shows items (filtered in the dialog) or, with search, the items search returns for the
+/// text that is entered
 class MintYSelectionDialogWithFilter extends StatelessWidget {
   String buttonText = "";
   List<String> items;
+  SearchCallback? search;
   StringCallback selectionCallback;
   StringCallback? deleteCallback;
   MintYSelectionDialogWithFilter(
       {super.key,
       this.buttonText = "",
-      required this.items,
+      this.items = const [],
+      this.search,
       required this.selectionCallback,
       this.deleteCallback}) {
-    items.sort((a, b) => a.compareTo(b));
+    items = [...items]..sort((a, b) => a.compareTo(b));
   }
 
   @override
@@ -1040,6 +1047,7 @@ class MintYSelectionDialogWithFilter extends StatelessWidget {
           builder: (context) {
             return _MintYSelectionDialogWithSearch(
               items: items,
+              search: search,
               selectionCallback: selectionCallback,
               deleteCallback: deleteCallback,
             );
@@ -1053,10 +1061,12 @@ class MintYSelectionDialogWithFilter extends StatelessWidget {
 
 class _MintYSelectionDialogWithSearch extends StatefulWidget {
   List<String> items;
+  SearchCallback? search;
   StringCallback selectionCallback;
   StringCallback? deleteCallback;
   _MintYSelectionDialogWithSearch(
       {required this.items,
+      this.search,
       required this.selectionCallback,
       this.deleteCallback});
 
@@ -1073,6 +1083,34 @@ class __MintYSelectionDialogWithSearchState
 
   String searchTerm = "";
 
+  /// Number of the last search, the answers of older ones are dropped
+  int _searchNumber = 0;
+
+  @override
+  void initState() {
+    super.initState();
+    if (widget.search != null) {
+      _search();
+    }
+  }
+
+  Future<void> _search() async {
+    int searchNumber = ++_searchNumber;
+    List<String> items;
+    try {
+      items = await widget.search!(searchTerm);
+    } catch (e) {
+      print("Search failed: $e");
+      items = [];
+    }
+    if (!mounted || searchNumber != _searchNumber) {
+      return;
+    }
+    setState(() {
+      filteredItems = items;
+    });
+  }
+
   // ListViewCOntroller
   void filter() {
     if (searchTerm.trim() == "") {
@@ -1089,7 +1127,9 @@ class __MintYSelectionDialogWithSearchState
 
   @override
   Widget build(BuildContext context) {
-    filter();
+    if (widget.search == null) {
+      filter();
+    }
 
     return AlertDialog(
       title: Text(
@@ -1107,6 +1147,9 @@ class __MintYSelectionDialogWithSearchState
                   setState(() {
                     searchTerm = value;
                   });
+                  if (widget.search != null) {
+                    _search();
+                  }
                 },
                 focus: true,
               ),
@@ -1129,9 +1172,14 @@ class __MintYSelectionDialogWithSearchState
                           ),
                           color: Colors.red,
                           onPressed: () {
-                            widget.deleteCallback!.call(filteredItems[index]);
-                            widget.items.remove(filteredItems[index]);
-                            setState(() {});
+                            String item = filteredItems[index];
+                            widget.deleteCallback!.call(item);
+                            widget.items.remove(item);
+                            setState(() {
+                              if (widget.search != null) {
+                                filteredItems.remove(item);
+                              }
+                            });
                           },
                         )
                       : null,
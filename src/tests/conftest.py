@@ -0,0 +1,52 @@
+# The tests run against a temporary home: config, cache and invoice dir
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+src_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, src_dir)
+
+
+@pytest.fixture
+def directories(tmp_path):
+    home = str(tmp_path)
+    directories = {
+        "home": home,
+        "cache_dir": f"{home}/.cache/rechnungs-assistent/",
+        "config_dir": f"{home}/.config/rechnungs-assistent/",
+        "current_dir": src_dir,
+    }
+    os.makedirs(directories["cache_dir"])
+    os.makedirs(directories["config_dir"])
+    shutil.copyfile(f"{src_dir}/html/template.csv.example", f'{directories["config_dir"]}/template.csv')
+    return directories
+
+
+# The arguments of generator-html.py for an xml-only run in the temporary home
+@pytest.fixture
+def create_args(directories):
+    parser = runpy.run_path(f"{src_dir}/generator-html.py")["create_parser"](directories)
+
+    def create_args(*arguments):
+        return parser.parse_args([
+            "--renderer", "none",
+            "--output", "xml",
+            "--invoiceDir", f'{directories["home"]}/Rechnungen',
+        ] + list(arguments))
+    return create_args
+
+
+# Runs generator-html.py like the app does, in the temporary home and for an xml-only run
+@pytest.fixture
+def run_generator(directories):
+    def run_generator(*arguments):
+        return subprocess.run([sys.executable, f"{src_dir}/generator-html.py",
+            "--renderer", "none",
+            "--output", "xml",
+            "--invoiceDir", f'{directories["home"]}/Rechnungen',
+        ] + list(arguments), env=dict(os.environ, HOME=directories["home"]), capture_output=True)
+    return run_generator
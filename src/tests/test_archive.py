@@ -0,0 +1,53 @@
+import datetime
+
+from generator.archive import open_invoice_archive
+from generator.generate import generate_invoice
+
+
+def generate(create_args, directories, number, customer, article):
+    params = vars(create_args("--invoiceNumber", number, "--customerName", customer, "--article", article))
+    generate_invoice(params, {}, directories)
+    return params["invoiceDir"]
+
+
+def test_revenue_after_an_invoice_is_replaced(create_args, directories):
+    month = datetime.datetime.now().strftime("%Y-%m")
+    invoice_dir = generate(create_args, directories, "R-1", "Anna", "Beratung;100;1;;19")
+    generate(create_args, directories, "R-2", "Bert", "Beratung;50;1;;19")
+    # Saved again under the same number: the old invoice leaves the sums
+    generate(create_args, directories, "R-1", "Carla", "Buch;200;1;;7")
+
+    archive = open_invoice_archive(invoice_dir)
+    try:
+        assert [(invoice["number"], invoice["customer"]) for invoice in archive.search("R-")] == [("R-2", "Bert"), ("R-1", "Carla")]
+        assert archive.get_revenue("month") == [
+            {"month": month, "currency": "EUR", "count": 2, "netto": 25000, "vat": 2350, "brutto": 27350},
+        ]
+        assert [(row["customer"], row["count"], row["brutto"]) for row in archive.get_revenue("customer", month)] == [
+            ("Carla", 1, 21400),
+            ("Bert", 1, 5950),
+        ]
+        assert [(row["rate"], row["count"], row["basis"], row["tax"]) for row in archive.get_revenue("vat", month[:4])] == [
+            ("7.00", 1, 20000, 1400),
+            ("19.00", 1, 5000, 950),
+        ]
+    finally:
+        archive.close()
+
+
+def test_reindex_reads_the_saved_xml_files(create_args, directories):
+    invoice_dir = generate(create_args, directories, "R-1", "Anna", "Beratung;100;1;;19")
+    generate(create_args, directories, "R-2", "Bert", "Buch;20;1;;7")
+    archive = open_invoice_archive(invoice_dir)
+    try:
+        revenue = archive.get_revenue("vat")
+        archive.connection.execute("DELETE FROM invoices")
+        archive.connection.execute("DELETE FROM invoice_vat")
+        archive.connection.execute("DELETE FROM revenue_vat")
+        stats = archive.reindex(invoice_dir)
+        assert (stats["files"], stats["added"], stats["removed"], stats["errors"]) == (2, 2, 0, [])
+        assert archive.get_revenue("vat") == revenue
+        # Nothing changed since
+        assert archive.reindex(invoice_dir)["added"] == 0
+    finally:
+        archive.close()
@@ -0,0 +1,64 @@
+import pytest
+
+from generator.batch import generate_batch_sequential, get_invoice_params, read_batch_manifest
+from generator.util import InvoiceError
+
+
+def test_values_get_the_types_of_the_command_line(create_args):
+    defaults = vars(create_args())
+    params = get_invoice_params(defaults, {
+        "customerZIP": 12345,
+        "invoiceNumber": None,
+        "dryRun": "false",
+        "article": "Artikel;10;1;",
+        "articleId": [3, "4;2"],
+    })
+    assert params["customerZIP"] == "12345"
+    assert params["invoiceNumber"] == defaults["invoiceNumber"]
+    assert params["dryRun"] == False
+    assert params["article"] == ["Artikel;10;1;"]
+    assert params["articleId"] == ["3", "4;2"]
+    assert get_invoice_params(defaults, {"dryRun": "ja"})["dryRun"] == True
+
+    with pytest.raises(InvoiceError):
+        get_invoice_params(defaults, {"dryRun": "maybe"})
+    with pytest.raises(InvoiceError):
+        get_invoice_params(defaults, {"customerName": {"first": "Max"}})
+    with pytest.raises(InvoiceError):
+        get_invoice_params(defaults, {"article": [["Artikel"]]})
+
+
+def test_csv_columns_can_be_repeated(tmp_path):
+    manifest = tmp_path / "batch.csv"
+    manifest.write_text("customerName,article,article,discount,discount,dryRun\nMax,A;1;1;,B;2;1;,Rabatt;1,Skonto;2,false\n")
+    assert list(read_batch_manifest(str(manifest))) == [{
+        "customerName": "Max",
+        "article": ["A;1;1;", "B;2;1;"],
+        "discount": ["Rabatt;1", "Skonto;2"],
+        "dryRun": "false",
+    }]
+
+
+def test_bad_rows_fail_alone(create_args, directories, tmp_path):
+    manifest = tmp_path / "batch.jsonl"
+    manifest.write_text("\n".join([
+        '{"customerName": "Max", "customerZIP": 12345, "article": "Artikel;10;1;"}',
+        '{"customerName": "Eva", "article": "Artikel;10;1;", "dryRun": "maybe"}',
+        "no json",
+        "[1, 2]",
+        '{"customerName": "Tom", "article": "Artikel;10;1;", "dryRun": false}',
+    ]) + "\n")
+    results = list(generate_batch_sequential(create_args("--batch", str(manifest)), {}, directories))
+    assert sorted(row_number for row_number, result, error in results if error == None) == [1, 5]
+    errors = {row_number: error for row_number, result, error in results if error != None}
+    assert errors[2] == 'Wrong format for dryRun: "maybe". Use true or false'
+    assert errors[3].startswith("Invalid json")
+    assert errors[4].startswith("Wrong format of the row")
+
+
+def test_jobs_must_be_at_least_one(create_args, run_generator):
+    assert create_args("--jobs", "4").jobs == 4
+    for jobs in ("0", "-1", "zwei"):
+        process = run_generator("--batch", "batch.csv", "--jobs", jobs)
+        assert process.returncode == 2
+        assert f'argument --jobs: "{jobs}" is not a whole number of at least 1'.encode() in process.stderr
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from generator.data import DataStore, resolve_data_ids
+from generator.util import InvoiceError
+
+
+def read_csv(data_dir, table):
+    with open(f"{data_dir}/{table}.csv", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def store(tmp_path):
+    data_dir = str(tmp_path / "data")
+    os.makedirs(data_dir)
+    with open(f"{data_dir}/customers.csv", "w", encoding="utf-8") as f:
+        f.write("companyName;name;street;zip;city;country\nACME;Max;Weg 1;12345;Berlin;DE\nacme west;Eva;Weg 2;54321;Bonn;DE\nBeta;Tom;Weg 3;12999;Köln;DE")
+    store = DataStore(data_dir)
+    yield store
+    store.close()
+
+
+def test_prefix_search_and_lookup_by_id(store):
+    assert [customer["name"] for customer in store.search("customers", "acme")] == ["Max", "Eva"]
+    # The zip code is searched too, % and _ are no wildcards
+    assert [customer["name"] for customer in store.search("customers", "12")] == ["Max", "Tom"]
+    assert store.search("customers", "%") == []
+    assert len(store.search("customers", "", limit=2)) == 2
+    customer = store.search("customers", "Beta")[0]
+    assert store.get("customers", customer["id"]) == customer
+    assert store.get("customers", 999) == None
+
+
+def test_added_rows_are_appended_to_the_csv(store):
+    before = read_csv(store.data_dir, "customers")
+    customer_id = store.add("customers", {"companyName": "Gamma; GmbH", "name": "Ina", "city": "Ulm\nSüd"})
+    # The last line of the file had no line break
+    assert read_csv(store.data_dir, "customers") == before + "\nGamma, GmbH;Ina;;;Ulm<br>Süd;\n"
+    assert store.get("customers", customer_id)["companyName"] == "Gamma, GmbH"
+    # What the store wrote itself is not imported again
+    assert store.import_csv_if_changed("customers") == None
+
+    article_id = store.add("articles", {"description": "Beratung", "pricePerUnit": "90"})
+    assert read_csv(store.data_dir, "articles") == "description;pricePerUnit;amount;summary\nBeratung;90;;\n"
+    assert store.get("articles", article_id)["pricePerUnit"] == "90"
+
+
+def test_deleted_rows_leave_the_csv(store):
+    ids = {customer["name"]: customer["id"] for customer in store.search("customers", "")}
+    store.delete("customers", ids["Eva"])
+    assert read_csv(store.data_dir, "customers") == "companyName;name;street;zip;city;country\nACME;Max;Weg 1;12345;Berlin;DE\nBeta;Tom;Weg 3;12999;Köln;DE\n"
+    assert store.import_csv_if_changed("customers") == None
+    # The other rows keep their ids
+    assert store.get("customers", ids["Tom"])["name"] == "Tom"
+
+
+def test_ids_are_replaced_by_their_rows(store):
+    customer_id = store.search("customers", "Beta")[0]["id"]
+    article_id = store.add("articles", {"description": "Beratung", "pricePerUnit": "90", "amount": "2", "summary": "Vor Ort"})
+    params = {"invoiceDir": os.path.dirname(store.data_dir), "customerId": str(customer_id), "articleId": [str(article_id), f"{article_id};5"],
+        "article": ["Anfahrt;30;1;"], "customerCompany": None, "customerName": "Anna", "customerStreet": None, "customerZIP": None, "customerCity": None}
+    resolve_data_ids(params)
+    assert (params["customerCompany"], params["customerName"], params["customerCity"]) == ("Beta", "Anna", "Köln")
+    assert params["article"] == ["Anfahrt;30;1;", "Beratung;90;2;Vor Ort", "Beratung;90;5;Vor Ort"]
+
+    with pytest.raises(InvoiceError):
+        resolve_data_ids(dict(params, customerId="999"))
@@ -0,0 +1,81 @@
+import os
+import time
+
+from generator.data import DataStore, DataWatcher
+
+
+def write_customers(data_dir, rows, mode="w"):
+    with open(f"{data_dir}/customers.csv", mode, encoding="utf-8") as f:
+        if mode == "w":
+            f.write("companyName;name;street;zip;city;country\n")
+        for row in rows:
+            f.write(row + "\n")
+
+
+def get_ids(store):
+    return {customer["companyName"]: customer["id"] for customer in store.search("customers", "")}
+
+
+def test_appended_rows_are_added(tmp_path):
+    data_dir = str(tmp_path / "data")
+    os.makedirs(data_dir)
+    write_customers(data_dir, ["ACME;Max;Weg 1;12345;Berlin;DE", "Beta;Eva;Weg 2;54321;Bonn;DE"])
+    store = DataStore(data_dir)
+    try:
+        ids = get_ids(store)
+        assert store.import_csv_if_changed("customers") == None
+
+        write_customers(data_dir, ["Gamma;Tom;Weg 3;11111;Köln;DE"], mode="a")
+        result = store.import_csv_if_changed("customers")
+        assert (result["appended"], result["added"], result["removed"]) == (True, 1, 0)
+        new_ids = get_ids(store)
+        assert {name: new_ids[name] for name in ids} == ids
+        assert store.get("customers", new_ids["Gamma"])["city"] == "Köln"
+    finally:
+        store.close()
+
+
+def test_rewritten_rows_keep_their_ids(tmp_path):
+    data_dir = str(tmp_path / "data")
+    os.makedirs(data_dir)
+    write_customers(data_dir, ["ACME;Max;Weg 1;12345;Berlin;DE", "Beta;Eva;Weg 2;54321;Bonn;DE", "Gamma;Tom;Weg 3;11111;Köln;DE"])
+    store = DataStore(data_dir)
+    try:
+        ids = get_ids(store)
+        # ACME is removed and Beta moved, the rows are no longer just appended
+        write_customers(data_dir, ["Gamma;Tom;Weg 3;11111;Köln;DE", "Beta;Eva;Neuer Weg 9;54321;Bonn;DE"])
+        result = store.import_csv_if_changed("customers")
+        assert (result["appended"], result["added"], result["removed"]) == (False, 1, 2)
+        new_ids = get_ids(store)
+        assert sorted(new_ids) == ["Beta", "Gamma"]
+        assert new_ids["Gamma"] == ids["Gamma"]
+        assert store.get("customers", ids["ACME"]) == None
+        assert store.get("customers", new_ids["Beta"])["street"] == "Neuer Weg 9"
+    finally:
+        store.close()
+
+
+def test_watcher_imports_written_files(tmp_path):
+    data_dir = str(tmp_path / "data")
+    watcher = DataWatcher(data_dir)
+    watcher.start()
+    try:
+        # Written next to it and moved in, like the app and most tools do
+        with open(f"{data_dir}/customers.csv.tmp", "w", encoding="utf-8") as f:
+            f.write("companyName;name;street;zip;city;country\nACME;Max;Weg 1;12345;Berlin;DE\n")
+        os.replace(f"{data_dir}/customers.csv.tmp", f"{data_dir}/customers.csv")
+        deadline = time.monotonic() + 10
+        while watcher.get_status()["customers"]["imports"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        status = watcher.get_status()
+        assert status["customers"]["imports"] == 1
+        assert status["customers"]["lastImport"]["added"] == 1
+    finally:
+        watcher.stop()
+
+    store = DataStore(data_dir)
+    try:
+        assert store.imports == []
+        assert [customer["name"] for customer in store.search("customers", "")] == ["Max"]
+    finally:
+        store.close()
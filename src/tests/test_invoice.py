@@ -0,0 +1,61 @@
+import decimal
+
+import pytest
+
+from generator.invoice import Invoice, round_money, round_price
+from generator.template import Template
+from generator.util import InvoiceError
+from generator.zugferd import format_amount, format_price
+
+
+def create_invoice(create_args, *arguments, default_vat="19"):
+    return Invoice(vars(create_args(*arguments)), Template([f"DEFAULT-VAT;{default_vat}"]))
+
+
+def test_money_is_rounded_half_up():
+    # As floats 0.015 and 2.675 are a little less and would round down
+    assert round_money("0.005") == decimal.Decimal("0.01")
+    assert round_money(0.015) == decimal.Decimal("0.02")
+    assert round_money(2.675) == decimal.Decimal("2.68")
+    assert round_money("-0.005") == decimal.Decimal("-0.01")
+    assert format_amount(10) == "10.00"
+
+
+def test_prices_keep_their_precision():
+    assert format_price("0.0042") == "0.0042"
+    assert format_price("10") == "10.00"
+    assert format_price("1.50000") == "1.50"
+    assert round_price("1E+2") == decimal.Decimal("100.00")
+
+
+def test_line_totals_are_rounded_once(create_args):
+    invoice = create_invoice(create_args, "--article", "Kleinteil;0.0042;10000;", "Stunde;0.333;3;")
+    assert [line.total for line in invoice.lines] == [decimal.Decimal("42.00"), decimal.Decimal("1.00")]
+    assert invoice.sum_netto == decimal.Decimal("43.00")
+
+
+def test_tax_is_calculated_per_rate(create_args):
+    # Per line the tax of 0.01 would round to 0.00 ten times, on the sum of the rate it is 0.02
+    articles = ["Schraube;0.01;1;;19"] * 10 + ["Buch;10.05;1;;7"]
+    invoice = create_invoice(create_args, "--article", *articles)
+    assert [(group.vat, group.basis, group.tax) for group in invoice.vat_groups] == [
+        (decimal.Decimal("7"), decimal.Decimal("10.05"), decimal.Decimal("0.70")),
+        (decimal.Decimal("19"), decimal.Decimal("0.10"), decimal.Decimal("0.02")),
+    ]
+    assert invoice.vat_sum == decimal.Decimal("0.72")
+    assert invoice.sum_brutto == decimal.Decimal("10.87")
+
+
+def test_discounts_lower_the_basis_of_their_rate(create_args):
+    invoice = create_invoice(create_args, "--article", "Beratung;100;1;", "Buch;20;1;;7", "--discount", "Rabatt;10", "Buchrabatt;5;7")
+    assert [(group.vat, group.basis, group.tax) for group in invoice.vat_groups] == [
+        (decimal.Decimal("7"), decimal.Decimal("15"), decimal.Decimal("1.05")),
+        (decimal.Decimal("19"), decimal.Decimal("90"), decimal.Decimal("17.10")),
+    ]
+    assert invoice.sum_brutto == decimal.Decimal("123.15")
+
+
+def test_a_wrong_default_vat_names_the_template_key(create_args):
+    for default_vat in ("", "neunzehn"):
+        with pytest.raises(InvoiceError, match="DEFAULT-VAT"):
+            create_invoice(create_args, "--article", "Beratung;100;1;", default_vat=default_vat)
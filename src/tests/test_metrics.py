@@ -0,0 +1,49 @@
+import json
+
+from generator.metrics import StageStatistics, get_percentile, stage_names
+
+
+def read_records(metrics_path):
+    with open(metrics_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_one_record_per_invoice(run_generator, tmp_path):
+    metrics_path = str(tmp_path / "metrics.jsonl")
+    assert run_generator("--metrics", metrics_path, "--invoiceNumber", "R-1", "--customerName", "Max", "--article", "Beratung;100;1;").returncode == 0
+    assert run_generator("--metrics", metrics_path, "--paymentDays", "bald", "--customerName", "Max", "--article", "Beratung;100;1;").returncode == 1
+
+    record, failed = read_records(metrics_path)
+    assert (record["type"], record["ok"], record["invoiceNumber"], record["sumWithoutVat"]) == ("invoice", True, "R-1", 100.0)
+    assert "documents" not in record
+    timings = record["timings"]
+    # The stages in the order they ran, they add up to the total
+    assert [stage for stage in timings if stage not in ("arguments", "total")] == [stage for stage in stage_names if stage in timings and stage != "arguments"]
+    assert {"template", "invoice", "xml", "commit"} <= set(timings)
+    assert abs(sum(seconds for stage, seconds in timings.items() if stage not in ("arguments", "total")) - timings["total"]) < 0.00001
+    assert failed == {"type": "invoice", "ok": False, "error": 'Wrong format for paymentDays: "bald". Use a number of days, e.g. --paymentDays 14'}
+
+
+def test_a_batch_ends_with_its_summary(run_generator, tmp_path):
+    manifest = tmp_path / "batch.jsonl"
+    manifest.write_text("\n".join('{"customerName": "Max", "article": "Beratung;100;1;", "dryRun": %s}' % dry_run for dry_run in ("true", "true", '"maybe"')) + "\n")
+    metrics_path = str(tmp_path / "metrics.jsonl")
+    assert run_generator("--batch", str(manifest), "--metrics", metrics_path).returncode == 1
+
+    records = read_records(metrics_path)
+    # A row that is wrong before it is generated is reported first
+    assert sorted((record["row"], record["ok"]) for record in records[:3]) == [(1, True), (2, True), (3, False)]
+    summary = records[3]
+    assert (summary["type"], summary["count"], summary["failed"]) == ("batch", 3, 1)
+    assert summary["stages"]["total"]["count"] == 2
+    assert set(summary["stages"]["xml"]) == {"count", "sum", "p50", "p90", "p99", "max"}
+
+
+def test_percentiles_are_nearest_rank():
+    values = list(range(1, 101))
+    assert (get_percentile(values, 50), get_percentile(values, 90), get_percentile(values, 99)) == (50, 90, 99)
+    assert get_percentile([7], 99) == 7
+    statistics = StageStatistics()
+    for seconds in (0.3, 0.1, 0.2):
+        statistics.add({"xml": seconds, "total": seconds * 2})
+    assert statistics.get_summary()["xml"] == {"count": 3, "sum": 0.6, "p50": 0.2, "p90": 0.3, "p99": 0.3, "max": 0.3}
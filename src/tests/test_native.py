@@ -0,0 +1,39 @@
+import re
+import zlib
+
+from generator.generate import generate_invoice
+
+
+def generate_pdf(create_args, directories, *arguments):
+    params = vars(create_args("--renderer", "native", "--output", "pdf,xml", "--invoiceNumber", "R-1", "--customerName", "Max", *arguments))
+    result = generate_invoice(params, {}, directories)
+    with open(result["invoicePath"], "rb") as f:
+        pdf = f.read()
+    with open(result["xmlPath"], "rb") as f:
+        return pdf, f.read()
+
+
+def test_the_xref_table_points_at_the_objects(create_args, directories):
+    pdf = generate_pdf(create_args, directories, "--article", *["Beratung;100;1;"] * 60)[0]
+    xref_offset = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+    assert pdf[xref_offset:].startswith(b"xref\n0 ")
+    entries = re.findall(rb"(\d{10}) 00000 n \n", pdf[xref_offset:])
+    size = int(re.search(rb"/Size (\d+)", pdf[xref_offset:]).group(1))
+    assert len(entries) == size - 1
+    for number, offset in enumerate(entries, 1):
+        assert pdf[int(offset):].startswith(b"%d 0 obj\n" % number)
+    # 60 lines don't fit on one page
+    assert int(re.search(rb"/Type/Pages/Kids\[[^\]]*\]/Count (\d+)", pdf).group(1)) > 1
+
+
+def test_the_xml_is_attached(create_args, directories):
+    pdf, xml = generate_pdf(create_args, directories, "--article", "Beratung;100;1;")
+    assert b"/AFRelationship/Alternative" in pdf
+    assert b"/EmbeddedFiles<</Names[(factur-x.xml)" in pdf
+    embedded = re.search(rb"<</Type/EmbeddedFile/Subtype/text#2Fxml/Params<</Size (\d+)[^\n]*/Length (\d+)>>\nstream\n", pdf)
+    data = pdf[embedded.end():embedded.end() + int(embedded.group(2))]
+    assert zlib.decompress(data) == xml
+    assert int(embedded.group(1)) == len(xml)
+    # Without embedded fonts and an output intent the pdf is no PDF/A-3, so it doesn't claim Factur-X
+    assert b"fx:ConformanceLevel" not in pdf
+    assert b"pdfaid:" not in pdf
@@ -0,0 +1,110 @@
+import datetime
+import json
+import os
+import re
+
+from generator.batch import generate_batch_parallel, generate_batch_sequential
+from generator.numbering import allocate_invoice_numbers, commit_invoice_number, get_invoice_dir, release_invoice_numbers
+
+
+def get_prefix():
+    return datetime.datetime.now().strftime("%Y-%m-")
+
+
+# The numbers of the saved invoices, sorted
+def get_saved_numbers(invoice_dir):
+    numbers = []
+    for file in os.listdir(invoice_dir):
+        match = re.match(r"^Rechnung-\d{4}-\d{2}-(\d+)\.xml$", file)
+        if match != None:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def write_manifest(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    return str(path)
+
+
+def test_allocate_and_commit(directories, tmp_path):
+    invoice_dir = str(tmp_path / "invoices")
+    os.makedirs(invoice_dir)
+    prefix = get_prefix()
+    assert allocate_invoice_numbers(directories, invoice_dir, 3) == [prefix + "1", prefix + "2", prefix + "3"]
+    # Handed out numbers are not handed out again, even before they are committed
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [prefix + "4"]
+    # A lookup doesn't use the number up
+    assert allocate_invoice_numbers(directories, invoice_dir, 1, reserve=False) == [prefix + "5"]
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [prefix + "5"]
+    commit_invoice_number(directories, invoice_dir, prefix + "5")
+    with open(f"{invoice_dir}/.invoice-sequence") as f:
+        assert f.read().strip() == "5"
+
+
+def test_release_gives_numbers_back(directories, tmp_path):
+    invoice_dir = str(tmp_path / "invoices")
+    os.makedirs(invoice_dir)
+    prefix = get_prefix()
+    first = allocate_invoice_numbers(directories, invoice_dir, 2)
+    commit_invoice_number(directories, invoice_dir, first[0])
+    # The last numbers handed out: the counter goes back
+    release_invoice_numbers(directories, invoice_dir, first[1:])
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [prefix + "2"]
+
+    # Another generator took a number in the meantime: the released one comes first
+    mine = allocate_invoice_numbers(directories, invoice_dir, 1)
+    other = allocate_invoice_numbers(directories, invoice_dir, 1)
+    assert (mine, other) == ([prefix + "3"], [prefix + "4"])
+    release_invoice_numbers(directories, invoice_dir, mine)
+    assert allocate_invoice_numbers(directories, invoice_dir, 2) == [prefix + "3", prefix + "5"]
+
+    # A number a document was saved under is not given back
+    number = allocate_invoice_numbers(directories, invoice_dir, 1)[0]
+    open(f"{invoice_dir}/Rechnung-{number}.xml", "w").close()
+    release_invoice_numbers(directories, invoice_dir, [number])
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [prefix + "7"]
+
+
+def test_failed_rows_leave_no_gap(directories, create_args, tmp_path):
+    rows = [{"customerName": f"Kunde {i}", "article": "Artikel;10;1;"} for i in range(6)]
+    # Fails before it is numbered
+    rows[1]["paymentDays"] = "x"
+    # Fails while it is generated
+    rows[3]["template"] = str(tmp_path / "missing.csv")
+    args = create_args("--batch", write_manifest(tmp_path / "batch.jsonl", rows))
+    results = list(generate_batch_sequential(args, {}, directories))
+    assert sorted(row_number for row_number, result, error in results if error != None) == [2, 4]
+
+    invoice_dir = get_invoice_dir(vars(args))
+    assert get_saved_numbers(invoice_dir) == [1, 2, 3, 4]
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [get_prefix() + "5"]
+
+
+def test_failed_rows_leave_no_gap_in_parallel(directories, create_args, tmp_path):
+    rows = [{"customerName": f"Kunde {i}", "article": "Artikel;10;1;"} for i in range(6)]
+    rows[2]["paymentDays"] = "x"
+    args = create_args("--batch", write_manifest(tmp_path / "batch.jsonl", rows), "--jobs", "2")
+    results = list(generate_batch_parallel(args, directories, 2))
+    assert [row_number for row_number, result, error in results if error != None] == [3]
+
+    invoice_dir = get_invoice_dir(vars(args))
+    assert get_saved_numbers(invoice_dir) == [1, 2, 3, 4, 5]
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [get_prefix() + "6"]
+
+
+def test_cancelled_batch_leaves_no_gap(directories, create_args, tmp_path):
+    rows = [{"customerName": f"Kunde {i}", "article": "Artikel;10;1;"} for i in range(20)]
+    args = create_args("--batch", write_manifest(tmp_path / "batch.jsonl", rows))
+    results = generate_batch_sequential(args, {}, directories)
+    for i in range(5):
+        next(results)
+    # What run_batch() does when SIGTERM ends it
+    results.close()
+
+    invoice_dir = get_invoice_dir(vars(args))
+    assert get_saved_numbers(invoice_dir) == [1, 2, 3, 4, 5]
+    with open(f"{invoice_dir}/.invoice-sequence") as f:
+        assert f.read().strip() == "5"
+    assert allocate_invoice_numbers(directories, invoice_dir, 1) == [get_prefix() + "6"]
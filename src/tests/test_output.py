@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from generator.generate import get_outputs
+from generator.util import InvoiceError
+
+
+def test_only_the_requested_documents_are_built():
+    assert get_outputs({"output": None, "renderer": "chromium"}) == {"pdf", "xml"}
+    assert get_outputs({"output": " html, xml,html", "renderer": "native"}) == {"html", "xml"}
+    # Without a renderer there is no pdf
+    assert get_outputs({"output": "pdf,xml", "renderer": "none"}) == {"xml"}
+    with pytest.raises(InvoiceError):
+        get_outputs({"output": "pdf", "renderer": "none"})
+    with pytest.raises(InvoiceError):
+        get_outputs({"output": "xml,docx", "renderer": "chromium"})
+
+
+def test_the_document_is_written_to_the_fd(run_generator, directories):
+    process = run_generator("--outputFd", "1", "--invoiceNumber", "R-1", "--customerName", "Max", "--article", "Beratung;100;1;")
+    assert process.returncode == 0
+    assert process.stdout.startswith(b'<?xml version="1.0" encoding="UTF-8"?>\n<rsm:CrossIndustryInvoice')
+    assert b"<ram:ID>R-1</ram:ID>" in process.stdout
+    # The messages went to stderr and nothing was saved
+    assert not os.path.exists(f'{directories["home"]}/Rechnungen/Rechnung-R-1.xml')
+
+
+def test_the_fd_takes_a_single_document(run_generator):
+    process = run_generator("--output", "xml,html", "--outputFd", "1", "--customerName", "Max", "--article", "Beratung;100;1;")
+    assert process.returncode == 1
+    assert process.stdout == b""
+    assert b"Error: --outputFd writes one document, choose it with --output" in process.stderr
+
+    process = run_generator("--outputFd", "stdout", "--customerName", "Max", "--article", "Beratung;100;1;")
+    assert process.returncode == 1
+    assert b'Error: --outputFd is not a file descriptor: "stdout"' in process.stdout
@@ -0,0 +1,69 @@
+import decimal
+
+from generator.invoice import Invoice, create_items_html
+from generator.pagination import CARRY_OUT_HEIGHT, HEADER_HEIGHT, HTML_PAGE_RESERVE, PAGE_HEIGHT, PAGE_MARGIN, ROW_HEIGHT, ItemRow, measure_item_rows, paginate_html_items, paginate_items
+from generator.template import Template
+
+
+class Line:
+    def __init__(self, total):
+        self.total = decimal.Decimal(total)
+
+
+def create_rows(count, lines=1):
+    return [ItemRow(Line(i + 1), [("Artikel", True)] * lines) for i in range(count)]
+
+
+def get_page_ranges(pages):
+    return [(page.start, page.end, page.carry_in, page.carry_out) for page in pages]
+
+
+def test_the_subtotal_is_carried_over():
+    rows = create_rows(14)
+    # Room for the header, the carried over subtotal, five rows and the "Übertrag" row.
+    # The first page has no subtotal to start with and one row more.
+    page_space = HEADER_HEIGHT + ROW_HEIGHT + 5 * rows[0].height + CARRY_OUT_HEIGHT
+    pages = paginate_items(rows, page_space, page_space, 0)
+    # The first page ends with 1+...+6, the next page starts with it
+    assert get_page_ranges(pages) == [(0, 6, None, 21), (6, 11, 21, 66), (11, 14, 66, None)]
+
+    # Everything fits, there is no carry-over
+    assert get_page_ranges(paginate_items(rows, 1000, 1000, 100)) == [(0, 14, None, None)]
+
+
+def test_the_totals_keep_a_row_with_them():
+    rows = create_rows(3)
+    page_space = HEADER_HEIGHT + 3 * rows[0].height + CARRY_OUT_HEIGHT
+    # The rows fit onto the page, the totals below them don't: the last row goes with the totals
+    assert get_page_ranges(paginate_items(rows, page_space, 1000, 5 * ROW_HEIGHT)) == [(0, 2, None, 3), (2, 3, 3, None)]
+    # A single row is not split from the totals
+    assert get_page_ranges(paginate_items(rows[:1], HEADER_HEIGHT + rows[0].height + CARRY_OUT_HEIGHT, 1000, 5 * ROW_HEIGHT)) == [(0, 1, None, None)]
+
+
+def test_rows_that_dont_fit():
+    rows = create_rows(2)
+    # Not even one row fits below the text of the first page, the table starts on the next one
+    assert get_page_ranges(paginate_items(rows, HEADER_HEIGHT, 1000, 0)) == [(0, 0, None, None), (0, 2, None, None)]
+    # A row higher than a page gets a page of its own
+    rows = create_rows(1) + create_rows(1, lines=80) + create_rows(1)
+    page_space = HEADER_HEIGHT + ROW_HEIGHT + 2 * rows[0].height + CARRY_OUT_HEIGHT
+    assert [(page.start, page.end) for page in paginate_items(rows, page_space, page_space, 0)] == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_html_pages_leave_the_reserve_free(create_args):
+    template = Template(["DEFAULT-VAT;19"])
+    invoice = Invoice(vars(create_args("--article", *[f"Artikel {i};10;1;" for i in range(100)])), template)
+    pages = paginate_html_items({}, invoice)
+    assert len(pages) > 2
+    rows = measure_item_rows(invoice)
+    page_space = PAGE_HEIGHT - 2 * PAGE_MARGIN - HTML_PAGE_RESERVE
+    for page in pages[1:-1]:
+        used = HEADER_HEIGHT + ROW_HEIGHT + sum(row.height for row in rows[page.start:page.end]) + CARRY_OUT_HEIGHT
+        assert used <= page_space
+        # One more row would have used the reserve
+        assert used + rows[page.end].height > page_space
+
+    html = create_items_html(invoice, template, pages)
+    assert html.count('<tr class="carry-over"><td colspan="3">Übertrag</td>') == len(pages) - 1
+    assert html.count('<tr class="carried-over"><td colspan="3">Übertrag</td>') == len(pages) - 1
+    assert html.count('<div class="page">') == len(pages) - 1
@@ -0,0 +1,43 @@
+import json
+
+from generator.metrics import stage_names
+
+
+def read_events(process):
+    return [json.loads(line) for line in process.stdout.decode().splitlines()]
+
+
+def test_the_progress_of_one_invoice(run_generator):
+    process = run_generator("--progress", "--invoiceNumber", "R-1", "--customerName", "Max", "--article", "Beratung;100;1;")
+    assert process.returncode == 0
+    # Only the events are on stdout, the messages went to stderr
+    events = read_events(process)
+    assert events[0] == {"type": "start", "count": 1}
+    stages = [event["stage"] for event in events if event["type"] == "stage"]
+    assert stages == [stage for stage in stage_names if stage in stages]
+    assert {event["invoice"] for event in events if event["type"] == "stage"} == {1}
+    invoice, progress = events[-2:]
+    assert (invoice["type"], invoice["ok"], invoice["invoiceNumber"]) == ("invoice", True, "R-1")
+    assert (progress["type"], progress["done"], progress["failed"], progress["count"], progress["eta"]) == ("progress", 1, 0, 1, 0)
+    assert b"Rechnung-R-1.xml" in process.stderr
+
+
+def test_the_progress_of_a_batch(run_generator, tmp_path):
+    manifest = tmp_path / "batch.jsonl"
+    manifest.write_text('{"customerName": "Max", "article": "Beratung;100;1;", "dryRun": true}\n' * 2 + '{"customerName": "Eva", "paymentDays": "bald"}\n')
+    process = run_generator("--batch", str(manifest), "--progress")
+    assert process.returncode == 1
+    events = read_events(process)
+    assert events[0] == {"type": "start", "count": 3}
+    done = [event for event in events if event["type"] == "progress"]
+    assert [(event["done"], event["count"]) for event in done] == [(1, 3), (2, 3), (3, 3)]
+    assert done[-1]["failed"] == 1
+    assert done[-1]["eta"] == 0
+    failed = [event for event in events if event["type"] == "invoice" and not event["ok"]]
+    assert [(event["row"], event["error"]) for event in failed] == [(3, 'Wrong format for paymentDays: "bald". Use a number of days, e.g. --paymentDays 14')]
+
+
+def test_the_progress_needs_stdout(run_generator):
+    process = run_generator("--progress", "--outputFd", "1", "--customerName", "Max", "--article", "Beratung;100;1;")
+    assert process.returncode == 1
+    assert b"Error: --progress writes to stdout, use another --outputFd" in process.stderr
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from generator.generate import create_html_values
+from generator.invoice import Invoice
+from generator.template import Template, compile_template, load_template, render_template
+from generator.util import InvoiceError
+
+
+def render(text, values):
+    return render_template(compile_template(text), values)
+
+
+def test_placeholders_are_filled_in_one_pass():
+    # A longer key is no prefix collision, a value is not searched for placeholders again
+    assert render("#!SEN-NAME / #!SEN-NAME-2\n", {"SEN-NAME": "#!SEN-NAME-2", "SEN-NAME-2": "Zweit"}) == ("#!SEN-NAME-2 / Zweit\n", [])
+    # A - that is not followed by a letter or digit ends the key
+    assert render("#!DATE- bis #!DATE-\n", {"DATE": "1.1.", "DATE-": "nie"}) == ("1.1.- bis 1.1.-\n", [])
+    assert render("#!A#!B", {"A": "1", "B": "2"}) == ("12", [])
+
+
+def test_lines_without_a_value_are_left_out():
+    text = "Kopf\n<p>#!CUSTOMER-COMPANY</p>\n<p>#!CUSTOMER-NAME #!MISSING</p>\nFuß\n"
+    html, unresolved_keys = render(text, {"CUSTOMER-COMPANY": None, "CUSTOMER-NAME": "Max"})
+    assert html == "Kopf\nFuß\n"
+    # None is an empty value on purpose, only keys without any value are reported
+    assert unresolved_keys == ["MISSING"]
+
+
+def test_the_compiled_template_is_reused():
+    text = "<p>#!INVOICE-NUM</p>\n"
+    assert compile_template(text) is compile_template(text)
+    compiled = compile_template(text)
+    assert render_template(compiled, {"INVOICE-NUM": "R-1"})[0] == "<p>R-1</p>\n"
+    assert render_template(compiled, {"INVOICE-NUM": "R-2"})[0] == "<p>R-2</p>\n"
+
+
+def test_template_values_can_contain_placeholders(create_args):
+    params = vars(create_args("--invoiceNumber", "R-7", "--customerName", "Max", "--article", "Beratung;100;1;"))
+    template = Template(["DEFAULT-VAT;19", "MESSAGE;Rechnung #!INVOICE-NUM für #!REC-NAME"])
+    values = create_html_values(params, template, Invoice(params, template))
+    assert values["MESSAGE"] == "Rechnung R-7 für Max"
+    assert values["REC-COMPANY"] == None
+
+
+def test_templates_are_parsed_again_when_the_file_changes(tmp_path):
+    template_path = str(tmp_path / "template.csv")
+    with open(template_path, "w", encoding="utf-8") as f:
+        f.write("MESSAGE;Zahlbar; sofort\r\nCURRENCY;€\nMESSAGE;nicht diese\n")
+    template = load_template(template_path)
+    # Only the first ; separates the value, the first of a repeated key counts
+    assert template.get("MESSAGE") == "Zahlbar; sofort"
+    assert template.currency == "€"
+    assert load_template(template_path) is template
+
+    mtime_ns = os.stat(template_path).st_mtime_ns
+    with open(template_path, "w", encoding="utf-8") as f:
+        f.write("MESSAGE;Danke\nCURRENCY;EUR\n")
+    # Written within the same mtime on a coarse file system, the size still differs
+    os.utime(template_path, ns=(mtime_ns, mtime_ns))
+    changed = load_template(template_path)
+    assert changed is not template
+    assert (changed.get("MESSAGE"), changed.currency) == ("Danke", "EUR")
+
+    with pytest.raises(InvoiceError):
+        load_template(str(tmp_path / "missing.csv"))
@@ -0,0 +1,49 @@
+import io
+import xml.etree.ElementTree
+
+from generator.invoice import Invoice
+from generator.template import Template
+from generator.zugferd import escape_xml, write_invoice_xml
+
+
+ram = "{urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100}"
+
+
+def create_xml(create_args, template_lines, *arguments):
+    template = Template(["DEFAULT-VAT;19"] + template_lines)
+    f = io.StringIO()
+    write_invoice_xml(Invoice(vars(create_args("--invoiceNumber", "R-1", *arguments)), template), template, f)
+    return xml.etree.ElementTree.fromstring(f.getvalue())
+
+
+def test_one_trade_tax_per_rate(create_args):
+    root = create_xml(create_args, [], "--article", "Beratung;100;1;", "Buch;10.05;2;;7", "Stift;1;1;;19", "--discount", "Buchrabatt;1.10;7")
+    settlement = root.find(f".//{ram}ApplicableHeaderTradeSettlement")
+    taxes = [(tax.findtext(f"{ram}RateApplicablePercent"), tax.findtext(f"{ram}BasisAmount"), tax.findtext(f"{ram}CalculatedAmount"))
+        for tax in settlement.findall(f"{ram}ApplicableTradeTax")]
+    assert taxes == [("7.00", "19.00", "1.33"), ("19.00", "101.00", "19.19")]
+    summation = settlement.find(f"{ram}SpecifiedTradeSettlementHeaderMonetarySummation")
+    assert summation.findtext(f"{ram}TaxBasisTotalAmount") == "120.00"
+    assert summation.findtext(f"{ram}TaxTotalAmount") == "20.52"
+    assert summation.findtext(f"{ram}GrandTotalAmount") == "140.52"
+    # Every line has the rate it is taxed with
+    line_rates = [item.findtext(f".//{ram}SpecifiedLineTradeSettlement/{ram}ApplicableTradeTax/{ram}RateApplicablePercent")
+        for item in root.iter(f"{ram}IncludedSupplyChainTradeLineItem")]
+    assert line_rates == ["19.00", "7.00", "19.00", "7.00"]
+
+
+def test_unit_prices_keep_their_precision(create_args):
+    root = create_xml(create_args, [], "--article", "Kleinteil;0.0042;10000;", "Stunde;90;1.5;")
+    items = list(root.iter(f"{ram}IncludedSupplyChainTradeLineItem"))
+    assert [item.findtext(f".//{ram}NetPriceProductTradePrice/{ram}ChargeAmount") for item in items] == ["0.0042", "90.00"]
+    assert [item.findtext(f".//{ram}LineTotalAmount") for item in items] == ["42.00", "135.00"]
+
+
+def test_texts_are_escaped(create_args):
+    assert escape_xml('A & B <"C">') == "A &amp; B &lt;&quot;C&quot;&gt;"
+    root = create_xml(create_args, ["SEN-COMPANY;Müller & Söhne", "MESSAGE;Rechnung <#!INVOICE-NUM>"],
+        "--customerCompany", "A&B", "--customerName", "<Max>", "--article", 'Kabel "3m" & Stecker;5;1;')
+    assert root.find(f".//{ram}SellerTradeParty/{ram}Name").text == "Müller & Söhne"
+    assert root.find(f".//{ram}BuyerTradeParty/{ram}Name").text == "A&B <Max>"
+    assert root.find(f".//{ram}SpecifiedTradeProduct/{ram}Name").text == 'Kabel "3m" & Stecker'
+    assert root.find(f".//{ram}IncludedNote/{ram}Content").text == "Rechnung <R-1>"